@@ -0,0 +1,141 @@
+"""
+云盘批量操作基准测试
+对比旧的文件夹重命名（逐条加载 UserFile/UserFolder 记录在 Python 中改写路径）与按路径前缀一次性改写的
+move_folder，以及逐个调用单文件移动与一次批量 move_files 的耗时。
+
+默认使用临时 sqlite 数据库，也可以指定测试用的 MySQL（会创建一个 bench_ 开头的测试用户，结束后清空其云盘数据）：
+    python benchmarks/bench_batch_ops.py                       # 10000 个文件的文件夹
+    python benchmarks/bench_batch_ops.py --files 50000 --database-url mysql+pymysql://...
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+def _prepare_database(url):
+    workdir = None
+    if not url:
+        workdir = tempfile.mkdtemp(prefix='bench_batch_ops_')
+        url = f"sqlite:///{workdir}/bench.db"
+    # 必须在导入 app 之前设置
+    os.environ['DATABASE_URL'] = url
+    return workdir
+
+
+def seed_folder(app, db, user_id: int, root: str, files: int, subfolders: int):
+    """在 root 下生成 subfolders 个子文件夹，共 files 个文件记录"""
+    for i in range(subfolders):
+        app.ensure_folder_index(db, user_id, f"{root}sub{i}/")
+    db.flush()
+    rows = [{
+        'file_uuid': str(uuid.uuid4()),
+        'original_name': f"file{i}.txt",
+        'save_path': '',
+        'file_size': 100,
+        'file_type': 'text/plain',
+        'user_id': user_id,
+        'folder_path': f"{root}sub{i % subfolders}/",
+        'content_hash': None,
+    } for i in range(files)]
+    db.execute(app.insert(app.UserFile), rows)
+    app.recompute_folder_usage(db, user_id)
+    db.commit()
+
+
+def legacy_rename(app, db, user_id: int, old_path: str, new_path: str):
+    """旧 rename_folder 的行为：加载全部记录后逐条改写"""
+    for file in db.query(app.UserFile).filter(
+        app.UserFile.user_id == user_id,
+        app.UserFile.folder_path.startswith(old_path, autoescape=True)
+    ).all():
+        file.folder_path = file.folder_path.replace(old_path, new_path, 1)
+    for folder in db.query(app.UserFolder).filter(
+        app.UserFolder.user_id == user_id,
+        app.UserFolder.folder_path.startswith(old_path, autoescape=True)
+    ).all():
+        folder.folder_path = new_path + folder.folder_path[len(old_path):]
+        folder.parent_path = app.folder_utils.parent_path(folder.folder_path)
+    app.ensure_folder_index(db, user_id, new_path)
+    db.flush()
+    app.recompute_folder_usage(db, user_id, new_path)
+    app.record_change(db, user_id, app.folder_utils.CHANGE_FOLDER, app.folder_utils.ACTION_RENAME,
+                      path=old_path, new_path=new_path)
+    db.commit()
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='云盘批量操作基准测试')
+    parser.add_argument('--files', type=int, default=10000, help='文件夹中的文件数')
+    parser.add_argument('--subfolders', type=int, default=20, help='子文件夹数')
+    parser.add_argument('--moves', type=int, default=500, help='批量移动的文件数')
+    parser.add_argument('--database-url', help='数据库URL（默认临时 sqlite）')
+    args = parser.parse_args()
+
+    workdir = _prepare_database(args.database_url)
+    import app  # noqa: E402
+
+    app.Base.metadata.create_all(app.engine)
+    db = app.SessionLocal()
+    user = app.User(username=f"bench_{uuid.uuid4().hex[:8]}", email=f"{uuid.uuid4().hex[:8]}@bench.local",
+                    password_hash='x')
+    db.add(user)
+    db.commit()
+    user_id = user.id
+    try:
+        seed_folder(app, db, user_id, '/legacy/', args.files, args.subfolders)
+        seed_folder(app, db, user_id, '/prefix/', args.files, args.subfolders)
+
+        print(f"文件夹重命名（{args.files} 个文件，{args.subfolders} 个子文件夹）")
+        legacy = timed(legacy_rename, app, db, user_id, '/legacy/', '/legacy2/')
+
+        def prefix_rename():
+            app.move_folder(db, user_id, '/prefix/', '/prefix2/')
+            db.commit()
+        prefix = timed(prefix_rename)
+        print(f"  逐条改写: {legacy * 1000:>10.1f} ms")
+        print(f"  前缀改写: {prefix * 1000:>10.1f} ms  ({legacy / prefix:.1f}x)")
+
+        file_ids = [file_id for (file_id,) in db.query(app.UserFile.id).filter(
+            app.UserFile.user_id == user_id
+        ).order_by(app.UserFile.id).limit(args.moves * 2)]
+        single_ids, batch_ids = file_ids[:args.moves], file_ids[args.moves:]
+
+        def single_moves():
+            for file_id in single_ids:
+                app.move_files(db, user_id, [file_id], '/single/')
+                db.commit()
+
+        def batch_move():
+            app.move_files(db, user_id, batch_ids, '/batch/')
+            db.commit()
+
+        print(f"移动 {args.moves} 个文件")
+        single = timed(single_moves)
+        batch = timed(batch_move)
+        print(f"  逐个请求: {single * 1000:>10.1f} ms")
+        print(f"  一次批量: {batch * 1000:>10.1f} ms  ({single / batch:.1f}x)")
+    finally:
+        db.rollback()
+        app.delete_cloud_disk_data(db, user)
+        db.query(app.PurgeItem).filter(app.PurgeItem.user_id == user_id).delete(synchronize_session=False)
+        db.commit()
+        db.close()
+        if workdir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,138 @@
+"""
+存储压缩基准测试
+对比旧的 compress_file（整文件读入内存 + DEFLATE zip，不区分类型）与新的压缩阶段
+（抽样判断 + 流式 zstd）在混合语料上的CPU耗时和压缩率。
+
+用法（在 py 目录下运行）：
+    python benchmarks/bench_compression.py                  # 使用自动生成的语料
+    python benchmarks/bench_compression.py --corpus <目录>  # 使用真实文件
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+import zipfile
+import zlib
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils import compression_utils  # noqa: E402
+
+WORDS = ['学习', '计划', '单词', '复习', '笔记', 'study', 'review', 'lecture', 'chapter',
+         'vocabulary', 'exercise', 'answer', 'question', '考试', '作业', 'IPv6', 'network']
+
+
+def _text(size: int, rng: random.Random) -> bytes:
+    lines = []
+    total = 0
+    while total < size:
+        line = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(6, 16))) + '\n'
+        lines.append(line)
+        total += len(line.encode('utf-8'))
+    return ''.join(lines).encode('utf-8')[:size]
+
+
+def build_corpus(target: Path, scale_mb: int = 8):
+    """生成 txt / docx / pdf / mp4 各一份的混合语料"""
+    rng = random.Random(20261019)
+    size = scale_mb * 1024 * 1024
+
+    (target / 'notes.txt').write_bytes(_text(size // 2, rng))
+
+    # docx 本身是 DEFLATE 压缩的 zip
+    with zipfile.ZipFile(target / 'report.docx', 'w', zipfile.ZIP_DEFLATED) as zf:
+        zf.writestr('[Content_Types].xml', '<?xml version="1.0"?><Types/>')
+        body = _text(size, rng).decode('utf-8', 'ignore')
+        zf.writestr('word/document.xml', f'<w:document><w:body>{body}</w:body></w:document>')
+
+    # pdf 的内容流通常是 FlateDecode 压缩的
+    with open(target / 'slides.pdf', 'wb') as f:
+        f.write(b'%PDF-1.7\n')
+        for i in range(1, 9):
+            stream = zlib.compress(_text(size // 8, rng), 6)
+            f.write(f'{i} 0 obj\n<< /Length {len(stream)} /Filter /FlateDecode >>\nstream\n'.encode())
+            f.write(stream)
+            f.write(b'\nendstream\nendobj\n')
+        f.write(b'trailer\n<< /Root 1 0 R >>\n%%EOF\n')
+
+    # mp4 的媒体数据已经是压缩编码，与随机数据相当
+    with open(target / 'lecture.mp4', 'wb') as f:
+        f.write(b'\x00\x00\x00\x20ftypisom\x00\x00\x02\x00isomiso2avc1mp41')
+        f.write(os.urandom(size * 2))
+
+
+def legacy_compress(path: Path, workdir: Path) -> int:
+    """旧 compress_file 的行为：整文件读入内存写入 DEFLATE zip"""
+    zip_path = workdir / (path.name + '.zip')
+    with zipfile.ZipFile(zip_path, 'w', compression=zipfile.ZIP_DEFLATED) as zipf:
+        with open(path, 'rb') as f:
+            zipf.writestr(zipfile.ZipInfo(path.name), f.read(), compress_type=zipfile.ZIP_DEFLATED)
+    size = zip_path.stat().st_size
+    zip_path.unlink()
+    return size
+
+
+def engine_compress(path: Path, workdir: Path, level: int, min_saving: float):
+    """新压缩阶段：抽样判断 + 流式 zstd"""
+    tmp = workdir / (path.name + '.part')
+    shutil.copyfile(path, tmp)
+    start = time.process_time()
+    result, codec = compression_utils.compress_file_to_temp(tmp, level, min_saving)
+    cpu = time.process_time() - start
+    size = os.path.getsize(result)
+    os.remove(result)
+    return size, codec, cpu
+
+
+def main():
+    parser = argparse.ArgumentParser(description='存储压缩基准测试')
+    parser.add_argument('--corpus', help='语料目录（默认自动生成）')
+    parser.add_argument('--level', type=int, default=3, help='zstd压缩级别')
+    parser.add_argument('--min-saving', type=float, default=0.1, help='至少节省的比例')
+    parser.add_argument('--scale-mb', type=int, default=8, help='自动生成语料的规模（MB）')
+    args = parser.parse_args()
+
+    workdir = Path(tempfile.mkdtemp(prefix='bench_compression_'))
+    try:
+        if args.corpus:
+            corpus = Path(args.corpus)
+        else:
+            corpus = workdir / 'corpus'
+            corpus.mkdir()
+            build_corpus(corpus, args.scale_mb)
+
+        files = sorted(p for p in corpus.iterdir() if p.is_file())
+        header = f"{'文件':<16}{'大小(MB)':>10}{'旧CPU(s)':>10}{'旧压缩率':>10}{'新CPU(s)':>10}{'新压缩率':>10}  编码"
+        print(header)
+        print('-' * (len(header) + 8))
+        totals = [0, 0.0, 0, 0.0, 0]
+        for path in files:
+            original = path.stat().st_size
+            start = time.process_time()
+            legacy_size = legacy_compress(path, workdir)
+            legacy_cpu = time.process_time() - start
+            engine_size, codec, engine_cpu = engine_compress(path, workdir, args.level, args.min_saving)
+            print(f"{path.name:<16}{original / 1048576:>10.1f}{legacy_cpu:>10.3f}"
+                  f"{legacy_size / original:>10.1%}{engine_cpu:>10.3f}{engine_size / original:>10.1%}  {codec or '原样'}")
+            totals[0] += original
+            totals[1] += legacy_cpu
+            totals[2] += legacy_size
+            totals[3] += engine_cpu
+            totals[4] += engine_size
+
+        original, legacy_cpu, legacy_size, engine_cpu, engine_size = totals
+        print('-' * (len(header) + 8))
+        print(f"{'合计':<16}{original / 1048576:>10.1f}{legacy_cpu:>10.3f}"
+              f"{legacy_size / original:>10.1%}{engine_cpu:>10.3f}{engine_size / original:>10.1%}")
+        if legacy_cpu:
+            print(f"CPU 节省: {1 - engine_cpu / legacy_cpu:.1%}")
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
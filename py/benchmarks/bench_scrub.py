@@ -0,0 +1,116 @@
+"""
+存储完整性校验吞吐量基准测试
+生成原样存储和 zstd 压缩存储的测试文件，分别用 64KB read() 循环（对照）和 scrub_utils.hash_file
+（mmap 大块顺序读 / 流式解压）计算 SHA-256，报告墙钟吞吐量和按线程CPU时间计算的每核吞吐量（MB/s per core）。
+最后用多个线程同时校验不同文件，观察 hashlib 释放 GIL 后的多核扩展。
+
+    python benchmarks/bench_scrub.py                   # 256MB
+    python benchmarks/bench_scrub.py --size-mb 1024 --threads 4 --drop-caches
+"""
+import argparse
+import hashlib
+import os
+import shutil
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import zstandard
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils import scrub_utils  # noqa: E402
+
+
+def seed(root: str, size_mb: int):
+    """生成一个不可压缩的原样文件和一个文本内容的 zstd 压缩文件，原始内容都是 size_mb"""
+    plain = os.path.join(root, 'plain')
+    with open(plain, 'wb') as f:
+        for _ in range(size_mb):
+            f.write(os.urandom(1024 * 1024))
+    line = '第一章 学习计划 study plan for the week, 重点复习单词和语法\n'.encode('utf-8')
+    block = line * (1024 * 1024 // len(line) + 1)
+    compressed = os.path.join(root, 'compressed')
+    with open(compressed, 'wb') as f:
+        with zstandard.ZstdCompressor(level=3).stream_writer(f) as writer:
+            for _ in range(size_mb):
+                writer.write(block[:1024 * 1024])
+    return plain, compressed
+
+
+def read_loop(path: str, codec=None) -> str:
+    """对照：64KB read() 循环"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        source = zstandard.ZstdDecompressor().stream_reader(f) if codec else f
+        while True:
+            block = source.read(64 * 1024)
+            if not block:
+                break
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def drop_caches():
+    os.sync()
+    with open('/proc/sys/vm/drop_caches', 'w') as f:
+        f.write('3')
+
+
+def timed(func, *args):
+    """执行一次，返回 (墙钟秒数, 当前线程CPU秒数)"""
+    wall, cpu = time.perf_counter(), time.thread_time()
+    func(*args)
+    return time.perf_counter() - wall, time.thread_time() - cpu
+
+
+def measure(label: str, size_mb: int, cold: bool, func, *args):
+    if cold:
+        drop_caches()
+    wall, cpu = timed(func, *args)
+    print(f"{label:<30} {size_mb / wall:8.1f} MB/s  {size_mb / cpu:8.1f} MB/s/核")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size-mb', type=int, default=256)
+    parser.add_argument('--threads', type=int, default=min(4, os.cpu_count() or 1))
+    parser.add_argument('--drop-caches', action='store_true', help="每次计时前清空页缓存")
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='bench_scrub_')
+    try:
+        print(f"生成 {args.size_mb}MB 测试文件 ...")
+        plain, compressed = seed(root, args.size_mb)
+        # 预热页缓存（--drop-caches 时每次计时前会清空）
+        read_loop(plain)
+        read_loop(compressed, 'zstd')
+        size = args.size_mb
+        measure("原样 read() 64KB", size, args.drop_caches, read_loop, plain)
+        measure("原样 hash_file (mmap 8MB)", size, args.drop_caches, scrub_utils.hash_file, plain)
+        measure("zstd read() 64KB", size, args.drop_caches, read_loop, compressed, 'zstd')
+        measure("zstd hash_file (流式解压)", size, args.drop_caches, scrub_utils.hash_file, compressed, 'zstd')
+
+        # 多线程：每个线程校验一个副本
+        copies = [plain]
+        for i in range(1, args.threads):
+            copy = os.path.join(root, f'plain_{i}')
+            shutil.copyfile(plain, copy)
+            copies.append(copy)
+        if args.drop_caches:
+            drop_caches()
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.threads) as executor:
+            times = list(executor.map(lambda path: timed(scrub_utils.hash_file, path), copies))
+        wall = time.perf_counter() - started
+        cpu = sum(c for _, c in times)
+        total = size * len(copies)
+        print(f"{f'原样 hash_file x{args.threads} 线程':<30} {total / wall:8.1f} MB/s  {total / cpu:8.1f} MB/s/核")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+"""
+冷存储重新压缩基准测试
+用一段文本内容（默认取本机 Python 标准库源码，贴近文档/笔记类文件）比较各 zstd 级别的压缩比和压缩速度，
+再用 tiering_utils.timed_read 对比上传时的级别（热存储）和冷存储级别下的首字节延迟与读取（解压）吞吐量。
+
+    python benchmarks/bench_tiering.py                       # 32MB，级别 3/9/15/19
+    python benchmarks/bench_tiering.py --levels 3 12 19 --drop-caches
+"""
+import argparse
+import glob
+import os
+import shutil
+import sys
+import sysconfig
+import tempfile
+import time
+from pathlib import Path
+
+import zstandard
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from utils import tiering_utils  # noqa: E402
+
+HOT_LEVEL = 3
+
+
+def sample_content(size_mb: int) -> bytes:
+    """拼接标准库源码作为测试内容，不够时重复"""
+    limit = size_mb * 1024 * 1024
+    parts, total = [], 0
+    for path in sorted(glob.glob(os.path.join(sysconfig.get_paths()['stdlib'], '**', '*.py'), recursive=True)):
+        with open(path, 'rb') as f:
+            data = f.read()
+        parts.append(data)
+        total += len(data)
+        if total >= limit:
+            break
+    content = b''.join(parts)
+    return (content * (limit // max(len(content), 1) + 1))[:limit]
+
+
+def write_compressed(path: str, content: bytes, level: int) -> float:
+    """以指定级别流式压缩写入，返回耗时"""
+    started = time.perf_counter()
+    with open(path, 'wb') as f:
+        with zstandard.ZstdCompressor(level=level, write_checksum=True).stream_writer(f) as writer:
+            for offset in range(0, len(content), 1024 * 1024):
+                writer.write(content[offset:offset + 1024 * 1024])
+    return time.perf_counter() - started
+
+
+def timed_read(path: str, cold: bool) -> tiering_utils.ReadTiming:
+    if cold:
+        os.sync()
+        tiering_utils.drop_page_cache(path)
+    return tiering_utils.timed_read(path, 'zstd')
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size-mb', type=int, default=32)
+    parser.add_argument('--levels', type=int, nargs='+', default=[HOT_LEVEL, 9, 15, 19])
+    parser.add_argument('--drop-caches', action='store_true', help="每次读取前丢弃该文件的页缓存")
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='bench_tiering_')
+    try:
+        content = sample_content(args.size_mb)
+        size_mb = len(content) / 1024 / 1024
+        print(f"测试内容 {size_mb:.1f}MB")
+        print(f"{'级别':<6} {'压缩比':>8} {'存储MB':>9} {'压缩 MB/s':>10} {'首字节 ms':>10} {'读取 MB/s':>10}")
+        for level in args.levels:
+            path = os.path.join(root, f'level_{level}')
+            elapsed = write_compressed(path, content, level)
+            stored = os.path.getsize(path)
+            timed_read(path, False)  # 预热（--drop-caches 时计时前会丢弃）
+            timing = timed_read(path, args.drop_caches)
+            print(f"{level:<6} {len(content) / stored:8.2f} {stored / 1024 / 1024:9.2f} {size_mb / elapsed:10.1f} "
+                  f"{timing.first_byte_seconds * 1000:10.2f} {size_mb / timing.total_seconds:10.1f}")
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""
+多文件上传登记基准测试
+对比旧的逐个文件登记（每个文件单独 INSERT 记录、记录变更、更新用量并提交一次事务）与 store_new_files
+在一个事务中批量登记整批文件的耗时，分别上传 1、50、500 个文件（可用 --counts 指定）。
+只测量数据库登记和blob提交，不包括HTTP接收和压缩阶段；每个文件内容不同，都会提交为新blob。
+
+默认使用临时 sqlite 数据库，也可以指定测试用的 MySQL（会创建一个 bench_ 开头的测试用户，结束后清空其云盘数据）：
+    python benchmarks/bench_upload_batch.py
+    python benchmarks/bench_upload_batch.py --counts 1 50 500 2000 --database-url mysql+pymysql://...
+"""
+import argparse
+import os
+import shutil
+import sys
+import tempfile
+import time
+import uuid
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+def _prepare_environment(url):
+    """blob存储放到临时目录；没有指定数据库时使用临时 sqlite，必须在导入 app 之前设置"""
+    workdir = tempfile.mkdtemp(prefix='bench_upload_batch_')
+    if not url:
+        url = f"sqlite:///{workdir}/bench.db"
+    os.environ['DATABASE_URL'] = url
+    from config import Settings
+    Settings.BLOB_DIR = Path(workdir) / 'blobs'
+    Settings.BLOB_TMP_DIR = Settings.BLOB_DIR / 'tmp'
+    Settings.BLOB_TMP_DIR.mkdir(parents=True, exist_ok=True)
+    return workdir
+
+
+def make_uploads(app, user_id: int, folder_path: str, count: int, size: int):
+    """生成 count 个内容不同的临时文件和对应的文件记录"""
+    entries = []
+    for i in range(count):
+        tmp_path, content_hash, file_size = app.storage_utils.save_bytes_to_temp(
+            uuid.uuid4().bytes * (size // 16)
+        )
+        db_file = app.UserFile(
+            file_uuid=str(uuid.uuid4()),
+            original_name=f"file{i}.bin",
+            save_path=app.storage_utils.blob_key(content_hash),
+            file_size=file_size,
+            file_type='application/octet-stream',
+            user_id=user_id,
+            folder_path=folder_path,
+            content_hash=content_hash
+        )
+        entries.append((db_file, tmp_path, None))
+    return entries
+
+
+def legacy_upload(app, db, entries):
+    """旧上传接口的行为：每个文件单独登记并提交"""
+    for db_file, tmp_path, codec in entries:
+        app.register_new_file(db, db_file)
+        app.store_blob_reference(db, db_file, tmp_path, codec)
+
+
+def batch_upload(app, db, entries):
+    app.store_new_files(db, entries)
+
+
+def timed(func, *args):
+    start = time.perf_counter()
+    func(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='多文件上传登记基准测试')
+    parser.add_argument('--counts', type=int, nargs='+', default=[1, 50, 500], help='每次上传的文件数')
+    parser.add_argument('--size', type=int, default=4096, help='每个文件的大小（字节）')
+    parser.add_argument('--database-url', help='数据库URL（默认临时 sqlite）')
+    args = parser.parse_args()
+
+    workdir = _prepare_environment(args.database_url)
+    import app  # noqa: E402
+
+    app.Base.metadata.create_all(app.engine)
+    db = app.SessionLocal()
+    user = app.User(username=f"bench_{uuid.uuid4().hex[:8]}", email=f"{uuid.uuid4().hex[:8]}@bench.local",
+                    password_hash='x')
+    db.add(user)
+    db.commit()
+    user_id = user.id
+    try:
+        print(f"上传登记（每个文件 {args.size} 字节）")
+        for count in args.counts:
+            legacy = timed(legacy_upload, app, db, make_uploads(app, user_id, f"/legacy{count}/", count, args.size))
+            batch = timed(batch_upload, app, db, make_uploads(app, user_id, f"/batch{count}/", count, args.size))
+            print(f"  {count:>5} 个文件  逐个提交: {legacy * 1000:>10.1f} ms  "
+                  f"一个事务: {batch * 1000:>10.1f} ms  ({legacy / batch:.1f}x)")
+    finally:
+        db.rollback()
+        app.delete_cloud_disk_data(db, user)
+        db.query(app.PurgeItem).filter(app.PurgeItem.user_id == user_id).delete(synchronize_session=False)
+        db.commit()
+        db.close()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -37,15 +37,97 @@ class Settings:
         'https://api.doubao.com/v1'
     )
     MAX_TOKEN: int = int(os.getenv('MAX_TOKEN', '4096'))
+    # 单词表AI补全：按输出token预算分批（每批不超过 VOCAB_AI_MAX_BATCH 个单词），最多同时进行 VOCAB_AI_CONCURRENCY 个请求
+    VOCAB_AI_CONCURRENCY: int = int(os.getenv('VOCAB_AI_CONCURRENCY', '4'))
+    VOCAB_AI_TOKEN_BUDGET: int = int(os.getenv('VOCAB_AI_TOKEN_BUDGET', '4096'))  # 每批请求的 max_tokens
+    VOCAB_AI_MAX_BATCH: int = int(os.getenv('VOCAB_AI_MAX_BATCH', '40'))
     
     # ============ 文件配置 ============
     # 使用项目根目录的相对路径
     BASE_DIR: Path = BASE_DIR
     UPLOAD_DIR: Path = BASE_DIR / 'uploads'
     CLOUD_DISK_DIR: Path = BASE_DIR / 'cloud_disk'
+    # 内容寻址的共享blob存储（按SHA-256去重）
+    BLOB_DIR: Path = BASE_DIR / 'cloud_disk' / 'blobs'
+    BLOB_TMP_DIR: Path = BASE_DIR / 'cloud_disk' / 'blobs' / 'tmp'
+    # 分片续传：会话与分片的本地存储目录、分片大小范围、放弃会话的过期时间
+    UPLOAD_SESSION_DIR: Path = BASE_DIR / 'cloud_disk' / 'upload_sessions'
+    UPLOAD_CHUNK_SIZE: int = int(os.getenv('UPLOAD_CHUNK_SIZE', str(8 * 1024 * 1024)))  # 8MB
+    UPLOAD_CHUNK_MIN_SIZE: int = 256 * 1024
+    UPLOAD_CHUNK_MAX_SIZE: int = 64 * 1024 * 1024
+    UPLOAD_SESSION_EXPIRE_HOURS: int = int(os.getenv('UPLOAD_SESSION_EXPIRE_HOURS', '24'))
+    # 存储压缩：新blob抽样判断可压缩性，值得压缩时以zstd存储（已压缩的格式自动跳过）
+    COMPRESSION_ENABLED: bool = os.getenv('COMPRESSION_ENABLED', 'True').lower() == 'true'
+    COMPRESSION_LEVEL: int = int(os.getenv('COMPRESSION_LEVEL', '3'))
+    COMPRESSION_MIN_SIZE: int = int(os.getenv('COMPRESSION_MIN_SIZE', str(4 * 1024)))  # 小文件不压缩
+    COMPRESSION_MIN_SAVING: float = float(os.getenv('COMPRESSION_MIN_SAVING', '0.1'))  # 至少节省10%才压缩
+    COMPRESSION_WORKERS: int = int(os.getenv('COMPRESSION_WORKERS', '2'))
+    # 增量同步：云盘变更日志的保留天数，游标早于保留期的客户端需要重新拉取完整目录树
+    CHANGE_JOURNAL_RETENTION_DAYS: int = int(os.getenv('CHANGE_JOURNAL_RETENTION_DAYS', '30'))
+    # 云盘空间配额：用户未单独设置配额时使用的默认值（字节），0 表示不限制
+    CLOUD_DISK_QUOTA: int = int(os.getenv('CLOUD_DISK_QUOTA', str(10 * 1024 * 1024 * 1024)))  # 10GB
+    # 用量计数的定期校对间隔（小时），修正计数与文件记录之间的偏差
+    USAGE_RECONCILE_INTERVAL_HOURS: float = float(os.getenv('USAGE_RECONCILE_INTERVAL_HOURS', '24'))
+    # 删除队列：删除文件夹/账户时磁盘清理由后台任务分批执行，每批之间暂停以限制IO
+    PURGE_BATCH_SIZE: int = int(os.getenv('PURGE_BATCH_SIZE', '500'))
+    PURGE_BATCH_PAUSE: float = float(os.getenv('PURGE_BATCH_PAUSE', '0.05'))  # 秒
+    PURGE_POLL_SECONDS: float = float(os.getenv('PURGE_POLL_SECONDS', '60'))  # 定期检查其他进程登记或重启前未完成的清理
+    # 缩略图：图片和PDF首页生成固定尺寸的WebP缩略图，按blob哈希和尺寸缓存在磁盘上，在进程池中生成
+    THUMBNAIL_DIR: Path = BASE_DIR / 'cloud_disk' / 'thumbnails'
+    THUMBNAIL_SIZES: tuple = tuple(int(size) for size in os.getenv('THUMBNAIL_SIZES', '128,256,512').split(','))
+    THUMBNAIL_QUALITY: int = int(os.getenv('THUMBNAIL_QUALITY', '80'))
+    THUMBNAIL_WORKERS: int = int(os.getenv('THUMBNAIL_WORKERS', '2'))
+    THUMBNAIL_MAX_SOURCE_SIZE: int = int(os.getenv('THUMBNAIL_MAX_SOURCE_SIZE', str(50 * 1024 * 1024)))  # 超过则不生成
+    # 图片转码：上传的照片另外生成去掉EXIF、缩小的 WebP/AVIF 版本（保留原图），作为图片内嵌显示时按 Accept 头协商
+    IMAGE_RENDITION_ENABLED: bool = os.getenv('IMAGE_RENDITION_ENABLED', 'False').lower() == 'true'
+    IMAGE_RENDITION_DIR: Path = BASE_DIR / 'cloud_disk' / 'renditions'
+    IMAGE_RENDITION_FORMATS: tuple = tuple(name.strip() for name in os.getenv('IMAGE_RENDITION_FORMATS', 'avif,webp').split(',') if name.strip())  # 按偏好顺序，本机不支持的格式跳过
+    IMAGE_RENDITION_QUALITY: int = int(os.getenv('IMAGE_RENDITION_QUALITY', '75'))
+    IMAGE_RENDITION_MAX_DIMENSION: int = int(os.getenv('IMAGE_RENDITION_MAX_DIMENSION', '2048'))  # 最大边长（像素）
+    IMAGE_RENDITION_MIN_SIZE: int = int(os.getenv('IMAGE_RENDITION_MIN_SIZE', str(200 * 1024)))  # 更小的图片不转码
+    IMAGE_RENDITION_MAX_SOURCE_SIZE: int = int(os.getenv('IMAGE_RENDITION_MAX_SOURCE_SIZE', str(50 * 1024 * 1024)))
+    # 文本预览：在线编辑器按字节区间读取文本窗口，跳转行号用的稀疏行索引按blob哈希缓存在磁盘上
+    LINE_INDEX_DIR: Path = BASE_DIR / 'cloud_disk' / 'line_index'
+    PREVIEW_DEFAULT_LENGTH: int = int(os.getenv('PREVIEW_DEFAULT_LENGTH', str(64 * 1024)))
+    PREVIEW_MAX_LENGTH: int = int(os.getenv('PREVIEW_MAX_LENGTH', str(1024 * 1024)))
+    # 全文搜索
+    SEARCH_MAX_TEXT_CHARS: int = int(os.getenv('SEARCH_MAX_TEXT_CHARS', '200000'))  # 每个文件/笔记索引的文本长度上限
+    SEARCH_MAX_SOURCE_SIZE: int = int(os.getenv('SEARCH_MAX_SOURCE_SIZE', str(20 * 1024 * 1024)))  # 超过的docx/pdf只索引文件名
+    SEARCH_BATCH_SIZE: int = int(os.getenv('SEARCH_BATCH_SIZE', '100'))
+    SEARCH_POLL_SECONDS: float = float(os.getenv('SEARCH_POLL_SECONDS', '30'))  # 定期检查其他进程的变更
+    # 文件历史版本：在线编辑保存时按块保存版本，相邻版本共享未改动的块
+    VERSION_CHUNK_DIR: Path = BASE_DIR / 'cloud_disk' / 'version_chunks'
+    VERSION_MAX_COUNT: int = int(os.getenv('VERSION_MAX_COUNT', '20'))  # 每个文件最多保留的版本数
+    VERSION_RETENTION_DAYS: int = int(os.getenv('VERSION_RETENTION_DAYS', '30'))  # 超过天数的版本清理（最新版本保留）
+    VERSION_MAX_FILE_SIZE: int = int(os.getenv('VERSION_MAX_FILE_SIZE', str(20 * 1024 * 1024)))  # 超过则不保存版本
+    VERSION_PRUNE_INTERVAL_HOURS: float = float(os.getenv('VERSION_PRUNE_INTERVAL_HOURS', '6'))
+    # 存储对账：规范化文件路径、对账blob/版本块/缩略图/用户目录，孤儿文件超过宽限期后删除
+    RECONCILE_INTERVAL_HOURS: float = float(os.getenv('RECONCILE_INTERVAL_HOURS', '24'))  # 0 表示不在后台执行
+    RECONCILE_REMOVE_ORPHANS: bool = os.getenv('RECONCILE_REMOVE_ORPHANS', 'True').lower() == 'true'  # 否则只报告
+    RECONCILE_ORPHAN_GRACE_HOURS: float = float(os.getenv('RECONCILE_ORPHAN_GRACE_HOURS', '24'))
+    RECONCILE_WORKERS: int = int(os.getenv('RECONCILE_WORKERS', '8'))  # 并行扫描目录的线程数
+    RECONCILE_BATCH_SIZE: int = int(os.getenv('RECONCILE_BATCH_SIZE', '1000'))
+    # 存储完整性校验：后台限速重算blob和版本块的SHA-256，发现的问题见 /api/admin/storage/scrub
+    SCRUB_INTERVAL_HOURS: float = float(os.getenv('SCRUB_INTERVAL_HOURS', '24'))  # 每轮结束后的间隔，0 表示不在后台执行
+    SCRUB_RATE_MB_PER_SEC: float = float(os.getenv('SCRUB_RATE_MB_PER_SEC', '20'))  # 读取限速，0 表示不限速
+    SCRUB_BATCH_SIZE: int = int(os.getenv('SCRUB_BATCH_SIZE', '200'))
+    # 冷存储分层：超过天数没有被下载的blob移到冷存储目录（可以是另一块盘），可压缩的内容用高级别zstd重新压缩
+    COLD_BLOB_DIR: Path = Path(os.getenv('COLD_BLOB_DIR') or BASE_DIR / 'cloud_disk' / 'cold_blobs')
+    COLD_TIER_AFTER_DAYS: float = float(os.getenv('COLD_TIER_AFTER_DAYS', '30'))  # 0 表示不分层
+    COLD_TIER_INTERVAL_HOURS: float = float(os.getenv('COLD_TIER_INTERVAL_HOURS', '24'))
+    COLD_COMPRESSION_LEVEL: int = int(os.getenv('COLD_COMPRESSION_LEVEL', '19'))
+    COLD_TIER_BATCH_SIZE: int = int(os.getenv('COLD_TIER_BATCH_SIZE', '100'))
+    # 文件分享链接：分享信息按分享码缓存在进程内（撤销时立即失效），下载次数以数据库为准
+    SHARE_CACHE_SIZE: int = int(os.getenv('SHARE_CACHE_SIZE', '4096'))
+    SHARE_CACHE_TTL: float = float(os.getenv('SHARE_CACHE_TTL', '60'))  # 秒，0 表示不缓存
+    SHARE_ACCESS_TOKEN_TTL: int = int(os.getenv('SHARE_ACCESS_TOKEN_TTL', '3600'))  # 输入分享密码后换取的访问凭证有效期（秒）
     # 支持环境变量配置，默认500MB（适合视频文件）
     MAX_FILE_SIZE: int = int(os.getenv('MAX_FILE_SIZE', str(500 * 1024 * 1024)))  # 500MB
     NOTES_FOLDER_NAME: str = 'notes'
+    # 下载卸载：开启后下载接口只做权限校验，通过 X-Accel-Redirect 交给nginx发送文件
+    # 需要在nginx中配置对应的 internal location（见 complete_nginx_config.conf）
+    DOWNLOAD_ACCEL_REDIRECT: bool = os.getenv('DOWNLOAD_ACCEL_REDIRECT', 'False').lower() == 'true'
+    ACCEL_REDIRECT_PREFIX: str = os.getenv('ACCEL_REDIRECT_PREFIX', '/_protected')
     
     # 允许的文件扩展名
     ALLOWED_EXTENSIONS = {
@@ -95,6 +177,13 @@ class Settings:
         """确保必要的目录存在"""
         cls.UPLOAD_DIR.mkdir(parents=True, exist_ok=True)
         cls.CLOUD_DISK_DIR.mkdir(parents=True, exist_ok=True)
+        cls.BLOB_TMP_DIR.mkdir(parents=True, exist_ok=True)
+        cls.UPLOAD_SESSION_DIR.mkdir(parents=True, exist_ok=True)
+        cls.THUMBNAIL_DIR.mkdir(parents=True, exist_ok=True)
+        cls.LINE_INDEX_DIR.mkdir(parents=True, exist_ok=True)
+        cls.IMAGE_RENDITION_DIR.mkdir(parents=True, exist_ok=True)
+        cls.VERSION_CHUNK_DIR.mkdir(parents=True, exist_ok=True)
+        (cls.COLD_BLOB_DIR / 'tmp').mkdir(parents=True, exist_ok=True)
     
     @classmethod
     def validate(cls) -> list:
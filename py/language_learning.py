@@ -15,6 +15,8 @@ import uuid
 import logging
 from fastapi.responses import JSONResponse, StreamingResponse, Response
 import asyncio
+from functools import partial
+import anyio
 from enum import Enum
 
 # 统一使用app框架下的配置
@@ -56,6 +58,8 @@ try:
 except Exception:
     app_settings = None
 
+from utils import vocabulary_utils
+
 # 尝试从模块化结构导入模型（向后兼容）
 try:
     from models.language_learning import (
@@ -960,71 +964,65 @@ def extract_words_with_ai(text_content: str, language: str = 'en') -> list:
             words = [w.lower() for w in words if len(w) > 2]
         return list(set(words))
 
-# 使用AI处理单词信息的函数 - 支持批量处理和多语言
-def process_words_with_ai(words_data: list, language: str = 'en') -> list:
-    """批量使用DeepSeek API处理多个单词信息，减少API调用次数，支持多语言"""
-    from openai import OpenAI
-    import os
-    
-    try:
-        deepseek_api_key = (
-            app_settings.DEEPSEEK_API_KEY if app_settings and app_settings.DEEPSEEK_API_KEY else os.getenv("DEEPSEEK_API_KEY")
-        )
-        deepseek_api_key = deepseek_api_key.strip() if deepseek_api_key else None
-        deepseek_api_key = deepseek_api_key.strip() if deepseek_api_key else None
-        deepseek_api_key = deepseek_api_key.strip() if deepseek_api_key else None
-        if not deepseek_api_key:
-            # 如果API密钥未设置，返回基础信息
-            results = []
-            for word_data in words_data:
-                results.append({
-                    "word": word_data["word"],
-                    "definition": word_data["definition"] or "暂无解释",
-                    "part_of_speech": word_data["part_of_speech"] or "未知",
-                    "example": "",
-                    "processed": False
-                })
-            return results
-        
-        # 初始化OpenAI客户端
-        client = OpenAI(
-            api_key=deepseek_api_key,
-            base_url="https://api.deepseek.com/v1"
-        )
-        
-        # 获取语言名称
-        language_name = get_language_name(language)
-        
-        # 根据语言调整提示词
-        if language == 'zh':
-            definition_desc = "准确的中文释义"
-            pos_desc = "标准的词性（如名词、动词、形容词等）"
-            example_desc = "一个简单的中文例句"
-            invalid_desc = "有效的词语"
-        elif language == 'ja':
-            definition_desc = "准确的中文释义"
-            pos_desc = "标准的词性（如名词、动词、形容词等，使用日语术语）"
-            example_desc = "一个简单的日语例句"
-            invalid_desc = "有效的日语单词"
-        elif language == 'ko':
-            definition_desc = "准确的中文释义"
-            pos_desc = "标准的词性（如名词、动词、形容词等，使用韩语术语）"
-            example_desc = "一个简单的韩语例句"
-            invalid_desc = "有效的韩语单词"
-        else:
-            definition_desc = "准确的中文释义"
-            pos_desc = "标准的词性（如noun、verb、adjective等，不要使用缩写）"
-            example_desc = f"一个简单的{language_name}例句"
-            invalid_desc = f"有效的{language_name}单词"
-        
-        # 准备批量处理的提示词
-        words_list_str = ""
-        for i, word_data in enumerate(words_data):
-            words_list_str += f"\n{i+1}. 单词: {word_data['word']}\n"
-            words_list_str += f"   现有解释: {word_data['definition']}\n"
-            words_list_str += f"   现有词性: {word_data['part_of_speech']}\n"
+def _deepseek_api_key() -> Optional[str]:
+    deepseek_api_key = (
+        app_settings.DEEPSEEK_API_KEY if app_settings and app_settings.DEEPSEEK_API_KEY else os.getenv("DEEPSEEK_API_KEY")
+    )
+    return deepseek_api_key.strip() if deepseek_api_key else None
+
+def _fallback_word_results(words_data: list) -> list:
+    """AI不可用或处理失败时，返回所有单词的原始信息（processed=False）"""
+    results = []
+    for word_data in words_data:
+        # 安全处理可能为None的值
+        word_text = word_data.get("word", "") or ""
+        definition = word_data.get("definition") or "暂无解释"
+        part_of_speech = word_data.get("part_of_speech") or "未知"
         
-        prompt = f"""
+        results.append({
+            "word": word_text,
+            "definition": definition if definition else "暂无解释",
+            "part_of_speech": part_of_speech if part_of_speech else "未知",
+            "example": "",
+            "processed": False
+        })
+    return results
+
+def _word_batch_messages(words_data: list, language: str) -> list:
+    """批量处理单词的对话消息（系统提示词和用户提示词）"""
+    # 获取语言名称
+    language_name = get_language_name(language)
+    
+    # 根据语言调整提示词
+    if language == 'zh':
+        definition_desc = "准确的中文释义"
+        pos_desc = "标准的词性（如名词、动词、形容词等）"
+        example_desc = "一个简单的中文例句"
+        invalid_desc = "有效的词语"
+    elif language == 'ja':
+        definition_desc = "准确的中文释义"
+        pos_desc = "标准的词性（如名词、动词、形容词等，使用日语术语）"
+        example_desc = "一个简单的日语例句"
+        invalid_desc = "有效的日语单词"
+    elif language == 'ko':
+        definition_desc = "准确的中文释义"
+        pos_desc = "标准的词性（如名词、动词、形容词等，使用韩语术语）"
+        example_desc = "一个简单的韩语例句"
+        invalid_desc = "有效的韩语单词"
+    else:
+        definition_desc = "准确的中文释义"
+        pos_desc = "标准的词性（如noun、verb、adjective等，不要使用缩写）"
+        example_desc = f"一个简单的{language_name}例句"
+        invalid_desc = f"有效的{language_name}单词"
+    
+    # 准备批量处理的提示词
+    words_list_str = ""
+    for i, word_data in enumerate(words_data):
+        words_list_str += f"\n{i+1}. 单词: {word_data['word']}\n"
+        words_list_str += f"   现有解释: {word_data['definition']}\n"
+        words_list_str += f"   现有词性: {word_data['part_of_speech']}\n"
+    
+    prompt = f"""
 请将以下多个{language_name}单词批量处理成标准格式，提供正确的释义和词性。
 
 {words_list_str}
@@ -1037,34 +1035,64 @@ def process_words_with_ai(words_data: list, language: str = 'en') -> list:
 
 如果某个单词不是{invalid_desc}，请在该对象中返回null值。请确保返回的JSON格式正确，可以被直接解析。
 """
-            
-        # 增加max_tokens以容纳批量处理的结果
-        max_tokens = min(4096, 500 * len(words_data))
-        
-        system_content = f"你是一位专业的{language_name}词典编辑，擅长批量提供准确的{language_name}单词释义、词性和例句。请严格按照要求的JSON格式返回结果。"
-        
-        response = client.chat.completions.create(
-            model="deepseek-chat",
-            messages=[
-                    {"role": "system", "content": system_content},
-                    {"role": "user", "content": prompt}
-                ],
-                temperature=0.3,  # 降低温度以获取更确定的结果
-                max_tokens=max_tokens
-            )
-        
-        ai_content = response.choices[0].message.content.strip()
-        
-        # 提取JSON数组部分
-        json_match = re.search(r'\[.*\]', ai_content, re.DOTALL)
-        if json_match:
-            processed_data_list = json.loads(json_match.group())
-            
-            # 确保返回的结果与输入的单词数量匹配
-            results = []
-            for i, word_data in enumerate(words_data):
-                if i < len(processed_data_list) and processed_data_list[i]:
-                    processed_data = processed_data_list[i]
+    
+    system_content = f"你是一位专业的{language_name}词典编辑，擅长批量提供准确的{language_name}单词释义、词性和例句。请严格按照要求的JSON格式返回结果。"
+    return [
+        {"role": "system", "content": system_content},
+        {"role": "user", "content": prompt}
+    ]
+
+def _parse_word_batch(ai_content: str, words_data: list) -> list:
+    """解析AI返回的批量处理结果，结果与输入的单词按顺序一一对应"""
+    # 提取JSON数组部分
+    json_match = re.search(r'\[.*\]', ai_content, re.DOTALL)
+    if json_match:
+        processed_data_list = json.loads(json_match.group())
+        
+        # 确保返回的结果与输入的单词数量匹配
+        results = []
+        for i, word_data in enumerate(words_data):
+            if i < len(processed_data_list) and processed_data_list[i]:
+                processed_data = processed_data_list[i]
+                # 确保必需字段都有值，安全处理None值
+                definition = (processed_data.get("definition") or "").strip() if processed_data.get("definition") else ""
+                part_of_speech = (processed_data.get("part_of_speech") or "").strip() if processed_data.get("part_of_speech") else ""
+                
+                # 如果释义或词性为空，标记为未处理成功
+                if not definition or not part_of_speech:
+                    results.append({
+                        "word": word_data["word"],
+                        "definition": definition or "暂无解释",
+                        "part_of_speech": part_of_speech or "未知",
+                        "example": (processed_data.get("example") or "").strip() if processed_data.get("example") else "",
+                        "processed": False
+                    })
+                else:
+                    results.append({
+                        "word": processed_data.get("word", word_data["word"]),
+                        "definition": definition,
+                        "part_of_speech": part_of_speech,
+                        "example": (processed_data.get("example") or "").strip() if processed_data.get("example") else "",
+                        "processed": True
+                    })
+            else:
+                # 如果某个单词没有返回结果或结果为null，使用原始信息
+                results.append({
+                    "word": word_data["word"],
+                    "definition": word_data["definition"] or "暂无解释",
+                    "part_of_speech": word_data["part_of_speech"] or "未知",
+                    "example": "",
+                    "processed": False
+                })
+        return results
+    else:
+        # 如果无法提取JSON数组，尝试提取多个单独的JSON对象
+        json_objects = re.findall(r'\{[^}]*\}', ai_content)
+        results = []
+        for i, word_data in enumerate(words_data):
+            if i < len(json_objects):
+                try:
+                    processed_data = json.loads(json_objects[i])
                     # 确保必需字段都有值，安全处理None值
                     definition = (processed_data.get("definition") or "").strip() if processed_data.get("definition") else ""
                     part_of_speech = (processed_data.get("part_of_speech") or "").strip() if processed_data.get("part_of_speech") else ""
@@ -1086,54 +1114,7 @@ def process_words_with_ai(words_data: list, language: str = 'en') -> list:
                             "example": (processed_data.get("example") or "").strip() if processed_data.get("example") else "",
                             "processed": True
                         })
-                else:
-                    # 如果某个单词没有返回结果或结果为null，使用原始信息
-                    results.append({
-                        "word": word_data["word"],
-                        "definition": word_data["definition"] or "暂无解释",
-                        "part_of_speech": word_data["part_of_speech"] or "未知",
-                        "example": "",
-                        "processed": False
-                    })
-            return results
-        else:
-            # 如果无法提取JSON数组，尝试提取多个单独的JSON对象
-            json_objects = re.findall(r'\{[^}]*\}', ai_content)
-            results = []
-            for i, word_data in enumerate(words_data):
-                if i < len(json_objects):
-                    try:
-                        processed_data = json.loads(json_objects[i])
-                        # 确保必需字段都有值，安全处理None值
-                        definition = (processed_data.get("definition") or "").strip() if processed_data.get("definition") else ""
-                        part_of_speech = (processed_data.get("part_of_speech") or "").strip() if processed_data.get("part_of_speech") else ""
-                        
-                        # 如果释义或词性为空，标记为未处理成功
-                        if not definition or not part_of_speech:
-                            results.append({
-                                "word": word_data["word"],
-                                "definition": definition or "暂无解释",
-                                "part_of_speech": part_of_speech or "未知",
-                                "example": (processed_data.get("example") or "").strip() if processed_data.get("example") else "",
-                                "processed": False
-                            })
-                        else:
-                            results.append({
-                                "word": processed_data.get("word", word_data["word"]),
-                                "definition": definition,
-                                "part_of_speech": part_of_speech,
-                                "example": (processed_data.get("example") or "").strip() if processed_data.get("example") else "",
-                                "processed": True
-                            })
-                    except:
-                        results.append({
-                            "word": word_data["word"],
-                            "definition": word_data["definition"] or "暂无解释",
-                            "part_of_speech": word_data["part_of_speech"] or "未知",
-                            "example": "",
-                            "processed": False
-                        })
-                else:
+                except:
                     results.append({
                         "word": word_data["word"],
                         "definition": word_data["definition"] or "暂无解释",
@@ -1141,26 +1122,73 @@ def process_words_with_ai(words_data: list, language: str = 'en') -> list:
                         "example": "",
                         "processed": False
                     })
-            return results
+            else:
+                results.append({
+                    "word": word_data["word"],
+                    "definition": word_data["definition"] or "暂无解释",
+                    "part_of_speech": word_data["part_of_speech"] or "未知",
+                    "example": "",
+                    "processed": False
+                })
+        return results
+
+# 使用AI处理单词信息的函数 - 支持批量处理和多语言
+def process_words_with_ai(words_data: list, language: str = 'en') -> list:
+    """批量使用DeepSeek API处理多个单词信息，减少API调用次数，支持多语言"""
+    from openai import OpenAI
+    
+    try:
+        deepseek_api_key = _deepseek_api_key()
+        if not deepseek_api_key:
+            # 如果API密钥未设置，返回基础信息
+            return _fallback_word_results(words_data)
+        
+        # 初始化OpenAI客户端
+        client = OpenAI(
+            api_key=deepseek_api_key,
+            base_url="https://api.deepseek.com/v1"
+        )
+        
+        # 增加max_tokens以容纳批量处理的结果
+        max_tokens = min(4096, 500 * len(words_data))
+        
+        response = client.chat.completions.create(
+            model="deepseek-chat",
+            messages=_word_batch_messages(words_data, language),
+            temperature=0.3,  # 降低温度以获取更确定的结果
+            max_tokens=max_tokens
+        )
+        
+        return _parse_word_batch(response.choices[0].message.content.strip(), words_data)
     except Exception as e:
         logger.error(f"AI批量处理单词失败: {str(e)}", exc_info=True)
 
     # 失败时返回所有单词的原始信息
-    results = []
-    for word_data in words_data:
-        # 安全处理可能为None的值
-        word_text = word_data.get("word", "") or ""
-        definition = word_data.get("definition") or "暂无解释"
-        part_of_speech = word_data.get("part_of_speech") or "未知"
-        
-        results.append({
-            "word": word_text,
-            "definition": definition if definition else "暂无解释",
-            "part_of_speech": part_of_speech if part_of_speech else "未知",
-            "example": "",
-            "processed": False
-        })
-    return results
+    return _fallback_word_results(words_data)
+
+async def process_words_with_ai_async(client, words_data: list, language: str = 'en', max_tokens: int = 4096) -> list:
+    """
+    process_words_with_ai 的异步版本，使用调用方共享的 AsyncOpenAI 客户端，等待响应时不占用事件循环
+
+    Raises:
+        BatchTruncated: 输出被 max_tokens 截断（由调用方拆分批次重试）
+    """
+    try:
+        response = await client.chat.completions.create(
+            model="deepseek-chat",
+            messages=_word_batch_messages(words_data, language),
+            temperature=0.3,
+            max_tokens=max_tokens
+        )
+        choice = response.choices[0]
+        if choice.finish_reason == 'length':
+            raise vocabulary_utils.BatchTruncated(f"{len(words_data)} 个单词的结果超出 {max_tokens} tokens")
+        return _parse_word_batch(choice.message.content.strip(), words_data)
+    except vocabulary_utils.BatchTruncated:
+        raise
+    except Exception as e:
+        logger.error(f"AI批量处理单词失败: {str(e)}", exc_info=True)
+    return _fallback_word_results(words_data)
 
 # 保持向后兼容的单个单词处理函数
 def process_word_with_ai(word: str, existing_definition: str = "", existing_pos: str = "") -> dict:
@@ -1178,215 +1206,274 @@ def process_word_with_ai(word: str, existing_definition: str = "", existing_pos:
         "processed": False
     }
 
+def _prepare_vocabulary_task(db: Session, task_id: str, text_content: str, language: str, vocabulary_list_id: int):
+    """
+    单词表任务的准备阶段（在线程中运行）：提取单词、与总表配对，立即保存从总表找到的单词
+
+    Returns:
+        (任务, 需要AI处理的单词, 从总表复用的单词数)；任务不存在或没有提取到单词时返回None
+    """
+    # 更新任务状态为处理中
+    task = db.query(VocabularyUploadTask).filter(VocabularyUploadTask.task_id == task_id).first()
+    if not task:
+        logger.error(f"任务不存在: {task_id}")
+        return None
+    
+    task.status = 'processing'
+    task.message = '正在提取单词...'
+    db.commit()
+    
+    # 步骤1：先用AI提取单词列表
+    logger.info(f"任务 {task_id}: 开始使用AI提取单词列表...")
+    extracted_words = extract_words_with_ai(text_content, language)
+    logger.info(f"任务 {task_id}: AI提取到 {len(extracted_words)} 个单词")
+    
+    # 如果AI提取失败或提取的单词很少，尝试解析文件格式
+    if len(extracted_words) < 3:
+        logger.info(f"任务 {task_id}: AI提取的单词较少，尝试解析文件格式...")
+        words_from_file = []
+        # 简单提取单词（假设每行一个单词）
+        lines = text_content.split('\n')
+        for line in lines:
+            if line.strip():
+                word = line.strip().split('\t')[0].split(',')[0].strip()
+                if word:
+                    words_from_file.append(word.lower().strip())
+        extracted_words = list(set(extracted_words + words_from_file))
+        logger.info(f"任务 {task_id}: 合并后共有 {len(extracted_words)} 个单词")
+    
+    if not extracted_words:
+        task.status = 'failed'
+        task.error_message = "未能从文件中提取到有效的英语单词"
+        db.commit()
+        return None
+    
+    # 更新任务：设置总单词数
+    task.total_words = len(extracted_words)
+    task.processed_words = 0
+    task.progress = 0
+    task.message = f'共提取到 {len(extracted_words)} 个单词，开始处理...'
+    db.commit()
+    
+    # 步骤2：与总表配对（按语言匹配）
+    logger.info(f"任务 {task_id}: 开始与总表配对（语言: {language}）...")
+    # 对于非英语，不强制转小写（某些语言大小写敏感）
+    if language == 'en':
+        all_words_lower = [w.lower() for w in extracted_words]
+        existing_public_words = db.query(PublicVocabularyWord).filter(
+            PublicVocabularyWord.language == language,
+            func.lower(PublicVocabularyWord.word).in_(all_words_lower)
+        ).all()
+    else:
+        # 对于其他语言，直接匹配
+        existing_public_words = db.query(PublicVocabularyWord).filter(
+            PublicVocabularyWord.language == language,
+            PublicVocabularyWord.word.in_(extracted_words)
+        ).all()
+    
+    # 创建匹配映射（根据语言决定是否转小写）
+    if language == 'en':
+        public_word_map = {pw.word.lower(): pw for pw in existing_public_words}
+        found_words = []
+        words_to_process = []
+        for word in extracted_words:
+            word_lower = word.lower()
+            if word_lower in public_word_map:
+                found_words.append((word, public_word_map[word_lower]))
+            else:
+                words_to_process.append(word)
+    else:
+        public_word_map = {pw.word: pw for pw in existing_public_words}
+        found_words = []
+        words_to_process = []
+        for word in extracted_words:
+            if word in public_word_map:
+                found_words.append((word, public_word_map[word]))
+            else:
+                words_to_process.append(word)
+    
+    logger.info(f"任务 {task_id}: 总表配对完成: 找到 {len(found_words)} 个，需要AI处理 {len(words_to_process)} 个")
+    
+    # 步骤3：立即保存找到的单词
+    public_words_reused = 0
+    for word, public_word in found_words:
+        vocabulary_word = VocabularyWord(
+            vocabulary_list_id=vocabulary_list_id,
+            word=public_word.word,
+            definition=public_word.definition,
+            part_of_speech=public_word.part_of_speech,
+            example=public_word.example,
+            language=language
+        )
+        db.add(vocabulary_word)
+        public_word.usage_count += 1
+        public_words_reused += 1
+    
+    # 更新进度，与找到的单词一起提交
+    task.processed_words = public_words_reused
+    task.progress = int((public_words_reused / task.total_words) * 100) if task.total_words > 0 else 0
+    task.message = f'已匹配 {public_words_reused} 个单词，正在处理剩余 {len(words_to_process)} 个...'
+    db.commit()
+    logger.info(f"任务 {task_id}: 已保存 {public_words_reused} 个从总表找到的单词")
+    return task, words_to_process, public_words_reused
+
+def _save_enriched_batch(db: Session, task, language: str, vocabulary_list_id: int, processed_batch: list,
+                         done_words: int, saved_words: int) -> int:
+    """
+    保存一批AI处理完的单词，与任务进度在同一事务中提交（在线程中运行）
+
+    Args:
+        done_words: 包括这一批在内已经处理完（不论成功与否）的单词数，用于计算进度
+        saved_words: 这一批之前由AI补全并保存的单词数
+
+    Returns:
+        这一批保存的单词数
+    """
+    saved = 0
+    for processed_word in processed_batch:
+        # 检查是否处理成功，并且必需字段都有值
+        word_text = (processed_word.get("word") or "").strip()
+        definition_raw = processed_word.get("definition")
+        part_of_speech_raw = processed_word.get("part_of_speech")
+        
+        # 安全处理None值
+        definition = (definition_raw or "").strip() if definition_raw else ""
+        part_of_speech = (part_of_speech_raw or "").strip() if part_of_speech_raw else ""
+        
+        # 只有单词、释义和词性都有值时才保存
+        if (processed_word.get("processed", False) and 
+            word_text and 
+            definition and 
+            part_of_speech):
+            
+            # 保存到公共单词库（包含语言信息）
+            new_public_word = PublicVocabularyWord(
+                word=word_text,
+                language=language,
+                definition=definition.strip(),
+                part_of_speech=part_of_speech.strip(),
+                example=(processed_word.get("example") or "").strip(),
+                usage_count=1
+            )
+            db.add(new_public_word)
+            
+            # 添加到用户的单词表中（包含语言信息）
+            vocabulary_word = VocabularyWord(
+                vocabulary_list_id=vocabulary_list_id,
+                word=word_text,
+                definition=definition.strip(),
+                part_of_speech=part_of_speech.strip(),
+                example=(processed_word.get("example") or "").strip(),
+                language=language
+            )
+            db.add(vocabulary_word)
+            saved += 1
+        else:
+            # 记录处理失败的单词（安全处理字符串）
+            def safe_str(value, max_len=30):
+                if value is None:
+                    return 'None'
+                try:
+                    str_val = str(value)
+                    return str_val[:max_len] + '...' if len(str_val) > max_len else str_val
+                except:
+                    return f'<{type(value).__name__}>'
+            
+            logger.warning(f"任务 {task.task_id}: 单词 '{word_text}' 处理不完整，跳过保存。processed={processed_word.get('processed')}, definition={safe_str(definition)}, part_of_speech={safe_str(part_of_speech, 20)}")
+    
+    # 进度按已处理完的单词计算（处理不完整、未保存的单词也算处理完），批次完成顺序不影响
+    task.processed_words = done_words
+    task.progress = int((done_words / task.total_words) * 100) if task.total_words > 0 else 0
+    task.message = f'已处理 {done_words}/{task.total_words} 个单词 ({task.progress}%)，AI补全 {saved_words + saved} 个'
+    db.commit()
+    return saved
+
+def _finish_vocabulary_task(db: Session, task_id: str, task=None, error: Optional[Exception] = None, message: str = ''):
+    """标记任务完成或失败（在线程中运行）"""
+    if error is not None:
+        db.rollback()
+        task = db.query(VocabularyUploadTask).filter(VocabularyUploadTask.task_id == task_id).first()
+        if task:
+            task.status = 'failed'
+            task.error_message = str(error)
+            db.commit()
+        return
+    task.status = 'completed'
+    task.progress = 100
+    task.processed_words = task.total_words
+    task.message = message
+    db.commit()
+
 # 后台处理单词表任务
 async def process_vocabulary_task(task_id: str, text_content: str, name: str, description: Optional[str], language: str, user_id: int, vocabulary_list_id: int):
-    """后台处理单词表任务"""
+    """
+    后台处理单词表任务
+
+    在web进程的事件循环中运行，数据库操作和单词提取都放到线程中执行；总表中没有的单词按输出token预算分批，
+    通过异步客户端并发请求AI（并发数 VOCAB_AI_CONCURRENCY），每批完成后立即保存并更新进度
+    """
     from app import SessionLocal
+    from openai import AsyncOpenAI
     db = SessionLocal()
     try:
-        # 更新任务状态为处理中
-        task = db.query(VocabularyUploadTask).filter(VocabularyUploadTask.task_id == task_id).first()
-        if not task:
-            logger.error(f"任务不存在: {task_id}")
+        prepared = await anyio.to_thread.run_sync(_prepare_vocabulary_task, db, task_id, text_content, language,
+                                                  vocabulary_list_id)
+        if prepared is None:
             return
+        task, words_to_process, public_words_reused = prepared
+        # 任务对象只在线程中访问（提交后读取属性会查询数据库）
+        total_words = public_words_reused + len(words_to_process)
         
-        task.status = 'processing'
-        task.message = '正在提取单词...'
-        db.commit()
-        
-        # 步骤1：先用AI提取单词列表
-        logger.info(f"任务 {task_id}: 开始使用AI提取单词列表...")
-        extracted_words = extract_words_with_ai(text_content)
-        logger.info(f"任务 {task_id}: AI提取到 {len(extracted_words)} 个单词")
-        
-        # 如果AI提取失败或提取的单词很少，尝试解析文件格式
-        if len(extracted_words) < 3:
-            logger.info(f"任务 {task_id}: AI提取的单词较少，尝试解析文件格式...")
-            words_from_file = []
-            # 简单提取单词（假设每行一个单词）
-            lines = text_content.split('\n')
-            for line in lines:
-                if line.strip():
-                    word = line.strip().split('\t')[0].split(',')[0].strip()
-                    if word:
-                        words_from_file.append(word.lower().strip())
-            extracted_words = list(set(extracted_words + words_from_file))
-            logger.info(f"任务 {task_id}: 合并后共有 {len(extracted_words)} 个单词")
-        
-        if not extracted_words:
-            task.status = 'failed'
-            task.error_message = "未能从文件中提取到有效的英语单词"
-            db.commit()
-            return
-        
-        # 更新任务：设置总单词数
-        task.total_words = len(extracted_words)
-        task.processed_words = 0
-        task.progress = 0
-        task.message = f'共提取到 {len(extracted_words)} 个单词，开始处理...'
-        db.commit()
-        
-        # 步骤2：与总表配对（按语言匹配）
-        logger.info(f"任务 {task_id}: 开始与总表配对（语言: {language}）...")
-        # 对于非英语，不强制转小写（某些语言大小写敏感）
-        if language == 'en':
-            all_words_lower = [w.lower() for w in extracted_words]
-            existing_public_words = db.query(PublicVocabularyWord).filter(
-                PublicVocabularyWord.language == language,
-                func.lower(PublicVocabularyWord.word).in_(all_words_lower)
-            ).all()
-        else:
-            # 对于其他语言，直接匹配
-            existing_public_words = db.query(PublicVocabularyWord).filter(
-                PublicVocabularyWord.language == language,
-                PublicVocabularyWord.word.in_(extracted_words)
-            ).all()
-        
-        # 创建匹配映射（根据语言决定是否转小写）
-        if language == 'en':
-            public_word_map = {pw.word.lower(): pw for pw in existing_public_words}
-            found_words = []
-            words_to_process = []
-            for word in extracted_words:
-                word_lower = word.lower()
-                if word_lower in public_word_map:
-                    found_words.append((word, public_word_map[word_lower]))
-                else:
-                    words_to_process.append(word)
-        else:
-            public_word_map = {pw.word: pw for pw in existing_public_words}
-            found_words = []
-            words_to_process = []
-            for word in extracted_words:
-                if word in public_word_map:
-                    found_words.append((word, public_word_map[word]))
-                else:
-                    words_to_process.append(word)
-        
-        logger.info(f"任务 {task_id}: 总表配对完成: 找到 {len(found_words)} 个，需要AI处理 {len(words_to_process)} 个")
+        # 步骤4：分批并发处理未找到的单词
+        token_budget = getattr(app_settings, 'VOCAB_AI_TOKEN_BUDGET', 4096)
+        batches = vocabulary_utils.plan_batches(words_to_process, language, token_budget,
+                                                getattr(app_settings, 'VOCAB_AI_MAX_BATCH', 40))
+        concurrency = getattr(app_settings, 'VOCAB_AI_CONCURRENCY', 4)
+        logger.info(f"任务 {task_id}: {len(words_to_process)} 个单词分为 {len(batches)} 批，并发数 {concurrency}")
         
-        # 步骤3：立即保存找到的单词
-        public_words_reused = 0
-        for word, public_word in found_words:
-            vocabulary_word = VocabularyWord(
-                vocabulary_list_id=vocabulary_list_id,
-                word=public_word.word,
-                definition=public_word.definition,
-                part_of_speech=public_word.part_of_speech,
-                example=public_word.example,
-                language=language
-            )
-            db.add(vocabulary_word)
-            public_word.usage_count += 1
-            public_words_reused += 1
+        deepseek_api_key = _deepseek_api_key()
+        client = AsyncOpenAI(api_key=deepseek_api_key, base_url="https://api.deepseek.com/v1") if deepseek_api_key else None
         
-        db.commit()
-        logger.info(f"任务 {task_id}: 已保存 {public_words_reused} 个从总表找到的单词")
-        
-        # 更新进度
-        task.processed_words = public_words_reused
-        task.progress = int((public_words_reused / task.total_words) * 100) if task.total_words > 0 else 0
-        task.message = f'已匹配 {public_words_reused} 个单词，正在处理剩余 {len(words_to_process)} 个...'
-        db.commit()
+        async def enrich(batch_words: list) -> list:
+            batch_words_data = [{"word": w, "definition": "", "part_of_speech": "", "example": ""} for w in batch_words]
+            if client is None:
+                # 如果API密钥未设置，返回基础信息（不会被保存）
+                return _fallback_word_results(batch_words_data)
+            return await process_words_with_ai_async(client, batch_words_data, language, token_budget)
         
-        # 步骤4：分批处理未找到的单词
         words_processed_with_ai = 0
-        batch_size = 20
-        
-        for batch_start in range(0, len(words_to_process), batch_size):
-            batch_words = words_to_process[batch_start:batch_start + batch_size]
-            batch_num = (batch_start // batch_size) + 1
-            total_batches = (len(words_to_process) + batch_size - 1) // batch_size
-            
-            logger.info(f"任务 {task_id}: 处理批次 {batch_num}/{total_batches}: {len(batch_words)} 个单词")
-            
-            task.message = f'正在处理批次 {batch_num}/{total_batches}...'
-            db.commit()
-            
-            # 准备批量处理的单词数据
-            batch_words_data = [{"word": w, "definition": "", "part_of_speech": "", "example": ""} for w in batch_words]
-            
-            # 使用AI处理这一批单词（传入语言参数）
-            processed_batch = process_words_with_ai(batch_words_data, language=language)
-            
-            # 立即保存这一批处理完的单词
-            for processed_word in processed_batch:
-                # 检查是否处理成功，并且必需字段都有值
-                word_text = (processed_word.get("word") or "").strip()
-                definition_raw = processed_word.get("definition")
-                part_of_speech_raw = processed_word.get("part_of_speech")
-                
-                # 安全处理None值
-                definition = (definition_raw or "").strip() if definition_raw else ""
-                part_of_speech = (part_of_speech_raw or "").strip() if part_of_speech_raw else ""
-                
-                # 只有单词、释义和词性都有值时才保存
-                if (processed_word.get("processed", False) and 
-                    word_text and 
-                    definition and 
-                    part_of_speech):
-                    
-                    # 保存到公共单词库（包含语言信息）
-                    new_public_word = PublicVocabularyWord(
-                        word=word_text,
-                        language=language,
-                        definition=definition.strip(),
-                        part_of_speech=part_of_speech.strip(),
-                        example=(processed_word.get("example") or "").strip(),
-                        usage_count=1
-                    )
-                    db.add(new_public_word)
-                    
-                    # 添加到用户的单词表中（包含语言信息）
-                    vocabulary_word = VocabularyWord(
-                        vocabulary_list_id=vocabulary_list_id,
-                        word=word_text,
-                        definition=definition.strip(),
-                        part_of_speech=part_of_speech.strip(),
-                        example=(processed_word.get("example") or "").strip(),
-                        language=language
-                    )
-                    db.add(vocabulary_word)
-                    words_processed_with_ai += 1
-                else:
-                    # 记录处理失败的单词（安全处理字符串）
-                    def safe_str(value, max_len=30):
-                        if value is None:
-                            return 'None'
-                        try:
-                            str_val = str(value)
-                            return str_val[:max_len] + '...' if len(str_val) > max_len else str_val
-                        except:
-                            return f'<{type(value).__name__}>'
-                    
-                    logger.warning(f"任务 {task_id}: 单词 '{word_text}' 处理不完整，跳过保存。processed={processed_word.get('processed')}, definition={safe_str(definition)}, part_of_speech={safe_str(part_of_speech, 20)}")
-            
-            # 每处理完一批就提交一次
-            db.commit()
-            
-            # 更新进度
-            task.processed_words = public_words_reused + words_processed_with_ai
-            task.progress = int((task.processed_words / task.total_words) * 100) if task.total_words > 0 else 0
-            task.message = f'已处理 {task.processed_words}/{task.total_words} 个单词 ({task.progress}%)'
-            db.commit()
-            
-            logger.info(f"任务 {task_id}: 批次 {batch_num} 处理完成并已保存")
+        done_words = public_words_reused
+        results = vocabulary_utils.enrich_batches(batches, enrich, concurrency)
+        try:
+            async for batch_words, processed_batch in results:
+                done_words += len(batch_words)
+                if processed_batch is None:
+                    logger.warning(f"任务 {task_id}: 单词 '{batch_words[0]}' 的结果超出输出长度限制，跳过保存")
+                    processed_batch = []
+                # 结果按完成顺序逐批保存，保存期间其他批次的请求继续进行
+                words_processed_with_ai += await anyio.to_thread.run_sync(
+                    _save_enriched_batch, db, task, language, vocabulary_list_id, processed_batch,
+                    done_words, words_processed_with_ai
+                )
+                logger.info(f"任务 {task_id}: {len(batch_words)} 个单词处理完成并已保存（{done_words}/{total_words}）")
+        finally:
+            # 保存失败退出时立即关闭生成器，取消其余批次的请求（contextlib.aclosing 需要 Python 3.10）
+            await results.aclose()
+            if client is not None:
+                await client.close()
         
         # 任务完成
-        task.status = 'completed'
-        task.progress = 100
-        task.message = f'处理完成！共处理 {task.total_words} 个单词，其中 {public_words_reused} 个来自总表，{words_processed_with_ai} 个由AI处理'
-        db.commit()
+        skipped = len(words_to_process) - words_processed_with_ai
+        message = f'处理完成！共处理 {total_words} 个单词，其中 {public_words_reused} 个来自总表，{words_processed_with_ai} 个由AI处理'
+        if skipped:
+            message += f'，{skipped} 个处理不完整未保存'
+        await anyio.to_thread.run_sync(partial(_finish_vocabulary_task, db, task_id, task, message=message))
         
-        logger.info(f"任务 {task_id}: 处理完成！总单词数={task.total_words}, 复用={public_words_reused}, AI处理={words_processed_with_ai}")
+        logger.info(f"任务 {task_id}: 处理完成！总单词数={total_words}, 复用={public_words_reused}, AI处理={words_processed_with_ai}")
         
     except Exception as e:
         logger.error(f"任务 {task_id} 处理失败: {str(e)}", exc_info=True)
-        task = db.query(VocabularyUploadTask).filter(VocabularyUploadTask.task_id == task_id).first()
-        if task:
-            task.status = 'failed'
-            task.error_message = str(e)
-            db.commit()
+        await anyio.to_thread.run_sync(partial(_finish_vocabulary_task, db, task_id, error=e))
     finally:
         db.close()
 
@@ -0,0 +1,31 @@
+-- =====================================================
+-- 数据库迁移脚本
+-- 云盘变更日志（增量同步）
+-- 执行日期: 2026-10-19
+-- =====================================================
+
+-- 步骤 1: 变更日志表，序号取自变更后的目录版本号，同一用户内单调递增
+CREATE TABLE IF NOT EXISTS `cloud_disk_changes` (
+    `id` INT NOT NULL AUTO_INCREMENT PRIMARY KEY COMMENT '主键',
+    `user_id` INT NOT NULL COMMENT '用户ID',
+    `seq` BIGINT NOT NULL COMMENT '变更序号（变更后的目录版本号）',
+    `entity_type` VARCHAR(16) NOT NULL COMMENT '对象类型：file / folder',
+    `action` VARCHAR(16) NOT NULL COMMENT '操作：create / update / move / delete / rename',
+    `file_id` INT NULL COMMENT '文件ID（文件变更）',
+    `path` VARCHAR(500) NULL COMMENT '文件夹路径（文件夹变更）',
+    `new_path` VARCHAR(500) NULL COMMENT '重命名后的文件夹路径',
+    `created_at` DATETIME DEFAULT CURRENT_TIMESTAMP COMMENT '创建时间',
+    INDEX `idx_cloud_disk_changes_user_seq` (`user_id`, `seq`),
+    INDEX `ix_cloud_disk_changes_created_at` (`created_at`),
+    CONSTRAINT `fk_cloud_disk_changes_user` FOREIGN KEY (`user_id`) REFERENCES `users` (`id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='云盘变更日志表';
+
+-- 步骤 2: 记录已清理的变更日志的最大序号，游标早于该值的客户端需要重新拉取完整目录树
+ALTER TABLE cloud_disk_states
+ADD COLUMN journal_floor BIGINT NOT NULL DEFAULT 0 COMMENT '已清理的变更日志的最大序号';
+
+-- =====================================================
+-- 回滚脚本（如果需要）
+-- =====================================================
+-- DROP TABLE IF EXISTS cloud_disk_changes;
+-- ALTER TABLE cloud_disk_states DROP COLUMN journal_floor;
@@ -0,0 +1,19 @@
+-- =====================================================
+-- 数据库迁移脚本
+-- 冷存储分层（长期没有下载的blob移到冷存储并重新压缩）
+-- 执行日期: 2026-10-19
+-- =====================================================
+
+-- tier 为空表示热存储；last_accessed_at 由下载批量写回（按小时精度），为空的已有blob从分层任务首次运行时开始计时
+ALTER TABLE `file_blobs`
+    ADD COLUMN `tier` VARCHAR(8) NULL COMMENT '存储层：cold 为冷存储，为空表示热存储' AFTER `codec`,
+    ADD COLUMN `stored_size` BIGINT NULL COMMENT '在磁盘上的大小（压缩后）' AFTER `tier`,
+    ADD COLUMN `last_accessed_at` DATETIME NULL COMMENT '最后一次被下载的时间（按小时精度批量更新）' AFTER `stored_size`;
+
+CREATE INDEX `idx_file_blobs_tier_access` ON `file_blobs` (`tier`, `last_accessed_at`);
+
+-- =====================================================
+-- 回滚脚本（如果需要，先把冷存储中的blob移回 blobs/ 并还原 files.save_path）
+-- =====================================================
+-- DROP INDEX `idx_file_blobs_tier_access` ON `file_blobs`;
+-- ALTER TABLE `file_blobs` DROP COLUMN `tier`, DROP COLUMN `stored_size`, DROP COLUMN `last_accessed_at`;
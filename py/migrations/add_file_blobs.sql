@@ -0,0 +1,27 @@
+-- =====================================================
+-- 数据库迁移脚本
+-- 云盘内容寻址去重存储（秒传）
+-- 执行日期: 2026-10-19
+-- =====================================================
+
+-- 步骤 1: 创建共享blob表，按SHA-256去重并记录引用计数
+CREATE TABLE IF NOT EXISTS `file_blobs` (
+    `sha256` VARCHAR(64) NOT NULL PRIMARY KEY COMMENT '内容SHA-256',
+    `file_size` BIGINT NOT NULL COMMENT '文件大小（字节）',
+    `ref_count` INT NOT NULL DEFAULT 0 COMMENT '引用该blob的文件记录数',
+    `created_at` DATETIME DEFAULT CURRENT_TIMESTAMP COMMENT '创建时间',
+    KEY `idx_file_blobs_ref_count` (`ref_count`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='云盘共享blob表';
+
+-- 步骤 2: files 表记录内容哈希（为空表示旧的独占存储文件）
+ALTER TABLE files
+ADD COLUMN content_hash VARCHAR(64) NULL COMMENT '内容SHA-256，非空时save_path指向共享blob';
+
+CREATE INDEX idx_files_content_hash ON files(content_hash);
+
+-- =====================================================
+-- 回滚脚本（如果需要）
+-- =====================================================
+-- DROP INDEX idx_files_content_hash ON files;
+-- ALTER TABLE files DROP COLUMN content_hash;
+-- DROP TABLE IF EXISTS file_blobs;
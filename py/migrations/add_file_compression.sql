@@ -0,0 +1,20 @@
+-- =====================================================
+-- 数据库迁移脚本
+-- 云盘存储压缩（zstd）
+-- 执行日期: 2026-10-19
+-- =====================================================
+
+-- 步骤 1: blob 记录自身的存储编码（为空表示原样存储）
+ALTER TABLE file_blobs
+ADD COLUMN codec VARCHAR(16) NULL COMMENT 'blob的存储压缩编码，为空表示原样存储';
+
+-- 步骤 2: files 表冗余记录压缩编码，下载时无需再查询 file_blobs
+ALTER TABLE files
+ADD COLUMN compression VARCHAR(16) NULL COMMENT '存储压缩编码（如zstd），为空表示原样存储';
+
+-- =====================================================
+-- 回滚脚本（如果需要）
+-- 注意：回滚前需确认没有以压缩编码存储的blob
+-- =====================================================
+-- ALTER TABLE files DROP COLUMN compression;
+-- ALTER TABLE file_blobs DROP COLUMN codec;
@@ -0,0 +1,28 @@
+-- =====================================================
+-- 数据库迁移脚本
+-- 云盘文件分享链接
+-- 执行日期: 2026-10-19
+-- =====================================================
+
+-- 按分享码公开访问，下载次数用 UPDATE ... WHERE download_count < max_downloads 原子递增
+CREATE TABLE IF NOT EXISTS `file_share_links` (
+    `id` INT NOT NULL AUTO_INCREMENT PRIMARY KEY COMMENT '主键',
+    `share_code` VARCHAR(32) NOT NULL COMMENT '分享码（链接中的随机字符串）',
+    `file_id` INT NOT NULL COMMENT '文件ID（文件删除后分享失效，不设外键）',
+    `user_id` INT NOT NULL COMMENT '分享者ID',
+    `password_hash` VARCHAR(255) NULL COMMENT '分享密码哈希（werkzeug），为空表示不需要密码',
+    `expires_at` DATETIME NULL COMMENT '过期时间，为空表示永不过期',
+    `max_downloads` INT NULL COMMENT '最大下载次数，为空表示不限制',
+    `download_count` INT NOT NULL DEFAULT 0 COMMENT '已下载次数',
+    `is_active` TINYINT(1) NOT NULL DEFAULT 1 COMMENT '是否有效，撤销后为0',
+    `created_at` DATETIME DEFAULT CURRENT_TIMESTAMP COMMENT '创建时间',
+    UNIQUE KEY `share_code` (`share_code`),
+    INDEX `ix_file_share_links_file_id` (`file_id`),
+    INDEX `ix_file_share_links_user_id` (`user_id`),
+    CONSTRAINT `file_share_links_ibfk_1` FOREIGN KEY (`user_id`) REFERENCES `users` (`id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='云盘文件分享链接表';
+
+-- =====================================================
+-- 回滚脚本（如果需要）
+-- =====================================================
+-- DROP TABLE IF EXISTS file_share_links;
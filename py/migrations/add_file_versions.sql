@@ -0,0 +1,33 @@
+-- =====================================================
+-- 数据库迁移脚本
+-- 文件历史版本（按块去重保存）
+-- 执行日期: 2026-10-19
+-- =====================================================
+
+-- 在线编辑保存时记录版本，manifest 为依次排列的块SHA-256（每个32字节）
+CREATE TABLE IF NOT EXISTS `file_versions` (
+    `id` INT NOT NULL AUTO_INCREMENT PRIMARY KEY COMMENT '主键',
+    `file_id` INT NOT NULL COMMENT '文件ID（文件删除后由清理任务回收版本）',
+    `user_id` INT NOT NULL COMMENT '用户ID',
+    `content_hash` VARCHAR(64) NOT NULL COMMENT '版本内容的SHA-256',
+    `file_size` BIGINT NOT NULL COMMENT '版本内容大小（字节）',
+    `manifest` MEDIUMBLOB NOT NULL COMMENT '块清单',
+    `created_at` DATETIME DEFAULT CURRENT_TIMESTAMP COMMENT '保存时间',
+    INDEX `idx_file_versions_file` (`file_id`, `id`),
+    INDEX `ix_file_versions_created_at` (`created_at`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='文件历史版本表';
+
+-- 版本内容块，按SHA-256去重，ref_count 为引用该块的版本数，归零后由清理任务删除
+CREATE TABLE IF NOT EXISTS `file_chunks` (
+    `sha256` VARCHAR(64) NOT NULL PRIMARY KEY COMMENT '块内容SHA-256',
+    `size` INT NOT NULL COMMENT '块大小（字节）',
+    `stored_size` INT NOT NULL COMMENT '压缩后在磁盘上的大小',
+    `ref_count` INT NOT NULL DEFAULT 0 COMMENT '引用该块的版本数',
+    INDEX `ix_file_chunks_ref_count` (`ref_count`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='文件版本内容块表';
+
+-- =====================================================
+-- 回滚脚本（如果需要）
+-- =====================================================
+-- DROP TABLE IF EXISTS file_versions;
+-- DROP TABLE IF EXISTS file_chunks;
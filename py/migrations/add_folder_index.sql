@@ -0,0 +1,32 @@
+-- =====================================================
+-- 数据库迁移脚本
+-- 云盘文件夹索引与目录树缓存版本号
+-- 执行日期: 2026-10-19
+-- =====================================================
+
+-- 步骤 1: 文件夹记录父路径，按层级列出子文件夹
+ALTER TABLE user_folders
+ADD COLUMN parent_path VARCHAR(500) NULL COMMENT '父文件夹路径，按层级列出子文件夹时使用';
+
+CREATE INDEX idx_user_folders_parent ON user_folders(user_id, parent_path);
+
+-- 步骤 2: 按文件夹列出文件
+CREATE INDEX idx_files_user_folder ON files(user_id, folder_path);
+
+-- 步骤 3: 用户云盘版本号，任何变更都会递增，用于目录树缓存失效
+CREATE TABLE IF NOT EXISTS `cloud_disk_states` (
+    `user_id` INT NOT NULL PRIMARY KEY COMMENT '用户ID',
+    `tree_version` BIGINT NOT NULL DEFAULT 0 COMMENT '云盘目录版本号，任何变更都会递增',
+    `updated_at` DATETIME DEFAULT CURRENT_TIMESTAMP COMMENT '更新时间',
+    CONSTRAINT `fk_cloud_disk_states_user` FOREIGN KEY (`user_id`) REFERENCES `users` (`id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='用户云盘状态表';
+
+-- parent_path 的历史数据以及只存在于文件记录中的文件夹，由应用启动时自动补齐
+
+-- =====================================================
+-- 回滚脚本（如果需要）
+-- =====================================================
+-- DROP TABLE IF EXISTS cloud_disk_states;
+-- DROP INDEX idx_files_user_folder ON files;
+-- DROP INDEX idx_user_folders_parent ON user_folders;
+-- ALTER TABLE user_folders DROP COLUMN parent_path;
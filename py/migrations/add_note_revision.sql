@@ -0,0 +1,14 @@
+-- =====================================================
+-- 数据库迁移脚本
+-- 笔记修订号（自动保存的冲突检测）
+-- 执行日期: 2026-10-19
+-- =====================================================
+
+-- 每次保存递增；增量保存时客户端提交所基于的修订号，不一致时拒绝
+ALTER TABLE `notes`
+    ADD COLUMN `revision` INT NOT NULL DEFAULT 0 COMMENT '修订号，每次保存递增，用于冲突检测' AFTER `file_path`;
+
+-- =====================================================
+-- 回滚脚本（如果需要）
+-- =====================================================
+-- ALTER TABLE `notes` DROP COLUMN `revision`;
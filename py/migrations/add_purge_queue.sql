@@ -0,0 +1,21 @@
+-- =====================================================
+-- 数据库迁移脚本
+-- 云盘删除队列（后台分批清理存储）
+-- 执行日期: 2026-10-19
+-- =====================================================
+
+-- 删除文件夹/注销账户时只批量删除记录并登记待清理的存储，
+-- 由后台清理任务分批释放blob引用、删除磁盘文件和用户目录，重启后继续处理
+CREATE TABLE IF NOT EXISTS `cloud_disk_purge_queue` (
+    `id` INT NOT NULL AUTO_INCREMENT PRIMARY KEY COMMENT '主键',
+    `user_id` INT NOT NULL COMMENT '用户ID（账户可能已删除，不设外键）',
+    `content_hash` VARCHAR(64) NULL COMMENT '要释放引用的blob',
+    `ref_count` INT NOT NULL DEFAULT 0 COMMENT '要释放的引用数',
+    `path` VARCHAR(500) NULL COMMENT '要删除的磁盘文件或目录',
+    `created_at` DATETIME DEFAULT CURRENT_TIMESTAMP COMMENT '创建时间'
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='云盘删除队列表';
+
+-- =====================================================
+-- 回滚脚本（如果需要）
+-- =====================================================
+-- DROP TABLE IF EXISTS cloud_disk_purge_queue;
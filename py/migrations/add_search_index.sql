@@ -0,0 +1,45 @@
+-- =====================================================
+-- 数据库迁移脚本
+-- 云盘文件和笔记的全文搜索索引
+-- 执行日期: 2026-10-19
+-- =====================================================
+
+-- 每个已索引的文件/笔记一行，保存提取的文本（截断）用于生成摘要
+CREATE TABLE IF NOT EXISTS `search_documents` (
+    `id` INT NOT NULL AUTO_INCREMENT PRIMARY KEY COMMENT '主键',
+    `user_id` INT NOT NULL COMMENT '用户ID',
+    `source_type` VARCHAR(8) NOT NULL COMMENT '来源：file / note',
+    `source_id` INT NOT NULL COMMENT '文件ID或笔记ID',
+    `title` VARCHAR(255) NOT NULL COMMENT '标题（文件名或笔记标题）',
+    `version` VARCHAR(255) NULL COMMENT '内容版本（文件为content_hash，笔记为文件路径），未变化时不重新提取',
+    `length` INT NOT NULL DEFAULT 0 COMMENT '词元数量（BM25文档长度）',
+    `content` MEDIUMTEXT NULL COMMENT '提取的文本',
+    `indexed_at` DATETIME DEFAULT CURRENT_TIMESTAMP COMMENT '索引时间',
+    UNIQUE KEY `unique_search_document_source` (`user_id`, `source_type`, `source_id`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='全文搜索文档表';
+
+-- 倒排表，词已归一化，按二进制比较
+CREATE TABLE IF NOT EXISTS `search_postings` (
+    `doc_id` INT NOT NULL COMMENT '文档ID',
+    `term` VARCHAR(64) CHARACTER SET utf8mb4 COLLATE utf8mb4_bin NOT NULL COMMENT '词',
+    `user_id` INT NOT NULL COMMENT '用户ID',
+    `tf` INT NOT NULL COMMENT '词频',
+    PRIMARY KEY (`doc_id`, `term`),
+    INDEX `idx_search_postings_user_term` (`user_id`, `term`, `tf`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='全文搜索倒排表';
+
+-- 索引进度：文件按云盘变更日志增量索引，笔记按版本号比对
+CREATE TABLE IF NOT EXISTS `search_states` (
+    `user_id` INT NOT NULL PRIMARY KEY COMMENT '用户ID',
+    `file_seq` BIGINT NULL COMMENT '已索引到的云盘变更序号，为空时全量比对',
+    `notes_version` BIGINT NOT NULL DEFAULT 0 COMMENT '笔记版本号，笔记增删改时递增',
+    `notes_seq` BIGINT NULL COMMENT '已索引到的笔记版本号',
+    `updated_at` DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP COMMENT '更新时间'
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='全文索引进度表';
+
+-- =====================================================
+-- 回滚脚本（如果需要）
+-- =====================================================
+-- DROP TABLE IF EXISTS search_postings;
+-- DROP TABLE IF EXISTS search_documents;
+-- DROP TABLE IF EXISTS search_states;
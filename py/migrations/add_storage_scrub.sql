@@ -0,0 +1,46 @@
+-- =====================================================
+-- 数据库迁移脚本
+-- 存储完整性校验（后台重算blob/版本块的SHA-256）
+-- 执行日期: 2026-10-19
+-- =====================================================
+
+-- 校验进度，只有一行（id=1）；last_sha256 为当前阶段已校验到的位置，重启后从游标继续
+CREATE TABLE IF NOT EXISTS `storage_scrub_state` (
+    `id` INT NOT NULL PRIMARY KEY COMMENT '固定为1',
+    `phase` VARCHAR(8) NOT NULL DEFAULT 'blob' COMMENT '正在校验的对象：blob / chunk',
+    `last_sha256` VARCHAR(64) NOT NULL DEFAULT '' COMMENT '当前阶段已校验到的SHA-256',
+    `lease_owner` VARCHAR(64) NULL COMMENT '正在执行校验的进程',
+    `lease_until` DATETIME NULL COMMENT '校验租约到期时间，过期后其他进程可以接手',
+    `pass_started_at` DATETIME NULL COMMENT '本轮开始时间，为空表示两轮之间',
+    `pass_files` BIGINT NOT NULL DEFAULT 0 COMMENT '本轮已校验的文件数',
+    `pass_bytes` BIGINT NOT NULL DEFAULT 0 COMMENT '本轮已读取的字节数',
+    `pass_cpu_seconds` DOUBLE NOT NULL DEFAULT 0 COMMENT '本轮校验线程的CPU时间',
+    `pass_wall_seconds` DOUBLE NOT NULL DEFAULT 0 COMMENT '本轮校验耗时（含限速等待）',
+    `last_pass_started_at` DATETIME NULL COMMENT '上一轮开始时间',
+    `last_pass_finished_at` DATETIME NULL COMMENT '上一轮完成时间',
+    `last_pass_files` BIGINT NOT NULL DEFAULT 0,
+    `last_pass_bytes` BIGINT NOT NULL DEFAULT 0,
+    `last_pass_cpu_seconds` DOUBLE NOT NULL DEFAULT 0,
+    `last_pass_wall_seconds` DOUBLE NOT NULL DEFAULT 0
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='存储完整性校验进度表';
+
+-- 校验发现的问题，每个blob/版本块一行；之后校验通过时记录解决时间
+CREATE TABLE IF NOT EXISTS `storage_scrub_findings` (
+    `id` INT NOT NULL AUTO_INCREMENT PRIMARY KEY COMMENT '主键',
+    `object_type` VARCHAR(8) NOT NULL COMMENT 'blob / chunk',
+    `sha256` VARCHAR(64) NOT NULL COMMENT '记录的SHA-256（即存储文件名）',
+    `problem` VARCHAR(16) NOT NULL COMMENT 'mismatch（内容与哈希不符） / missing / unreadable',
+    `actual_hash` VARCHAR(64) NULL COMMENT '重新计算得到的SHA-256',
+    `detail` VARCHAR(255) NULL COMMENT '读取错误信息',
+    `detected_at` DATETIME DEFAULT CURRENT_TIMESTAMP COMMENT '首次发现时间',
+    `checked_at` DATETIME DEFAULT CURRENT_TIMESTAMP COMMENT '最近一次校验时间',
+    `resolved_at` DATETIME NULL COMMENT '再次校验通过的时间',
+    UNIQUE KEY `uq_scrub_findings_object` (`object_type`, `sha256`),
+    INDEX `ix_storage_scrub_findings_resolved_at` (`resolved_at`)
+) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci COMMENT='存储完整性校验问题表';
+
+-- =====================================================
+-- 回滚脚本（如果需要）
+-- =====================================================
+-- DROP TABLE IF EXISTS storage_scrub_state;
+-- DROP TABLE IF EXISTS storage_scrub_findings;
@@ -0,0 +1,27 @@
+-- =====================================================
+-- 数据库迁移脚本
+-- 云盘用量计数与空间配额
+-- 执行日期: 2026-10-19
+-- =====================================================
+
+-- 步骤 1: 用户用量计数和配额，上传/修改/删除时在同一事务中更新
+ALTER TABLE cloud_disk_states
+ADD COLUMN used_bytes BIGINT NOT NULL DEFAULT 0 COMMENT '已用空间（字节，按文件记录计算）',
+ADD COLUMN file_count INT NOT NULL DEFAULT 0 COMMENT '文件数量',
+ADD COLUMN quota_bytes BIGINT NULL COMMENT '空间配额（字节），为空时使用默认配额，0 表示不限制';
+
+-- 步骤 2: 文件夹用量计数（含子文件夹）
+ALTER TABLE user_folders
+ADD COLUMN file_count INT NOT NULL DEFAULT 0 COMMENT '文件夹内（含子文件夹）的文件数量',
+ADD COLUMN total_size BIGINT NOT NULL DEFAULT 0 COMMENT '文件夹内（含子文件夹）的文件总大小';
+
+-- 已有数据的计数由应用启动后的校对任务按文件记录补齐，之后按 USAGE_RECONCILE_INTERVAL_HOURS 定期校对
+
+-- 为单个用户设置配额示例（20GB）:
+-- UPDATE cloud_disk_states SET quota_bytes = 21474836480 WHERE user_id = 1;
+
+-- =====================================================
+-- 回滚脚本（如果需要）
+-- =====================================================
+-- ALTER TABLE user_folders DROP COLUMN total_size, DROP COLUMN file_count;
+-- ALTER TABLE cloud_disk_states DROP COLUMN quota_bytes, DROP COLUMN file_count, DROP COLUMN used_bytes;
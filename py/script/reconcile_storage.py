@@ -0,0 +1,37 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+存储对账脚本
+规范化文件记录的 save_path 为存储键，报告（--fix 时删除）孤儿文件，报告数据库有记录但磁盘上缺失的文件。
+与后台定期执行的对账相同，见 app.reconcile_storage。
+
+    python script/reconcile_storage.py                # 只报告
+    python script/reconcile_storage.py --fix          # 写回路径并删除超过宽限期的孤儿
+    python script/reconcile_storage.py --fix --grace-hours 0
+"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="云盘存储对账")
+    parser.add_argument('--fix', action='store_true', help="写回规范化的路径并删除孤儿文件")
+    parser.add_argument('--grace-hours', type=float, default=None, help="孤儿文件的宽限期（小时）")
+    parser.add_argument('--workers', type=int, default=None, help="并行扫描目录的线程数")
+    args = parser.parse_args()
+
+    import app
+    if args.grace_hours is not None:
+        app.settings.RECONCILE_ORPHAN_GRACE_HOURS = args.grace_hours
+    if args.workers:
+        app.settings.RECONCILE_WORKERS = args.workers
+    report = app.reconcile_storage(fix=args.fix)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,43 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+冷存储分层脚本
+把超过天数没有被下载的blob移到冷存储目录并重新压缩，输出节省的空间和移动前后的读取延迟。
+与后台定期执行的分层相同，见 app.tier_cold_blobs。
+
+    python script/tier_cold_storage.py                    # 使用 COLD_TIER_AFTER_DAYS
+    python script/tier_cold_storage.py --after-days 90 --level 19
+"""
+import argparse
+import asyncio
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="云盘冷存储分层")
+    parser.add_argument('--after-days', type=float, default=None, help="超过多少天没有下载的文件移到冷存储")
+    parser.add_argument('--level', type=int, default=None, help="冷存储的zstd压缩级别")
+    args = parser.parse_args()
+
+    import app
+    if args.after_days is not None:
+        app.settings.COLD_TIER_AFTER_DAYS = args.after_days
+    if args.level is not None:
+        app.settings.COLD_COMPRESSION_LEVEL = args.level
+    app.settings.ensure_directories()
+
+    async def run():
+        try:
+            return await app.tier_cold_blobs()
+        finally:
+            app.compression_utils.shutdown_pool()
+
+    print(json.dumps(asyncio.run(run()), ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
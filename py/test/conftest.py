@@ -0,0 +1,108 @@
+"""
+云盘接口测试的公共夹具：app 使用临时目录中的 sqlite 数据库和存储目录，登录用户由测试指定
+"""
+import uuid
+
+import pytest
+from fastapi.testclient import TestClient
+from sqlalchemy import event
+
+STORAGE_DIRS = {
+    'BLOB_DIR': 'cloud_disk/blobs',
+    'BLOB_TMP_DIR': 'cloud_disk/blobs/tmp',
+    'UPLOAD_SESSION_DIR': 'cloud_disk/upload_sessions',
+    'THUMBNAIL_DIR': 'cloud_disk/thumbnails',
+    'LINE_INDEX_DIR': 'cloud_disk/line_index',
+    'IMAGE_RENDITION_DIR': 'cloud_disk/renditions',
+    'VERSION_CHUNK_DIR': 'cloud_disk/version_chunks',
+    'COLD_BLOB_DIR': 'cold_volume/blobs',
+}
+
+
+class CloudDisk:
+    """测试客户端：创建用户、切换登录用户、打开数据库会话"""
+
+    def __init__(self, appmod, root):
+        self.app = appmod
+        self.root = root
+        self.client = TestClient(appmod.app)
+        self.user_id = None
+
+        async def current_user():
+            db = appmod.SessionLocal()
+            try:
+                user = db.get(appmod.User, self.user_id)
+                db.expunge(user)
+                return user
+            finally:
+                db.close()
+
+        appmod.app.dependency_overrides[appmod.get_current_user] = current_user
+
+    def new_user(self, login: bool = True) -> int:
+        name = uuid.uuid4().hex[:12]
+        with self.app.SessionLocal() as db:
+            user = self.app.User(username=name, email=f'{name}@example.com', password_hash='x')
+            db.add(user)
+            db.commit()
+            user_id = user.id
+        if login:
+            self.login(user_id)
+        return user_id
+
+    def login(self, user_id: int):
+        self.user_id = user_id
+
+    def session(self):
+        return self.app.SessionLocal()
+
+    def upload(self, files, folder_path: str = '/'):
+        """上传 {文件名: 内容}，返回响应"""
+        return self.client.post(
+            '/api/cloud_disk/upload',
+            data={'folder_path': folder_path},
+            files=[('files', (name, content, 'application/octet-stream')) for name, content in files.items()],
+        )
+
+
+@pytest.fixture(scope='session')
+def cloud_app(tmp_path_factory):
+    root = tmp_path_factory.mktemp('cloud_app')
+    from config import Settings, settings
+    values = {
+        'DATABASE_URL': f"sqlite:///{root / 'app.db'}",
+        'UPLOAD_DIR': root / 'uploads',
+        'CLOUD_DISK_DIR': root / 'cloud_disk',
+        **{name: root / relative for name, relative in STORAGE_DIRS.items()},
+    }
+    # 类方法读取类属性；其他测试用 monkeypatch 改过 settings 后，恢复时会在实例上留下默认值，实例上也要设置
+    for name, value in values.items():
+        setattr(Settings, name, value)
+        setattr(settings, name, value)
+    Settings.ensure_directories()
+
+    import app as appmod
+
+    # pysqlite 默认的事务处理不支持 SAVEPOINT（begin_nested），按 SQLAlchemy 文档的方式由驱动外控制事务；
+    # WAL 模式下请求会话未结束的读事务不会阻塞后台任务的写入（与 MySQL 的行为一致）
+    @event.listens_for(appmod.engine, 'connect')
+    def _connect(dbapi_connection, connection_record):
+        dbapi_connection.isolation_level = None
+        dbapi_connection.execute('PRAGMA journal_mode=WAL')
+
+    @event.listens_for(appmod.engine, 'begin')
+    def _begin(connection):
+        connection.exec_driver_sql('BEGIN')
+
+    appmod.engine.dispose()
+    appmod.Base.metadata.create_all(appmod.engine)
+    return appmod, root
+
+
+@pytest.fixture
+def cloud(cloud_app):
+    appmod, root = cloud_app
+    disk = CloudDisk(appmod, root)
+    disk.new_user()
+    yield disk
+    appmod.app.dependency_overrides.pop(appmod.get_current_user, None)
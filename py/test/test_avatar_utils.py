@@ -0,0 +1,59 @@
+"""
+头像工具测试：一次解码生成各尺寸WebP/JPEG、内容哈希文件名、透明图片、文件清理
+"""
+import io
+
+from PIL import Image
+
+from utils import avatar_utils
+
+
+def _png(size=(640, 480), mode='RGB') -> bytes:
+    buf = io.BytesIO()
+    Image.new(mode, size, (10, 120, 200, 128)[:len(mode)]).save(buf, 'PNG')
+    return buf.getvalue()
+
+
+def test_render_all_variants(tmp_path):
+    digest = avatar_utils.render_avatar(_png(), 12, str(tmp_path))
+
+    assert len(digest) == 16
+    expected = {avatar_utils.variant_filename(12, digest, size, ext)
+                for size in avatar_utils.AVATAR_SIZES for ext in avatar_utils.FORMATS}
+    assert {p.name for p in tmp_path.iterdir()} == expected
+    for size in avatar_utils.AVATAR_SIZES:
+        with Image.open(tmp_path / avatar_utils.variant_filename(12, digest, size, 'webp')) as image:
+            assert image.format == 'WEBP'
+            assert image.size == (size, size)
+        with Image.open(tmp_path / avatar_utils.variant_filename(12, digest, size, 'jpg')) as image:
+            assert image.format == 'JPEG'
+            assert image.size == (size, size)
+
+
+def test_digest_follows_content(tmp_path):
+    first = avatar_utils.render_avatar(_png(), 12, str(tmp_path))
+    assert avatar_utils.render_avatar(_png(), 12, str(tmp_path)) == first
+    assert avatar_utils.render_avatar(_png(mode='RGBA'), 12, str(tmp_path)) != first
+
+
+def test_filenames_and_urls():
+    assert avatar_utils.is_valid_filename('12_0123456789abcdef_80.webp')
+    assert avatar_utils.is_valid_filename('12_legacy-uuid.jpg')
+    assert not avatar_utils.is_valid_filename('../12_a.jpg')
+    assert avatar_utils.media_type('12_0123456789abcdef_80.webp') == 'image/webp'
+
+    urls = avatar_utils.variant_urls('/api/users/avatar/', 12, '0123456789abcdef')
+    assert urls['40']['webp'] == '/api/users/avatar/12_0123456789abcdef_40.webp'
+    assert set(urls) == {str(size) for size in avatar_utils.AVATAR_SIZES}
+
+
+def test_remove_all_variants(tmp_path):
+    digest = avatar_utils.render_avatar(_png(), 12, str(tmp_path))
+    legacy = tmp_path / '12_old.jpg'
+    legacy.write_bytes(b'jpg')
+
+    url = f"/api/users/avatar/{avatar_utils.variant_filename(12, digest)}"
+    assert avatar_utils.remove_avatar_files(tmp_path, url) == 6
+    assert avatar_utils.remove_avatar_files(tmp_path, '/api/users/avatar/12_old.jpg') == 1
+    assert avatar_utils.remove_avatar_files(tmp_path, None) == 0
+    assert list(tmp_path.iterdir()) == []
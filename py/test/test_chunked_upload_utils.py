@@ -0,0 +1,84 @@
+"""
+分片续传工具测试
+"""
+import asyncio
+import hashlib
+import json
+
+import pytest
+
+from config import settings
+from utils import chunked_upload_utils
+
+
+async def _stream(data: bytes, piece: int = 1000):
+    for i in range(0, len(data), piece):
+        yield data[i:i + piece]
+
+
+@pytest.fixture
+def upload_dirs(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, 'BLOB_DIR', tmp_path / 'blobs')
+    monkeypatch.setattr(settings, 'BLOB_TMP_DIR', tmp_path / 'blobs' / 'tmp')
+    monkeypatch.setattr(settings, 'UPLOAD_SESSION_DIR', tmp_path / 'sessions')
+    monkeypatch.setattr(settings, 'UPLOAD_CHUNK_MIN_SIZE', 1)
+    return tmp_path
+
+
+def _save(session, index, data):
+    checksum = hashlib.sha256(data).hexdigest()
+    return asyncio.run(chunked_upload_utils.save_chunk(session, index, _stream(data), checksum))
+
+
+def test_out_of_order_chunks_assemble_to_original(upload_dirs):
+    data = bytes(range(256)) * 40
+    session = chunked_upload_utils.create_session(
+        7, 'video.mp4', len(data), '/', 'video/mp4', chunk_size=4096,
+        sha256=hashlib.sha256(data).hexdigest()
+    )
+    assert session['total_chunks'] == 3
+
+    for index in (2, 0):
+        _save(session, index, data[index * 4096:(index + 1) * 4096])
+    assert chunked_upload_utils.to_ranges(chunked_upload_utils.received_chunks(session)) == [[0, 0], [2, 2]]
+    with pytest.raises(chunked_upload_utils.UploadSessionError):
+        chunked_upload_utils.assemble(session)
+
+    _save(session, 1, data[4096:8192])
+    tmp_path, sha256, size = chunked_upload_utils.assemble(session)
+    assert tmp_path.read_bytes() == data
+    assert (sha256, size) == (hashlib.sha256(data).hexdigest(), len(data))
+
+
+def test_chunk_checksum_and_size_are_verified(upload_dirs):
+    session = chunked_upload_utils.create_session(7, 'a.bin', 10, '/', 'application/octet-stream', chunk_size=4)
+    with pytest.raises(chunked_upload_utils.UploadSessionError):
+        asyncio.run(chunked_upload_utils.save_chunk(session, 0, _stream(b'abcd'), '0' * 64))
+    with pytest.raises(chunked_upload_utils.UploadSessionError):
+        _save(session, 2, b'xyz')
+    with pytest.raises(chunked_upload_utils.UploadSessionError):
+        _save(session, 3, b'xy')
+    assert chunked_upload_utils.received_chunks(session) == []
+
+
+def test_session_is_private_and_completes_once(upload_dirs):
+    session = chunked_upload_utils.create_session(7, 'a.bin', 1, '/', 'application/octet-stream')
+    with pytest.raises(chunked_upload_utils.UploadSessionError):
+        chunked_upload_utils.load_session(session['upload_id'], 8)
+
+    chunked_upload_utils.begin_completion(session)
+    with pytest.raises(chunked_upload_utils.UploadSessionError):
+        chunked_upload_utils.begin_completion(session)
+    chunked_upload_utils.abort_completion(session)
+    assert chunked_upload_utils.load_session(session['upload_id'], 7)['file_name'] == 'a.bin'
+
+
+def test_cleanup_removes_only_expired_sessions(upload_dirs):
+    active = chunked_upload_utils.create_session(7, 'a.bin', 1, '/', 'application/octet-stream')
+    expired = chunked_upload_utils.create_session(7, 'b.bin', 1, '/', 'application/octet-stream')
+    manifest = settings.UPLOAD_SESSION_DIR / expired['upload_id'] / chunked_upload_utils.MANIFEST_NAME
+    manifest.write_text(json.dumps(dict(expired, expires_at=0)), encoding='utf-8')
+
+    assert chunked_upload_utils.cleanup_expired_sessions() == 1
+    assert (settings.UPLOAD_SESSION_DIR / active['upload_id']).exists()
+    assert not (settings.UPLOAD_SESSION_DIR / expired['upload_id']).exists()
@@ -0,0 +1,470 @@
+"""
+云盘接口测试：秒传持有证明、空间配额和用量计数、批量上传的登记、批量操作的回滚、历史版本的保存、照片转码版本的协商、分享链接
+"""
+import hashlib
+import uuid
+
+CONTENT = b'chapter 3 lecture notes\n' * 5000
+SHA256 = hashlib.sha256(CONTENT).hexdigest()
+
+
+def _probe(cloud, **extra):
+    body = {'sha256': SHA256, 'file_size': len(CONTENT), 'file_name': 'notes.txt', 'folder_path': '/'}
+    body.update(extra)
+    return cloud.client.post('/api/cloud_disk/upload/probe', json=body)
+
+
+def _proof(challenge, content=CONTENT):
+    start = challenge['offset']
+    return hashlib.sha256(challenge['nonce'].encode() + content[start:start + challenge['length']]).hexdigest()
+
+
+def test_probe_requires_proof_of_possession(cloud):
+    assert cloud.upload({'notes.txt': CONTENT}).json()['success_count'] == 1
+    # 自己已有的内容直接秒传
+    assert _probe(cloud).json()['instant'] is True
+
+    cloud.new_user()
+    response = _probe(cloud).json()
+    assert response['instant'] is False
+    challenge = response['challenge']
+
+    # 只知道哈希和大小时无法取得文件
+    assert _probe(cloud, challenge=challenge['token'], proof=SHA256).status_code == 403
+    assert _probe(cloud, challenge=challenge['token'] + 'x', proof=_proof(challenge)).status_code == 400
+
+    response = _probe(cloud, challenge=challenge['token'], proof=_proof(challenge)).json()
+    assert response['instant'] is True
+    file_id = response['file_id']
+    assert cloud.client.get(f'/api/cloud_disk/download/{file_id}', params={'user_id': cloud.user_id}).content == CONTENT
+
+    # 挑战属于申请它的用户
+    cloud.new_user()
+    assert _probe(cloud, challenge=challenge['token'], proof=_proof(challenge)).status_code == 400
+
+
+def test_probe_unknown_content(cloud):
+    response = _probe(cloud, sha256='e' * 64).json()
+    assert response == {'instant': False, 'message': '服务器没有相同内容，请上传文件'}
+
+
+def _usage(cloud):
+    return cloud.client.get('/api/cloud_disk/usage').json()
+
+
+def _set_quota(cloud, quota_bytes):
+    app = cloud.app
+    with cloud.session() as db:
+        state = db.get(app.CloudDiskState, cloud.user_id)
+        if state is None:
+            db.add(app.CloudDiskState(user_id=cloud.user_id, quota_bytes=quota_bytes))
+        else:
+            state.quota_bytes = quota_bytes
+        db.commit()
+
+
+def _assert_usage_consistent(cloud):
+    """用户和每个文件夹（含子文件夹）的计数与文件记录一致"""
+    app = cloud.app
+    with cloud.session() as db:
+        files = db.query(app.UserFile.folder_path, app.UserFile.file_size).filter(
+            app.UserFile.user_id == cloud.user_id).all()
+        state = db.get(app.CloudDiskState, cloud.user_id)
+        assert (state.used_bytes, state.file_count) == (sum(size for _, size in files), len(files))
+        for folder in db.query(app.UserFolder).filter(app.UserFolder.user_id == cloud.user_id):
+            sizes = [size for path, size in files if path.startswith(folder.folder_path)]
+            assert (folder.total_size, folder.file_count) == (sum(sizes), len(sizes)), folder.folder_path
+    return len(files)
+
+
+def _file_ids(cloud, folder_path):
+    app = cloud.app
+    with cloud.session() as db:
+        return [file_id for (file_id,) in db.query(app.UserFile.id).filter(
+            app.UserFile.user_id == cloud.user_id, app.UserFile.folder_path == folder_path
+        ).order_by(app.UserFile.id)]
+
+
+def _batch(cloud, *operations, atomic=True):
+    return cloud.client.post('/api/cloud_disk/batch', json={'atomic': atomic, 'operations': list(operations)})
+
+
+def test_usage_counters_follow_file_operations(cloud):
+    cloud.upload({'a.txt': b'a' * 100, 'b.txt': b'b' * 200}, folder_path='/docs/')
+    cloud.upload({'c.txt': b'c' * 50}, folder_path='/docs/drafts/')
+    assert _assert_usage_consistent(cloud) == 3
+    assert _usage(cloud)['used_bytes'] == 350
+
+    docs = _file_ids(cloud, '/docs/')
+    assert _batch(cloud, {'op': 'copy', 'file_ids': docs, 'target_folder': '/backup/'}).json()['committed']
+    assert _assert_usage_consistent(cloud) == 5
+    assert cloud.client.put('/api/cloud_disk/move-file',
+                            json={'file_id': docs[0], 'target_folder': '/docs/drafts/'}).status_code == 200
+    _assert_usage_consistent(cloud)
+    assert cloud.client.put('/api/cloud_disk/rename-folder',
+                            json={'old_path': '/docs/', 'new_name': 'papers'}).status_code == 200
+    _assert_usage_consistent(cloud)
+    assert cloud.client.delete(f'/api/cloud_disk/delete/{docs[1]}').status_code == 200
+    assert _assert_usage_consistent(cloud) == 4
+    assert cloud.client.post('/api/cloud_disk/delete-folder', json={'folder_path': '/papers/'}).status_code == 200
+    assert _assert_usage_consistent(cloud) == 2
+
+    usage = cloud.client.get('/api/cloud_disk/usage', params={'path': '/backup/'}).json()
+    assert usage['used_bytes'] == 300
+    assert usage['folder'] == {'path': '/backup/', 'file_count': 2, 'total_size': 300}
+
+
+def test_quota_rejects_upload_copy_and_restore(cloud):
+    _set_quota(cloud, 200)
+    assert cloud.upload({'plan.txt': b'p' * 120}).json()['success_count'] == 1
+    plan_id = _file_ids(cloud, '/')[0]
+
+    result = cloud.upload({'big.txt': b'x' * 100}).json()
+    assert result['success_count'] == 0 and result['error_count'] == 1
+    # 复制超出配额时整批回滚
+    response = _batch(cloud, {'op': 'copy', 'file_ids': [plan_id], 'target_folder': '/copy/'}).json()
+    assert response['committed'] is False
+    assert response['results'][0]['status_code'] == 413
+    # 自己已有的内容秒传同样计入用量
+    probe = cloud.client.post('/api/cloud_disk/upload/probe', json={
+        'sha256': hashlib.sha256(b'p' * 120).hexdigest(), 'file_size': 120, 'file_name': 'again.txt'})
+    assert probe.status_code == 413
+    assert _usage(cloud)['used_bytes'] == 120
+
+    # 编辑为较小的内容，再上传文件占满空间后，恢复为较大的旧版本会超出配额
+    edit = cloud.client.post(f'/api/cloud_disk/update-file/{plan_id}',
+                             files={'file': ('plan.txt', b'short', 'text/plain')})
+    assert edit.status_code == 200
+    assert cloud.upload({'fill.txt': b'f' * 150}).json()['success_count'] == 1
+    versions = cloud.client.get(f'/api/cloud_disk/files/{plan_id}/versions').json()['versions']
+    old_version = next(version for version in versions if version['file_size'] == 120)
+    restore = cloud.client.post(f'/api/cloud_disk/files/{plan_id}/versions/{old_version["id"]}/restore')
+    assert restore.status_code == 413
+    assert _usage(cloud)['used_bytes'] == 155
+    assert _assert_usage_consistent(cloud) == 2
+
+    # 配额为0表示不限制
+    _set_quota(cloud, 0)
+    assert cloud.client.post(f'/api/cloud_disk/files/{plan_id}/versions/{old_version["id"]}/restore').status_code == 200
+    assert _usage(cloud)['quota_bytes'] is None
+    _assert_usage_consistent(cloud)
+
+
+def _legacy_file(cloud, name, content, folder_path='/'):
+    """登记一个旧的独占存储文件（没有 content_hash），返回 (文件ID, 磁盘路径)"""
+    app = cloud.app
+    path = app.settings.get_cloud_disk_dir_for_user(cloud.user_id) / f'legacy_{uuid.uuid4().hex}.txt'
+    path.write_bytes(content)
+    with cloud.session() as db:
+        db_file = app.UserFile(file_uuid=str(uuid.uuid4()), original_name=name,
+                               save_path=app.storage_utils.storage_key(path), file_size=len(content),
+                               file_type='text/plain', user_id=cloud.user_id, folder_path=folder_path)
+        app.register_new_file(db, db_file)
+        db.commit()
+        return db_file.id, path
+
+
+def _user_dir_files(cloud):
+    user_dir = cloud.app.settings.get_cloud_disk_dir_for_user(cloud.user_id)
+    return sorted(path.name for path in user_dir.iterdir() if path.is_file())
+
+
+def _names(cloud, file_ids):
+    app = cloud.app
+    with cloud.session() as db:
+        names = dict(db.query(app.UserFile.id, app.UserFile.original_name).filter(app.UserFile.id.in_(file_ids)))
+    return [names[file_id] for file_id in file_ids]
+
+
+def _folder_paths(cloud):
+    app = cloud.app
+    with cloud.session() as db:
+        return sorted(path for (path,) in db.query(app.UserFolder.folder_path).filter(
+            app.UserFolder.user_id == cloud.user_id))
+
+
+def _blob_state(cloud):
+    """blob记录 {sha256: 引用计数}、blob目录中的文件和临时文件"""
+    app = cloud.app
+    with cloud.session() as db:
+        rows = dict(db.query(app.FileBlob.sha256, app.FileBlob.ref_count).all())
+    files = {path for path in app.settings.BLOB_DIR.rglob('*') if path.is_file()}
+    return rows, files
+
+
+def test_batch_upload_ids_follow_input_order(cloud):
+    cloud.upload({'shared.txt': b'already stored'}, folder_path='/old/')
+    names = {'b.txt': b'second', 'a.txt': b'first', 'copy.txt': b'second', 'again.txt': b'already stored'}
+    # 两个上传接口都走 store_new_files：同批重复内容、已有blob的内容混在一起
+    responses = (
+        (cloud.upload(names, folder_path='/new/'), 'file_name'),
+        (cloud.client.post('/api/files/upload', files=[('file', (name, content, 'text/plain'))
+                                                       for name, content in names.items()]), 'filename'),
+    )
+    for response, name_key in responses:
+        uploaded = response.json()['uploaded_files']
+        assert [entry[name_key] for entry in uploaded] == list(names)
+        for entry, content in zip(uploaded, names.values()):
+            download = cloud.client.get(f'/api/cloud_disk/download/{entry["id"]}?user_id={cloud.user_id}')
+            assert download.content == content
+    assert _assert_usage_consistent(cloud) == 9
+    rows, _ = _blob_state(cloud)
+    assert rows[hashlib.sha256(b'second').hexdigest()] == 4
+    assert rows[hashlib.sha256(b'already stored').hexdigest()] == 3
+
+
+def test_batch_upload_failure_leaves_nothing_behind(cloud, monkeypatch):
+    app = cloud.app
+    cloud.upload({'shared.txt': b'stored before the batch'})
+    rows_before, files_before = _blob_state(cloud)
+    usage_before = _usage(cloud)
+
+    def failing_record_file_changes(*args, **kwargs):
+        raise RuntimeError('disk full')
+
+    # 文件记录已经 INSERT、blob已提交到位后失败
+    monkeypatch.setattr(app, 'record_file_changes', failing_record_file_changes)
+    names = {'new.txt': b'brand new content', 'dup.txt': b'brand new content',
+             'again.txt': b'stored before the batch'}
+    result = cloud.upload(names, folder_path='/batch/').json()
+    assert result['success_count'] == 0
+    assert [error['filename'] for error in result['errors']] == list(names)
+
+    assert _file_ids(cloud, '/batch/') == []
+    assert _blob_state(cloud) == (rows_before, files_before)
+    assert not any(app.settings.BLOB_TMP_DIR.iterdir())
+    assert _usage(cloud) == usage_before
+    assert _assert_usage_consistent(cloud) == 1
+
+
+def test_atomic_batch_rolls_back_records_and_copied_files(cloud):
+    cloud.upload({'a.txt': b'a' * 10, 'b.txt': b'b' * 20}, folder_path='/term/')
+    legacy_id, _ = _legacy_file(cloud, 'old.txt', b'legacy notes', folder_path='/term/')
+    term_ids = _file_ids(cloud, '/term/')
+    disk_before, folders_before = _user_dir_files(cloud), _folder_paths(cloud)
+
+    response = _batch(
+        cloud,
+        {'op': 'copy', 'file_ids': term_ids, 'target_folder': '/archive/'},
+        {'op': 'rename', 'folder_path': '/term/', 'new_name': 'spring'},
+        {'op': 'delete', 'folder_path': '/spring/'},
+        {'op': 'move', 'file_ids': [999999], 'target_folder': '/'},
+        {'op': 'delete', 'file_ids': [legacy_id]},
+    ).json()
+
+    assert response['committed'] is False
+    assert [result['success'] for result in response['results']] == [True, True, True, False, False]
+    assert response['results'][3]['status_code'] == 404
+    assert response['results'][4]['skipped'] is True
+    # 记录、文件夹和用量都回到批量操作之前；复制出的旧文件副本已从磁盘删除
+    assert _file_ids(cloud, '/term/') == term_ids
+    assert _file_ids(cloud, '/archive/') == []
+    assert _folder_paths(cloud) == folders_before
+    assert _user_dir_files(cloud) == disk_before
+    assert _assert_usage_consistent(cloud) == 3
+
+
+def test_non_atomic_batch_keeps_successful_operations(cloud):
+    cloud.upload({'a.txt': b'a' * 10, 'b.txt': b'b' * 20}, folder_path='/term/')
+    legacy_id, _ = _legacy_file(cloud, 'old.txt', b'legacy notes', folder_path='/term/')
+    missing_id, missing_path = _legacy_file(cloud, 'lost.txt', b'gone', folder_path='/term/')
+    missing_path.unlink()
+    cloud.upload({'c.txt': b'c' * 30}, folder_path='/archive/term/')
+    a_id, b_id = _file_ids(cloud, '/term/')[:2]
+    disk_before = _user_dir_files(cloud)
+
+    response = _batch(
+        cloud,
+        # 第二个文件的内容不存在：已经复制出的第一个副本随该操作一起撤销
+        {'op': 'copy', 'file_ids': [legacy_id, missing_id], 'target_folder': '/copies/'},
+        {'op': 'copy', 'file_ids': [b_id, legacy_id, a_id], 'target_folder': '/copies/'},
+        {'op': 'delete', 'file_ids': [missing_id]},
+        {'op': 'move', 'folder_path': '/term/', 'target_folder': '/archive/'},
+        {'op': 'delete', 'folder_path': '/nothing/'},
+        atomic=False,
+    ).json()
+
+    assert response['committed'] is True
+    results = response['results']
+    assert [result['success'] for result in results] == [False, True, True, True, True]
+    assert results[0]['status_code'] == 404
+    # 新文件ID与请求中的 file_ids 顺序一致
+    assert _names(cloud, results[1]['file_ids']) == ['b.txt', 'old.txt', 'a.txt']
+    assert sorted(_file_ids(cloud, '/copies/')) == sorted(results[1]['file_ids'])
+    # 移动到已有同名文件夹时合并
+    assert results[3]['new_path'] == '/archive/term/'
+    assert _names(cloud, _file_ids(cloud, '/archive/term/')) == ['a.txt', 'b.txt', 'old.txt', 'c.txt']
+    assert '/term/' not in _folder_paths(cloud)
+    assert results[4]['deleted_count'] == 0
+    # 只多了成功复制的一个旧文件副本
+    assert len(_user_dir_files(cloud)) == len(disk_before) + 1
+    assert _assert_usage_consistent(cloud) == 7
+
+
+def test_versions_store_chunks_outside_blob_lock(cloud, monkeypatch):
+    app = cloud.app
+    store_chunk = app.version_utils.store_chunk
+    locked_writes = []
+
+    def tracked_store_chunk(sha256, data):
+        locked_writes.append(app.storage_utils.blob_lock.locked())
+        return store_chunk(sha256, data)
+
+    monkeypatch.setattr(app.version_utils, 'store_chunk', tracked_store_chunk)
+    lines = [f'line {i}: study plan for week {i % 52}\n'.encode() for i in range(4000)]
+    original = b''.join(lines)
+    edited = b''.join(lines[:2000] + [b'inserted line\n'] + lines[2000:])
+    cloud.upload({'plan.md': original})
+    file_id = _file_ids(cloud, '/')[0]
+
+    response = cloud.client.post(f'/api/cloud_disk/update-file/{file_id}',
+                                 files={'file': ('plan.md', edited, 'text/plain')})
+    assert response.status_code == 200
+    assert locked_writes and not any(locked_writes)
+
+    versions = cloud.client.get(f'/api/cloud_disk/files/{file_id}/versions').json()['versions']
+    assert [version['file_size'] for version in versions] == [len(edited), len(original)]
+    for version, content in zip(versions, (edited, original)):
+        url = f'/api/cloud_disk/files/{file_id}/versions/{version["id"]}/content'
+        assert cloud.client.get(url).content == content
+
+
+def test_version_restores_chunk_collected_before_registration(cloud):
+    """块写好之后、登记之前被回收任务删除时，登记时用当前内容补上"""
+    app = cloud.app
+    content = b''.join(f'chunk race line {i}\n'.encode() for i in range(3000))
+    chunks = app.version_utils.split_chunks(content)
+    stored_sizes = app.version_utils.store_chunks(content, chunks)
+    collected = chunks[1][0]
+    app.version_utils.remove_chunk(collected)
+
+    with cloud.session() as db:
+        version = app.save_file_version(db, 0, cloud.user_id, content, hashlib.sha256(content).hexdigest(),
+                                        chunks, stored_sizes)
+        db.commit()
+        assert app.version_utils.chunk_path(collected).exists()
+        assert app.version_utils.read_version(version.manifest) == content
+        app.release_versions(db, [version.id])
+        db.commit()
+
+
+def test_rendition_only_for_inline_image_requests(cloud, monkeypatch):
+    app = cloud.app
+    photo = b'\xff\xd8\xff\xe0 original photo bytes' * 100
+    cloud.upload({'IMG_0001.jpg': photo})
+    file_id = _file_ids(cloud, '/')[0]
+    monkeypatch.setattr(app.settings, 'IMAGE_RENDITION_ENABLED', True)
+    monkeypatch.setattr(app.settings, 'IMAGE_RENDITION_FORMATS', ('webp',))
+    rendition = app.rendition_utils.rendition_path(hashlib.sha256(photo).hexdigest(), 'webp')
+    rendition.parent.mkdir(parents=True, exist_ok=True)
+    rendition.write_bytes(b'RIFF small webp rendition')
+
+    url = f'/api/cloud_disk/download/{file_id}?user_id={cloud.user_id}'
+    accept = 'text/html,application/xhtml+xml,image/avif,image/webp,*/*;q=0.8'
+
+    # 浏览器导航下载（Accept 同样包含 image/webp）和没有 Sec-Fetch-Dest 的客户端拿到原图
+    for headers in ({'accept': accept, 'sec-fetch-dest': 'document'}, {'accept': accept}):
+        response = cloud.client.get(url, headers=headers)
+        assert response.content == photo
+        assert response.headers['vary'] == 'Accept, Sec-Fetch-Dest'
+        assert response.headers['content-disposition'].startswith('attachment')
+
+    # <img> 加载或明确要求预览时返回转码版本
+    for extra, headers in (('', {'accept': 'image/webp,*/*', 'sec-fetch-dest': 'image'}),
+                           ('&preview=true', {'accept': accept})):
+        response = cloud.client.get(url + extra, headers=headers)
+        assert response.content == rendition.read_bytes()
+        assert response.headers['content-type'] == 'image/webp'
+        assert response.headers['content-disposition'].startswith('inline')
+
+    assert cloud.client.get(url + '&preview=true&original=true', headers={'accept': accept}).content == photo
+
+
+def _share(cloud, file_id, **options):
+    response = cloud.client.post('/api/cloud_disk/shares', json={'file_id': file_id, **options})
+    assert response.status_code == 200
+    return response.json()['share']
+
+
+def _share_row(cloud, share_id):
+    with cloud.session() as db:
+        return db.get(cloud.app.FileShare, share_id)
+
+
+def test_share_download_limit_and_ranges(cloud):
+    content = bytes(range(256)) * 40
+    cloud.upload({'slides.pdf': content})
+    share = _share(cloud, _file_ids(cloud, '/')[0], max_downloads=2, password='1234')
+    url = share['url'] + '/download'
+    assert _share_row(cloud, share['id']).password_hash.startswith(('scrypt:', 'pbkdf2:'))
+
+    # 密码只在 POST 请求体中提交一次，之后携带访问凭证；URL 中的密码不再被接受
+    assert cloud.client.post(share['url'] + '/unlock', json={'password': '123'}).status_code == 401
+    assert cloud.client.get(url, params={'password': '1234'}).status_code == 401
+    assert cloud.client.get(share['url']).json() == {'need_password': True}
+    token = cloud.client.post(share['url'] + '/unlock', json={'password': '1234'}).json()['token']
+    assert cloud.client.get(share['url'], headers={'x-share-token': token}).json()['file_name'] == 'slides.pdf'
+    assert cloud.client.get(share['url'], params={'token': token + 'x'}).status_code == 401
+
+    # 不包含开头的续传请求不计数；后缀区间、多段区间覆盖到开头时计数
+    resume = cloud.client.get(url, params={'token': token}, headers={'range': 'bytes=100-'})
+    assert resume.status_code == 206 and resume.content == content[100:]
+    assert _share_row(cloud, share['id']).download_count == 0
+    whole = cloud.client.get(url, params={'token': token}, headers={'range': f'bytes=-{len(content)}'})
+    assert whole.content == content
+    assert cloud.client.get(url, params={'token': token}, headers={'range': 'bytes=1-,0-0'}).status_code == 206
+    assert _share_row(cloud, share['id']).download_count == 2
+
+    # 达到最大下载次数后返回410，续传请求也随之失效
+    assert cloud.client.get(url, params={'token': token}).status_code == 410
+    assert cloud.client.get(share['url'], params={'token': token}).json()['remaining_downloads'] == 0
+    assert _share_row(cloud, share['id']).download_count == 2
+
+
+def test_uncounted_ranges_checked_against_database(cloud):
+    content = b'lecture recording ' * 500
+    cloud.upload({'lecture.txt': content})
+    file_id = _file_ids(cloud, '/')[0]
+    share = _share(cloud, file_id, max_downloads=1)
+    url = share['url'] + '/download'
+    assert cloud.client.get(url).content == content
+
+    # 用完下载次数后，避开第一个字节的分段请求同样返回410
+    assert cloud.client.get(url, headers={'range': 'bytes=1-'}).status_code == 410
+
+    # 其他进程撤销分享时本进程的缓存还没有过期，分段请求按数据库拒绝
+    other = _share(cloud, file_id)
+    assert cloud.client.get(other['url'] + '/download', headers={'range': 'bytes=1-'}).status_code == 206
+    with cloud.session() as db:
+        db.get(cloud.app.FileShare, other['id']).is_active = False
+        db.commit()
+    assert cloud.app.share_cache.get(other['share_code']) is not None
+    assert cloud.client.get(other['url'] + '/download', headers={'range': 'bytes=1-'}).status_code == 410
+
+
+def test_revoke_invalidates_cached_share(cloud):
+    cloud.upload({'notes.txt': b'shared notes'})
+    share = _share(cloud, _file_ids(cloud, '/')[0])
+    # 访问一次，分享信息进入缓存
+    assert cloud.client.get(share['url']).json()['file_name'] == 'notes.txt'
+    assert cloud.app.share_cache.get(share['share_code']) is not None
+
+    assert cloud.client.delete(f'/api/cloud_disk/shares/{share["id"]}').status_code == 200
+    assert cloud.app.share_cache.get(share['share_code']) is None
+    assert cloud.client.get(share['url']).status_code == 404
+    assert cloud.client.get(share['url'] + '/download').status_code == 404
+
+
+def test_share_deactivated_when_file_deleted(cloud):
+    cloud.upload({'draft.txt': b'draft'})
+    file_id = _file_ids(cloud, '/')[0]
+    share = _share(cloud, file_id)
+    assert cloud.client.get(share['url'] + '/download').content == b'draft'
+    assert cloud.client.delete(f'/api/cloud_disk/delete/{file_id}').status_code == 200
+
+    # 缓存中的分享仍指向已删除的文件，访问时分享随之失效
+    assert cloud.app.share_cache.get(share['share_code']) is not None
+    assert cloud.client.get(share['url'] + '/download').status_code == 404
+    assert not _share_row(cloud, share['id']).is_active
+    assert cloud.app.share_cache.get(share['share_code']) is None
+    assert cloud.client.get('/api/cloud_disk/shares', params={'file_id': file_id}).json()['shares'] == []
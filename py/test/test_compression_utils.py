@@ -0,0 +1,82 @@
+"""
+存储压缩阶段测试：可压缩性估算、跳过已压缩内容、zstd 往返
+"""
+import hashlib
+import os
+
+import zstandard
+
+from utils import compression_utils
+
+TEXT = ('第一章 学习计划 study plan for the week\n' * 20000).encode('utf-8')
+
+
+def test_estimate_ratio_skips_random_data(tmp_path):
+    random_file = tmp_path / 'video.mp4'
+    random_file.write_bytes(os.urandom(512 * 1024))
+    text_file = tmp_path / 'notes.txt'
+    text_file.write_bytes(TEXT)
+
+    assert compression_utils.estimate_ratio(random_file) == 1.0
+    assert compression_utils.estimate_ratio(text_file) < 0.2
+
+
+def test_incompressible_content_is_left_untouched(tmp_path):
+    path = tmp_path / 'upload.part'
+    content = os.urandom(300 * 1024)
+    path.write_bytes(content)
+
+    result_path, codec = compression_utils.compress_file_to_temp(path, 3, 0.1)
+    assert codec is None
+    assert result_path == str(path)
+    assert path.read_bytes() == content
+
+
+def test_zstd_round_trip(tmp_path):
+    path = tmp_path / 'upload.part'
+    path.write_bytes(TEXT)
+
+    result_path, codec = compression_utils.compress_file_to_temp(path, 3, 0.1)
+    assert codec == compression_utils.CODEC_ZSTD
+    assert not path.exists()
+    assert os.path.getsize(result_path) < len(TEXT) // 10
+
+    reader, resources = compression_utils.open_reader(result_path, codec)
+    try:
+        assert reader.read() == TEXT
+    finally:
+        for resource in resources:
+            resource.close()
+
+
+def test_recompress_file_keeps_content(tmp_path):
+    compressed = tmp_path / 'compressed'
+    compressed.write_bytes(zstandard.ZstdCompressor(level=1).compress(TEXT))
+    dest = tmp_path / 'cold'
+    codec, sha256, size = compression_utils.recompress_file(compressed, 'zstd', dest, 19, 0.1)
+    assert (codec, sha256, size) == ('zstd', hashlib.sha256(TEXT).hexdigest(), len(TEXT))
+    assert os.path.getsize(dest) <= os.path.getsize(compressed)
+    assert zstandard.ZstdDecompressor().stream_reader(dest.read_bytes()).read() == TEXT
+
+    # 原样存储的可压缩内容改为压缩存储，不可压缩的原样复制
+    plain = tmp_path / 'plain'
+    plain.write_bytes(TEXT)
+    assert compression_utils.recompress_file(plain, None, dest, 9, 0.1)[0] == 'zstd'
+    random_data = os.urandom(256 * 1024)
+    plain.write_bytes(random_data)
+    assert compression_utils.recompress_file(plain, None, dest, 9, 0.1) == (
+        None, hashlib.sha256(random_data).hexdigest(), len(random_data))
+    assert dest.read_bytes() == random_data
+
+
+def test_lazy_process_pool():
+    pool = compression_utils.LazyProcessPool(lambda: 1)
+    executor = pool.get()
+    try:
+        assert pool.get() is executor
+        assert executor.submit(os.getpid).result(timeout=60) != os.getpid()
+    finally:
+        pool.shutdown()
+    # 关闭后再次使用时重新创建
+    assert pool.get() is not executor
+    pool.shutdown()
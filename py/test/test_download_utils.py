@@ -0,0 +1,164 @@
+"""
+统一下载响应测试：Range、多段 Range、ETag/304、If-Range、zip成员和压缩blob流式下载
+"""
+import zipfile
+
+import pytest
+import zstandard
+from fastapi import FastAPI, Request
+from fastapi.testclient import TestClient
+
+from utils import download_utils
+
+CONTENT = bytes(range(256)) * 8  # 2048 字节
+
+
+@pytest.fixture
+def client(tmp_path):
+    path = tmp_path / 'lecture.mp4'
+    path.write_bytes(CONTENT)
+    app = FastAPI()
+
+    @app.get('/download')
+    async def download(request: Request):
+        return download_utils.file_download_response(
+            request.headers, str(path), '讲义 第1章.mp4', 'video/mp4', content_hash='ab' * 32
+        )
+
+    return TestClient(app)
+
+
+def test_parse_range_header():
+    assert download_utils.parse_range_header(None, 100) is None
+    assert download_utils.parse_range_header('bytes=0-9', 100) == [(0, 9)]
+    assert download_utils.parse_range_header('bytes=90-', 100) == [(90, 99)]
+    assert download_utils.parse_range_header('bytes=-10', 100) == [(90, 99)]
+    assert download_utils.parse_range_header('bytes=50-200', 100) == [(50, 99)]
+    assert download_utils.parse_range_header('bytes=0-4,3-9,20-29', 100) == [(0, 9), (20, 29)]
+    assert download_utils.parse_range_header('bytes=200-300', 100) == []
+    assert download_utils.parse_range_header('bytes=9-1', 100) is None
+    assert download_utils.parse_range_header('items=0-1', 100) is None
+
+
+def test_full_download_has_validators(client):
+    response = client.get('/download')
+    assert response.status_code == 200
+    assert response.content == CONTENT
+    assert response.headers['etag'] == '"' + 'ab' * 32 + '"'
+    assert response.headers['accept-ranges'] == 'bytes'
+    assert "filename*=UTF-8''%E8%AE%B2%E4%B9%89" in response.headers['content-disposition']
+
+
+def test_single_range(client):
+    response = client.get('/download', headers={'Range': 'bytes=100-199'})
+    assert response.status_code == 206
+    assert response.content == CONTENT[100:200]
+    assert response.headers['content-range'] == 'bytes 100-199/2048'
+
+
+def test_multi_range(client):
+    response = client.get('/download', headers={'Range': 'bytes=0-9,2000-'})
+    assert response.status_code == 206
+    assert response.headers['content-type'].startswith('multipart/byteranges; boundary=')
+    assert int(response.headers['content-length']) == len(response.content)
+    assert b'Content-Range: bytes 0-9/2048\r\n\r\n' + CONTENT[:10] in response.content
+    assert b'Content-Range: bytes 2000-2047/2048\r\n\r\n' + CONTENT[2000:] in response.content
+
+
+def test_unsatisfiable_range(client):
+    response = client.get('/download', headers={'Range': 'bytes=5000-'})
+    assert response.status_code == 416
+    assert response.headers['content-range'] == 'bytes */2048'
+
+
+def test_conditional_requests(client):
+    first = client.get('/download')
+    etag, last_modified = first.headers['etag'], first.headers['last-modified']
+
+    assert client.get('/download', headers={'If-None-Match': etag}).status_code == 304
+    assert client.get('/download', headers={'If-Modified-Since': last_modified}).status_code == 304
+    assert client.get('/download', headers={'If-None-Match': '"other"'}).status_code == 200
+
+    stale = client.get('/download', headers={'Range': 'bytes=0-9', 'If-Range': '"other"'})
+    assert stale.status_code == 200 and stale.content == CONTENT
+    fresh = client.get('/download', headers={'Range': 'bytes=0-9', 'If-Range': etag})
+    assert fresh.status_code == 206 and fresh.content == CONTENT[:10]
+
+
+def test_accel_redirect_headers(tmp_path, monkeypatch):
+    monkeypatch.setattr(download_utils.settings, 'CLOUD_DISK_DIR', tmp_path)
+    blob = tmp_path / 'blobs' / 'ab' / 'cd' / ('abcd' * 16)
+    blob.parent.mkdir(parents=True)
+    blob.write_bytes(CONTENT)
+
+    response = download_utils.accel_redirect_response(str(blob), '讲义 第1章.mp4', 'video/mp4')
+    assert response.headers['x-accel-redirect'] == '/_protected/cloud_disk/blobs/ab/cd/' + 'abcd' * 16
+    assert response.headers['content-type'] == 'video/mp4'
+    assert response.headers['content-disposition'] == (
+        "attachment; filename=\"download.mp4\"; "
+        "filename*=UTF-8''%E8%AE%B2%E4%B9%89%20%E7%AC%AC1%E7%AB%A0.mp4"
+    )
+    assert response.body == b''
+
+
+def test_accel_redirect_rejects_paths_outside_locations(tmp_path, monkeypatch):
+    monkeypatch.setattr(download_utils.settings, 'CLOUD_DISK_DIR', tmp_path / 'cloud_disk')
+    outside = tmp_path / 'secret.txt'
+    outside.write_text('x')
+    assert download_utils.accel_redirect_uri(str(outside)) is None
+    assert download_utils.accel_redirect_uri(str(tmp_path / 'cloud_disk' / '..' / 'secret.txt')) is None
+
+
+@pytest.mark.parametrize('compression', [zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED])
+def test_zip_member_streams_without_extraction(tmp_path, compression):
+    zip_path = tmp_path / 'lecture.mp4.zip'
+    with zipfile.ZipFile(zip_path, 'w', compression=compression) as zf:
+        zf.writestr('lecture.mp4', CONTENT)
+    app = FastAPI()
+
+    @app.get('/download')
+    async def download(request: Request):
+        return download_utils.zip_member_download_response(
+            request.headers, str(zip_path), 'lecture.mp4', 'video/mp4'
+        )
+
+    client = TestClient(app)
+    response = client.get('/download')
+    assert response.status_code == 200
+    assert response.content == CONTENT
+
+    response = client.get('/download', headers={'Range': 'bytes=1000-1099,2000-'})
+    assert response.status_code == 206
+    assert CONTENT[1000:1100] in response.content
+    assert CONTENT[2000:] in response.content
+
+    etag = client.get('/download', headers={'Range': 'bytes=10-19'}).headers['etag']
+    assert client.get('/download', headers={'If-None-Match': etag}).status_code == 304
+    assert sorted(p.name for p in tmp_path.iterdir()) == ['lecture.mp4.zip']
+
+
+def test_compressed_blob_download(tmp_path):
+    path = tmp_path / 'blob'
+    path.write_bytes(zstandard.ZstdCompressor().compress(CONTENT))
+    app = FastAPI()
+
+    @app.get('/download')
+    async def download(request: Request):
+        return download_utils.file_download_response(
+            request.headers, str(path), 'notes.txt', 'text/plain',
+            content_hash='cd' * 32, codec='zstd', content_size=len(CONTENT)
+        )
+
+    client = TestClient(app)
+    response = client.get('/download')
+    assert response.content == CONTENT
+    assert response.headers['content-length'] == str(len(CONTENT))
+
+    response = client.get('/download', headers={'Range': 'bytes=1500-1599'})
+    assert response.status_code == 206
+    assert response.content == CONTENT[1500:1600]
+
+
+def test_decompressing_response_requires_reader(tmp_path):
+    with pytest.raises(TypeError):
+        download_utils.DecompressingResponse(str(tmp_path / 'blob'), 0)
@@ -0,0 +1,48 @@
+"""
+云盘文件夹路径工具与目录树缓存测试
+"""
+from utils import folder_utils
+
+
+def test_normalize_and_parent_paths():
+    assert folder_utils.normalize_folder_path(None) == '/'
+    assert folder_utils.normalize_folder_path('课程//第一章') == '/课程/第一章/'
+    assert folder_utils.parent_path('/课程/第一章/') == '/课程/'
+    assert folder_utils.parent_path('/课程/') == '/'
+    assert folder_utils.parent_path('/') is None
+    assert folder_utils.folder_name('/课程/第一章/') == '第一章'
+    assert folder_utils.ancestor_paths('/a/b/c/') == ['/a/', '/a/b/', '/a/b/c/']
+    assert folder_utils.ancestor_paths('/') == []
+
+
+def test_tree_cache_invalidated_by_version():
+    cache = folder_utils.TreeCache(max_users=2)
+    cache.put(1, 5, {'tree': 'v5'})
+    assert cache.get(1, 5) == {'tree': 'v5'}
+    assert cache.get(1, 6) is None
+
+    cache.put(2, 1, 'b')
+    cache.get(1, 5)
+    cache.put(3, 1, 'c')  # 淘汰最久未使用的用户2
+    assert cache.get(2, 1) is None
+    assert cache.get(1, 5) == {'tree': 'v5'}
+
+
+def test_summarize_changes_compacts_journal():
+    F, D = folder_utils.CHANGE_FILE, folder_utils.CHANGE_FOLDER
+    summary = folder_utils.summarize_changes([
+        (D, 'create', None, '/a/', None),
+        (F, 'create', 1, None, None),
+        (F, 'update', 1, None, None),
+        (F, 'create', 2, None, None),
+        (D, 'create', None, '/a/b/', None),
+        (D, 'rename', None, '/a/', '/c/'),
+        (D, 'delete', None, '/x/y/', None),
+        (D, 'delete', None, '/x/', None),
+        (F, 'delete', 2, None, None),
+    ])
+    assert summary.file_ids == [1, 2]
+    # 重命名的目标整棵重新下发，其中的新建文件夹不再单独列出
+    assert summary.subtree_roots == ['/c/']
+    assert summary.created_folders == ['/a/', '/a/b/']
+    assert summary.deleted_folders == ['/a/', '/x/']
@@ -0,0 +1,55 @@
+"""
+笔记工具测试：增量修改的应用（UTF-16 偏移、越界和切开字符）、原子写入
+"""
+import os
+
+import pytest
+
+from utils import note_utils
+
+
+def test_apply_patches_in_order():
+    content = '第一行\nhello world\n'
+    patches = [
+        {'offset': 4, 'delete': 5, 'insert': 'HELLO'},
+        {'offset': 0, 'delete': 0, 'insert': '# '},
+        {'offset': len('# 第一行\nHELLO world\n'), 'insert': '末尾'},
+    ]
+    assert note_utils.apply_patches(content, patches) == '# 第一行\nHELLO world\n末尾'
+    assert note_utils.apply_patches(content, []) == content
+
+
+def test_offsets_count_utf16_units():
+    # 表情在浏览器字符串中占2个码元
+    content = 'a😀b'
+    assert note_utils.apply_patches(content, [{'offset': 3, 'delete': 1, 'insert': 'c'}]) == 'a😀c'
+    assert note_utils.apply_patches(content, [{'offset': 1, 'delete': 2}]) == 'ab'
+    with pytest.raises(note_utils.PatchError):
+        note_utils.apply_patches(content, [{'offset': 2, 'delete': 1}])
+
+
+@pytest.mark.parametrize('patch', [
+    {'offset': 10, 'delete': 0},
+    {'offset': 0, 'delete': 99},
+    {'offset': -1},
+    {'offset': '1'},
+    {'offset': 0, 'insert': 5},
+    'not a dict',
+])
+def test_invalid_patches(patch):
+    with pytest.raises(note_utils.PatchError):
+        note_utils.apply_patches('hello', [patch])
+
+
+def test_write_temp_and_replace(tmp_path):
+    path = str(tmp_path / note_utils.new_note_filename())
+    tmp = note_utils.write_temp(path, '旧内容')
+    os.replace(tmp, path)
+    tmp = note_utils.write_temp(path, '新内容')
+    # rename 之前原文件不受影响
+    assert note_utils.read_note(path) == '旧内容'
+    os.replace(tmp, path)
+    assert note_utils.read_note(path) == '新内容'
+    note_utils.discard_temp(note_utils.write_temp(path, 'x'))
+    assert os.listdir(tmp_path) == [os.path.basename(path)]
+    assert note_utils.read_note(str(tmp_path / 'missing.txt')) == ''
@@ -0,0 +1,120 @@
+"""
+文本预览工具测试：编码判断、窗口对齐到字符和行、行索引的生成与跳转、缓存
+"""
+import asyncio
+import io
+
+import zstandard
+
+from config import settings
+from utils import preview_utils
+
+LINES = [f"第{i}行 line {i}\n" for i in range(1, 2501)]
+TEXT = ''.join(LINES)
+
+
+def _window_pages(data: bytes, encoding, length: int):
+    """从头按窗口读完全部内容，返回各窗口的文本"""
+    pages, offset = [], 0
+    while offset < len(data):
+        window = preview_utils.read_window(io.BytesIO(data), offset, length, encoding, len(data))
+        assert window.offset == max(offset, encoding.bom)
+        assert window.next_offset > window.offset
+        pages.append(window.text)
+        offset = window.next_offset
+    return pages
+
+
+def test_detect_encoding():
+    assert preview_utils.detect_encoding(TEXT.encode('utf-8')) == ('utf-8', 0)
+    # 截断在多字节字符中间的样本
+    assert preview_utils.detect_encoding('中文'.encode('utf-8')[:4]) == ('utf-8', 0)
+    assert preview_utils.detect_encoding(TEXT.encode('gb18030')) == ('gb18030', 0)
+    assert preview_utils.detect_encoding(b'\xef\xbb\xbfabc') == ('utf-8', 3)
+    assert preview_utils.detect_encoding('\ufeffabc'.encode('utf-16-le')) == ('utf-16-le', 2)
+    assert preview_utils.detect_encoding(b'\x89PNG\r\n\x1a\n\x00\x00') is None
+
+
+def test_windows_cover_content_without_splitting_lines():
+    for name, prefix in (('utf-8', b''), ('gb18030', b''), ('utf-16-le', b'\xff\xfe'), ('utf-8', b'\xef\xbb\xbf')):
+        data = prefix + TEXT.encode(name)
+        encoding = preview_utils.detect_encoding(data[:preview_utils.SAMPLE_SIZE])
+        pages = _window_pages(data, encoding, 1000)
+        assert ''.join(pages) == TEXT
+        assert all(page.endswith('\n') for page in pages)
+
+
+def test_window_aligns_arbitrary_offsets():
+    data = TEXT.encode('utf-8')
+    encoding = preview_utils.TextEncoding('utf-8', 0)
+    # 从“第”字的第二个字节开始：跳过续字节
+    start = data.index('第2行'.encode('utf-8')) + 1
+    window = preview_utils.read_window(io.BytesIO(data), start, 100, encoding, len(data))
+    assert window.text.startswith('2行')
+    # 窗口内没有换行时截到最后一个完整字符
+    window = preview_utils.read_window(io.BytesIO(data), 0, 5, encoding, len(data))
+    assert (window.text, window.next_offset) == ('第1', 4)
+
+    gb = TEXT.encode('gb18030')
+    encoding = preview_utils.TextEncoding('gb18030', 0)
+    line_start = gb.index('第2行'.encode('gb18030'))
+    window = preview_utils.read_window(io.BytesIO(gb), line_start, 200, encoding, len(gb))
+    assert window.text.startswith('第2行')
+    # 不在行首时从下一行开始
+    window = preview_utils.read_window(io.BytesIO(gb), line_start + 1, 200, encoding, len(gb))
+    assert window.text.startswith('第3行')
+
+
+def test_line_index_and_jump():
+    for name in ('utf-8', 'utf-16-le'):
+        data = TEXT.encode(name)
+        encoding = preview_utils.TextEncoding(name, 0)
+        index = preview_utils.build_line_index(io.BytesIO(data), encoding, step=100)
+        assert index.total_lines == len(LINES)
+        assert index.size == len(data)
+        assert len(index.offsets) == 25
+
+        line = 1234
+        slot = (line - 1) // 100
+        reader = io.BytesIO(data)
+        reader.seek(index.offsets[slot])
+        offset, skipped = preview_utils.count_lines(reader, index.offsets[slot], line - (slot * 100 + 1), encoding)
+        assert skipped == line - (slot * 100 + 1)
+        window = preview_utils.read_window(io.BytesIO(data), offset, 200, encoding, len(data))
+        assert window.text.startswith(LINES[line - 1])
+
+    # 最后一行没有换行，以及空文件
+    encoding = preview_utils.TextEncoding('utf-8', 0)
+    assert preview_utils.build_line_index(io.BytesIO(b'a\nb'), encoding).total_lines == 2
+    assert preview_utils.build_line_index(io.BytesIO(b''), encoding).total_lines == 1
+
+
+def test_line_index_over_compressed_stream():
+    data = TEXT.encode('utf-8') * 40
+    compressed = zstandard.ZstdCompressor(level=3).compress(data)
+    reader = zstandard.ZstdDecompressor().stream_reader(io.BytesIO(compressed))
+    index = preview_utils.build_line_index(reader, preview_utils.TextEncoding('utf-8', 0))
+    assert index.total_lines == len(LINES) * 40
+    assert index.offsets[1] == len(''.join(LINES[:preview_utils.LINE_INDEX_STEP]).encode('utf-8'))
+
+
+def test_line_index_cache(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, 'LINE_INDEX_DIR', tmp_path / 'line_index')
+    sha256 = 'ab' * 32
+    calls = []
+
+    def build():
+        calls.append(1)
+        return preview_utils.build_line_index(io.BytesIO(TEXT.encode('utf-8')), preview_utils.TextEncoding('utf-8', 0))
+
+    async def run():
+        return await asyncio.gather(*(preview_utils.ensure_line_index(sha256, build) for _ in range(3)))
+
+    results = asyncio.run(run())
+    assert len(calls) == 1 and results[0] == results[2]
+    assert preview_utils.load_line_index(sha256) == results[0]
+    assert asyncio.run(preview_utils.ensure_line_index(sha256, build)) == results[0]
+    assert len(calls) == 1
+
+    assert preview_utils.remove_line_index(sha256) is True
+    assert preview_utils.load_line_index(sha256) is None
@@ -0,0 +1,58 @@
+"""
+存储对账工具测试：有序并行执行、分片目录的有序扫描、磁盘与数据库键的归并
+"""
+import os
+import time
+
+from utils import reconcile_utils
+
+
+def _touch(path, content=b'x'):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb') as f:
+        f.write(content)
+
+
+def test_ordered_parallel_map_keeps_order():
+    def slow_square(n):
+        time.sleep(0.001 * (n % 3))
+        return n * n
+
+    assert list(reconcile_utils.ordered_parallel_map(slow_square, iter(range(50)), workers=4, window=3)) == [
+        n * n for n in range(50)
+    ]
+
+
+def test_scan_sharded_is_globally_sorted(tmp_path):
+    names = ['ff' + 'a' * 62, '00' + 'b' * 62, '0a' + 'c' * 62, '0a' + '0' * 62, 'a1' + 'd' * 62]
+    for name in names:
+        _touch(tmp_path / name[:2] / name[2:4] / name)
+    # 不是两位十六进制的目录（如上传临时目录）不扫描
+    _touch(tmp_path / 'tmp' / 'upload.part')
+
+    entries = list(reconcile_utils.scan_sharded(tmp_path, 2, workers=3))
+    assert [entry.name for entry in entries] == sorted(names)
+    assert all(reconcile_utils.file_stat(entry.path).st_size == 1 for entry in entries)
+    assert list(reconcile_utils.scan_sharded(tmp_path / 'missing', 2)) == []
+
+
+def test_walk_files(tmp_path):
+    _touch(tmp_path / 'b.txt')
+    _touch(tmp_path / 'notes' / 'a.txt')
+    assert [entry.name for entry in reconcile_utils.walk_files(tmp_path)] == ['b.txt', 'notes/a.txt']
+
+
+def test_merge_join_reports_orphans_and_missing():
+    disk = ['a_1', 'a_2', 'c_1', 'd_1']
+    keys = ['a', 'b', 'd', 'e']
+    result = list(reconcile_utils.merge_join(disk, keys, lambda name: name.split('_')[0]))
+    assert result == [
+        ('a', 'a_1', True),
+        ('a', 'a_2', True),
+        ('b', None, True),
+        ('c', 'c_1', False),
+        ('d', 'd_1', True),
+        ('e', None, True),
+    ]
+    assert list(reconcile_utils.merge_join([], ['x'], str)) == [('x', None, True)]
+    assert list(reconcile_utils.merge_join(['x'], [], str)) == [('x', 'x', False)]
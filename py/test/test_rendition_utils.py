@@ -0,0 +1,91 @@
+"""
+图片转码工具测试：Accept 协商、去掉EXIF并缩小、压缩存储的原图、没有变小时不保留、清理
+"""
+import io
+import os
+
+import pytest
+import zstandard
+from PIL import Image
+
+from config import settings
+from utils import compression_utils, rendition_utils
+
+SHA = 'cd' * 32
+
+
+@pytest.fixture
+def rendition_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, 'IMAGE_RENDITION_DIR', tmp_path / 'renditions')
+    monkeypatch.setattr(settings, 'IMAGE_RENDITION_FORMATS', ('avif', 'webp'))
+    return tmp_path / 'renditions'
+
+
+def _photo(size=(3000, 2000)) -> bytes:
+    """带EXIF（拍摄设备、方向=旋转90度）的噪点JPEG，模拟手机照片"""
+    image = Image.effect_noise(size, 40).convert('RGB')
+    exif = Image.Exif()
+    exif[0x010f] = 'PhoneMaker'
+    exif[0x0112] = 6
+    buf = io.BytesIO()
+    image.save(buf, 'JPEG', quality=95, exif=exif.tobytes())
+    return buf.getvalue()
+
+
+def test_negotiate_only_explicit_types():
+    available = ['avif', 'webp']
+    chrome = 'image/avif,image/webp,image/apng,image/svg+xml,image/*,*/*;q=0.8'
+    assert rendition_utils.negotiate(chrome, available) == 'avif'
+    assert rendition_utils.negotiate(chrome, ['webp']) == 'webp'
+    assert rendition_utils.negotiate('image/avif;q=0.5, image/webp', available) == 'webp'
+    assert rendition_utils.negotiate('image/webp;q=0', ['webp']) is None
+    # 只有通配符的客户端（下载工具、curl）拿到原图
+    assert rendition_utils.negotiate('*/*', available) is None
+    assert rendition_utils.negotiate('image/*', available) is None
+    assert rendition_utils.negotiate(None, available) is None
+
+
+def test_source_types():
+    assert rendition_utils.is_rendition_source('IMG_0001.JPG')
+    assert rendition_utils.is_rendition_source('scan', 'image/png')
+    assert not rendition_utils.is_rendition_source('anim.gif', 'image/gif')
+    assert not rendition_utils.is_rendition_source('notes.txt', 'text/plain')
+
+
+def test_render_strips_exif_and_downscales(tmp_path, rendition_dir):
+    content = _photo()
+    source = tmp_path / 'blob'
+    source.write_bytes(zstandard.ZstdCompressor().compress(content))
+
+    produced = rendition_utils.render_renditions(str(source), compression_utils.CODEC_ZSTD, SHA, ('webp',),
+                                                 1024, 75, 0.1, len(content), str(rendition_dir))
+    assert produced == ['webp']
+    path = rendition_utils.rendition_path(SHA, 'webp')
+    assert os.path.getsize(path) < len(content)
+    with Image.open(path) as image:
+        assert image.format == 'WEBP'
+        # 按EXIF方向转正后缩小：竖图
+        assert image.size == (683, 1024)
+        assert not image.getexif()
+    # 临时工作目录不会留下
+    assert {p.name for p in (rendition_dir / SHA[:2]).iterdir()} == {f"{SHA}.webp"}
+
+
+def test_not_smaller_is_skipped_and_removed(tmp_path, rendition_dir):
+    buf = io.BytesIO()
+    Image.new('RGB', (64, 64), (10, 120, 200)).save(buf, 'PNG')
+    source = tmp_path / 'tiny.png'
+    source.write_bytes(buf.getvalue())
+
+    # 要求节省99%以上，转码结果不保留并写入标记
+    assert rendition_utils.render_renditions(str(source), None, SHA, ('webp',), 1024, 75, 0.99,
+                                             len(buf.getvalue()), str(rendition_dir)) == []
+    assert not rendition_utils.rendition_path(SHA, 'webp').exists()
+    assert rendition_utils.remove_renditions(SHA) == 1
+
+    broken = tmp_path / 'broken.jpg'
+    broken.write_bytes(b'not an image' * 100)
+    assert rendition_utils.render_renditions(str(broken), None, SHA, ('webp',), 1024, 75, 0.1,
+                                             1200, str(rendition_dir)) == []
+    assert rendition_utils.remove_renditions(SHA) == 1
+    assert rendition_utils.available_renditions(SHA) == []
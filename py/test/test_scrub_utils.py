@@ -0,0 +1,76 @@
+"""
+存储完整性校验工具测试：原样/zstd 存储内容的哈希、发现损坏、按字节限速
+"""
+import hashlib
+import os
+
+import pytest
+import zstandard
+
+from utils import scrub_utils
+
+TEXT = ('第一章 学习计划 study plan for the week\n' * 20000).encode('utf-8')
+
+
+def test_hash_plain_file_in_blocks(tmp_path):
+    path = tmp_path / 'blob'
+    content = os.urandom(300 * 1024 + 17)
+    path.write_bytes(content)
+
+    result = scrub_utils.hash_file(path, None, read_size=64 * 1024)
+    assert result == (hashlib.sha256(content).hexdigest(), len(content), len(content))
+
+    empty = tmp_path / 'empty'
+    empty.write_bytes(b'')
+    assert scrub_utils.hash_file(empty).sha256 == hashlib.sha256(b'').hexdigest()
+
+
+def test_hash_zstd_file_is_hash_of_original_content(tmp_path):
+    path = tmp_path / 'blob'
+    path.write_bytes(zstandard.ZstdCompressor(level=3).compress(TEXT))
+
+    result = scrub_utils.hash_file(path, 'zstd', read_size=64 * 1024)
+    assert result.sha256 == hashlib.sha256(TEXT).hexdigest()
+    assert result.plain_bytes == len(TEXT)
+    assert result.stored_bytes == os.path.getsize(path)
+
+
+def test_detects_corruption(tmp_path):
+    plain = tmp_path / 'plain'
+    content = bytearray(os.urandom(100 * 1024))
+    expected = hashlib.sha256(content).hexdigest()
+    content[5000] ^= 0x01
+    plain.write_bytes(content)
+    assert scrub_utils.hash_file(plain).sha256 != expected
+
+    compressed = tmp_path / 'compressed'
+    data = bytearray(zstandard.ZstdCompressor(level=3).compress(TEXT))
+    data[len(data) // 2] ^= 0xff
+    compressed.write_bytes(data)
+    with pytest.raises(zstandard.ZstdError):
+        scrub_utils.hash_file(compressed, 'zstd')
+
+    with pytest.raises(FileNotFoundError):
+        scrub_utils.hash_file(tmp_path / 'missing')
+
+
+def test_rate_limiter_sleeps_for_excess_bytes():
+    now = [0.0]
+    sleeps = []
+
+    def sleep(seconds):
+        sleeps.append(seconds)
+        now[0] += seconds
+
+    limiter = scrub_utils.RateLimiter(1000, sleep=sleep, clock=lambda: now[0])
+    limiter.consume(1000)
+    assert sleeps == []
+    limiter.consume(500)
+    assert sleeps == [pytest.approx(0.5)]
+    now[0] += 10
+    limiter.consume(1000)
+    assert len(sleeps) == 1
+
+    unlimited = scrub_utils.RateLimiter(0, sleep=sleep, clock=lambda: now[0])
+    unlimited.consume(10 ** 9)
+    assert len(sleeps) == 1
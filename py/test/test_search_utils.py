@@ -0,0 +1,68 @@
+"""
+全文搜索工具测试：中英文分词、文本解码、docx 文本提取、BM25 排序和摘要
+"""
+import io
+import zipfile
+
+from utils import search_utils
+
+
+def _opener(content: bytes):
+    def open_content():
+        reader = io.BytesIO(content)
+        return reader, [reader]
+    return open_content
+
+
+def test_tokenize():
+    assert search_utils.tokenize('学习计划 Study-Plan') == [
+        '学习', '习计', '计划', '学', '习', '计', '划', 'study', 'plan'
+    ]
+    # 查询：多字中文只用二元组，全角字符归一，重复的词去掉
+    assert search_utils.query_terms('学习 ＢＭ２５ bm25 学') == ['学习', 'bm25', '学']
+    assert search_utils.query_terms(' ,, ') == []
+    assert search_utils.tokenize('a' * 100) == []
+
+
+def test_decode_text():
+    assert search_utils.decode_text('中文编码'.encode('gbk')) == '中文编码'
+    assert search_utils.decode_text(b'\xef\xbb\xbf' + '中文'.encode('utf-8')) == '中文'
+    # 截断在多字节字符中间
+    assert search_utils.decode_text('中文'.encode('utf-8')[:-1]) == '中'
+
+
+def test_extract_docx_and_text():
+    buf = io.BytesIO()
+    with zipfile.ZipFile(buf, 'w') as zf:
+        zf.writestr('word/document.xml',
+                    '<w:document xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main"><w:body>'
+                    '<w:p><w:r><w:t>季度报告</w:t></w:r></w:p><w:p><w:r><w:t>销售额</w:t><w:tab/><w:t>增长</w:t></w:r></w:p>'
+                    '</w:body></w:document>')
+    assert search_utils.document_kind('report.docx') == search_utils.KIND_DOCX
+    assert search_utils.extract_text(_opener(buf.getvalue()), search_utils.KIND_DOCX, 1000) == '季度报告\n销售额\t增长\n'
+
+    assert search_utils.document_kind('main.py') == search_utils.KIND_TEXT
+    assert search_utils.document_kind('photo.jpg', 'image/jpeg') is None
+    assert search_utils.extract_text(_opener('第一章'.encode() * 100), search_utils.KIND_TEXT, 5) == '第一章第一'
+
+
+def test_bm25_and_snippet():
+    docs = {
+        1: '本周学习计划：复习英语单词',
+        2: '会议纪要 ' * 50 + '学习',
+        3: '天气不错',
+    }
+    postings = {}
+    lengths = {}
+    for doc_id, text in docs.items():
+        counts, lengths[doc_id] = search_utils.term_frequencies('', text)
+        for term, tf in counts.items():
+            postings.setdefault(term, {})[doc_id] = tf
+    terms = search_utils.query_terms('学习计划')
+    scores = search_utils.bm25_scores({t: postings[t] for t in terms if t in postings}, lengths,
+                                      len(docs), sum(lengths.values()) / len(docs))
+    assert sorted(scores, key=scores.get, reverse=True) == [1, 2]
+
+    snippet, highlights = search_utils.make_snippet('x' * 200 + '本周的学习计划如下', '学习计划', width=40)
+    assert snippet.startswith('…')
+    assert [snippet[a:b] for a, b in highlights] == ['学习计划']
@@ -0,0 +1,148 @@
+"""
+分享链接工具测试：密码和访问凭证、Range 请求计数规则、缓存失效，以及并发下载不超过最大下载次数
+"""
+import threading
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import Boolean, Column, DateTime, Integer, MetaData, Table, create_engine, insert, select
+
+from utils import share_utils
+
+CODE = 'AbCdEfGhIjKlMnOp'
+
+
+def _info(**overrides):
+    fields = dict(id=1, file_id=2, user_id=3, password_hash=None, expires_at=None, max_downloads=None)
+    fields.update(overrides)
+    return share_utils.ShareInfo(**fields)
+
+
+def _share_table(path, **values):
+    engine = create_engine(f"sqlite:///{path}", connect_args={'timeout': 30})
+    table = Table(
+        'file_share_links', MetaData(),
+        Column('id', Integer, primary_key=True),
+        Column('is_active', Boolean, nullable=False, default=True),
+        Column('expires_at', DateTime, nullable=True),
+        Column('max_downloads', Integer, nullable=True),
+        Column('download_count', Integer, nullable=False, default=0),
+    )
+    table.metadata.create_all(engine)
+    with engine.begin() as conn:
+        conn.execute(insert(table), [{'id': 1, **values}])
+    return engine, table
+
+
+def _count(engine, table) -> int:
+    with engine.connect() as conn:
+        return conn.execute(select(table.c.download_count)).scalar_one()
+
+
+def test_password():
+    assert share_utils.check_password(_info(), None)
+    info = _info(password_hash=share_utils.hash_password('1234'))
+    assert share_utils.check_password(info, '1234')
+    assert not share_utils.check_password(info, '12345')
+    assert not share_utils.check_password(info, None)
+    # 每次哈希使用随机盐，同一密码在不同分享中不同
+    assert share_utils.hash_password('1234') != info.password_hash
+    assert '1234' not in info.password_hash
+
+
+def test_access_token():
+    info = _info(id=7, password_hash=share_utils.hash_password('1234'))
+    token = share_utils.new_access_token(7)
+    assert share_utils.has_access(info, token)
+    assert share_utils.has_access(_info(), None)
+    assert not share_utils.has_access(info, None)
+    assert not share_utils.has_access(info, 'not-a-token')
+    # 凭证只对签发时的分享有效，过期后失效
+    assert not share_utils.has_access(info._replace(id=8), token)
+    assert not share_utils.has_access(info, share_utils.new_access_token(7, ttl=-1))
+
+
+def test_counts_as_download():
+    size, etag = 10000, '"abc"'
+
+    def counts(range_header=None, if_range=None):
+        headers = {key: value for key, value in (('range', range_header), ('if-range', if_range)) if value}
+        return share_utils.counts_as_download(headers, size, etag)
+
+    assert counts()
+    assert counts('bytes=0-')
+    assert counts('bytes=0-1023, 4096-')
+    assert not counts('bytes=1024-')
+    assert not counts('bytes=-500')
+    assert not counts('bytes=1024-, 4096-', if_range=etag)
+    # 后缀区间或多段中的任一段覆盖到开头时仍然计数
+    assert counts(f'bytes=-{size}')
+    assert counts(f'bytes=-{size * 2}')
+    assert counts('bytes=1-,0-0')
+    assert counts('bytes=5000-, -99999')
+    # 被忽略的 Range、不匹配的 If-Range 会返回完整文件
+    assert counts('bytes=abc-')
+    assert counts('items=1-')
+    assert counts('bytes=1024-', if_range='"stale"')
+    assert counts('bytes=1024-', if_range='Mon, 19 Oct 2026 00:00:00 GMT')
+    # 无法满足的 Range 返回416，不发送内容
+    assert not counts(f'bytes={size}-')
+
+
+def test_cache_expiry_and_invalidate(monkeypatch):
+    cache = share_utils.ShareCache(max_items=2, ttl=60)
+    cache.put('a', _info(id=1))
+    cache.put('b', _info(id=2))
+    assert cache.get('a').id == 1
+    cache.put('c', _info(id=3))
+    # 超出容量时淘汰最久没有访问的
+    assert cache.get('b') is None and cache.get('a') is not None
+    cache.invalidate('a')
+    assert cache.get('a') is None
+
+    now = time.monotonic()
+    monkeypatch.setattr(share_utils.time, 'monotonic', lambda: now + 61)
+    assert cache.get('c') is None
+
+
+def test_claim_respects_state(tmp_path):
+    engine, table = _share_table(tmp_path / 'limited.db', max_downloads=1,
+                                 expires_at=datetime.now() + timedelta(hours=1))
+    with engine.begin() as conn:
+        assert share_utils.download_allowed(conn, table, 1)
+        assert share_utils.claim_download(conn, table, 1)
+        assert not share_utils.claim_download(conn, table, 1)
+        assert not share_utils.download_allowed(conn, table, 1)
+    assert _count(engine, table) == 1
+
+    engine, table = _share_table(tmp_path / 'inactive.db', is_active=False)
+    with engine.begin() as conn:
+        conn.execute(table.update().values(is_active=True, expires_at=datetime.now() - timedelta(seconds=1)))
+        assert not share_utils.claim_download(conn, table, 1)
+        assert not share_utils.download_allowed(conn, table, 1)
+        conn.execute(table.update().values(is_active=False, expires_at=None))
+        assert not share_utils.claim_download(conn, table, 1)
+        assert not share_utils.download_allowed(conn, table, 1)
+
+
+def test_concurrent_claims_never_exceed_limit(tmp_path):
+    limit, threads, attempts = 50, 8, 25
+    engine, table = _share_table(tmp_path / 'popular.db', max_downloads=limit)
+    granted = []
+    start = threading.Barrier(threads)
+
+    def worker():
+        start.wait()
+        for _ in range(attempts):
+            with engine.begin() as conn:
+                if share_utils.claim_download(conn, table, 1):
+                    granted.append(1)
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+
+    assert len(granted) == limit
+    assert _count(engine, table) == limit
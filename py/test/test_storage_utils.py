@@ -0,0 +1,168 @@
+"""
+云盘内容寻址存储工具测试
+"""
+import asyncio
+import hashlib
+import io
+import threading
+from pathlib import Path
+
+import pytest
+
+from config import settings
+from utils import storage_utils
+
+
+class _FakeUpload:
+    """模拟 starlette UploadFile 的异步读取接口"""
+
+    def __init__(self, content: bytes):
+        self._buffer = io.BytesIO(content)
+
+    async def read(self, size: int = -1) -> bytes:
+        return self._buffer.read(size)
+
+
+@pytest.fixture
+def blob_dirs(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, 'BLOB_DIR', tmp_path / 'blobs')
+    monkeypatch.setattr(settings, 'BLOB_TMP_DIR', tmp_path / 'blobs' / 'tmp')
+    return tmp_path
+
+
+def test_save_upload_hashes_in_stream(blob_dirs):
+    content = b'lecture slides' * 100000
+    tmp_path, sha256, size = asyncio.run(storage_utils.save_upload_to_temp(_FakeUpload(content)))
+    assert sha256 == hashlib.sha256(content).hexdigest()
+    assert size == len(content)
+    assert tmp_path.read_bytes() == content
+
+
+def test_writer_hashes_off_the_event_loop(tmp_path, monkeypatch):
+    write_block = storage_utils.HashingFileWriter._write_block
+    threads = []
+
+    def tracked_write_block(self, block):
+        threads.append(threading.get_ident())
+        write_block(self, block)
+
+    monkeypatch.setattr(storage_utils.HashingFileWriter, '_write_block', tracked_write_block)
+    # 请求体按小块到达，攒到 CHUNK_SIZE 才写入一次
+    pieces = [bytes([i % 256]) * 65536 for i in range(40)]
+
+    async def write():
+        async with storage_utils.HashingFileWriter(tmp_path / 'part') as writer:
+            for piece in pieces:
+                await writer.write(piece)
+        return writer
+
+    writer = asyncio.run(write())
+    content = b''.join(pieces)
+    assert (tmp_path / 'part').read_bytes() == content
+    assert (writer.size, writer.hexdigest()) == (len(content), hashlib.sha256(content).hexdigest())
+    assert len(threads) == -(-len(content) // storage_utils.CHUNK_SIZE)
+    assert threading.get_ident() not in threads
+
+
+def test_save_upload_enforces_max_size(blob_dirs):
+    with pytest.raises(storage_utils.FileTooLargeError):
+        asyncio.run(storage_utils.save_upload_to_temp(_FakeUpload(b'x' * 100), max_size=10))
+    assert list(settings.BLOB_TMP_DIR.iterdir()) == []
+
+
+def test_commit_deduplicates_identical_content(blob_dirs):
+    first, sha256, _ = storage_utils.save_bytes_to_temp(b'same bytes')
+    second, _, _ = storage_utils.save_bytes_to_temp(b'same bytes')
+
+    target = storage_utils.commit_temp_as_blob(first, sha256)
+    assert storage_utils.commit_temp_as_blob(second, sha256) == target
+    assert target == storage_utils.blob_path(sha256)
+    assert not second.exists()
+    assert target.read_bytes() == b'same bytes'
+
+    assert storage_utils.remove_blob(sha256)
+    assert not storage_utils.remove_blob(sha256)
+
+
+def test_is_valid_sha256():
+    assert storage_utils.is_valid_sha256('a' * 64)
+    assert not storage_utils.is_valid_sha256('A' * 64)
+    assert not storage_utils.is_valid_sha256('../etc/passwd')
+    assert not storage_utils.is_valid_sha256(None)
+
+
+def test_remove_path_handles_files_dirs_and_missing(tmp_path):
+    single = tmp_path / 'a.bin'
+    single.write_bytes(b'x')
+    tree = tmp_path / 'user_1' / 'notes'
+    tree.mkdir(parents=True)
+    (tree / 'n.txt').write_text('n')
+
+    assert storage_utils.remove_path(single) is True
+    assert storage_utils.remove_path(tmp_path / 'user_1') is True
+    assert not (tmp_path / 'user_1').exists()
+    assert storage_utils.remove_path(single) is False
+
+
+def test_storage_keys_round_trip(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, 'CLOUD_DISK_DIR', tmp_path / 'cloud_disk')
+    monkeypatch.setattr(settings, 'BLOB_DIR', tmp_path / 'cloud_disk' / 'blobs')
+    monkeypatch.setattr(settings, 'UPLOAD_DIR', tmp_path / 'uploads')
+    sha256 = 'ab' * 32
+
+    assert storage_utils.blob_key(sha256) == f"blobs/ab/ab/{sha256}"
+    assert storage_utils.resolve_storage_path(storage_utils.blob_key(sha256)) == storage_utils.blob_path(sha256)
+    legacy = tmp_path / 'uploads' / 'user_3' / 'a.docx'
+    assert storage_utils.storage_key(legacy) == 'uploads/user_3/a.docx'
+    assert storage_utils.resolve_storage_path('cloud_disk/3/x.txt') == tmp_path / 'cloud_disk' / '3' / 'x.txt'
+    # 存储目录之外的路径保持绝对路径；无法识别的相对路径交给调用方按旧规则处理
+    assert storage_utils.storage_key('/srv/other/x.txt') == '/srv/other/x.txt'
+    assert storage_utils.resolve_storage_path('/srv/other/x.txt') == Path('/srv/other/x.txt')
+    assert storage_utils.resolve_storage_path('x.txt') is None
+    assert storage_utils.remove_path('x.txt') is False
+
+
+def test_cold_tier_keys_and_remove(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, 'CLOUD_DISK_DIR', tmp_path / 'cloud_disk')
+    monkeypatch.setattr(settings, 'BLOB_DIR', tmp_path / 'cloud_disk' / 'blobs')
+    monkeypatch.setattr(settings, 'COLD_BLOB_DIR', tmp_path / 'hdd' / 'cold_blobs')
+    sha256 = 'cd' * 32
+
+    cold = storage_utils.blob_path(sha256, storage_utils.TIER_COLD)
+    assert cold == tmp_path / 'hdd' / 'cold_blobs' / 'cd' / 'cd' / sha256
+    assert storage_utils.blob_key(sha256, storage_utils.TIER_COLD) == f"cold_blobs/cd/cd/{sha256}"
+    assert storage_utils.resolve_storage_path(storage_utils.blob_key(sha256, storage_utils.TIER_COLD)) == cold
+    assert storage_utils.new_temp_path(storage_utils.TIER_COLD).parent == tmp_path / 'hdd' / 'cold_blobs' / 'tmp'
+
+    for path in (cold, storage_utils.blob_path(sha256)):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(b'x')
+    assert storage_utils.remove_blob(sha256) is True
+    assert not cold.exists() and not storage_utils.blob_path(sha256).exists()
+    assert storage_utils.remove_blob(sha256) is False
+
+
+def test_possession_challenge():
+    content = bytes(range(256)) * 1024
+    sha256 = hashlib.sha256(content).hexdigest()
+    challenge = storage_utils.new_possession_challenge(7, sha256, len(content))
+    offset, length = challenge['offset'], challenge['length']
+    assert length == min(storage_utils.POSSESSION_RANGE_SIZE, len(content))
+    assert 0 <= offset <= len(content) - length
+
+    assert storage_utils.read_possession_challenge(challenge['token'], 7, sha256, len(content)) == (
+        challenge['nonce'], offset, length)
+    # 挑战只对申请它的用户和内容有效
+    assert storage_utils.read_possession_challenge(challenge['token'], 8, sha256, len(content)) is None
+    assert storage_utils.read_possession_challenge(challenge['token'], 7, 'b' * 64, len(content)) is None
+    assert storage_utils.read_possession_challenge(challenge['token'] + 'x', 7, sha256, len(content)) is None
+
+    proof = storage_utils.possession_proof(io.BytesIO(content), challenge['nonce'], offset, length)
+    expected = hashlib.sha256(challenge['nonce'].encode() + content[offset:offset + length]).hexdigest()
+    assert proof == expected
+
+    # 小文件的区间是整个文件，证明仍然需要内容（不等于公开的内容哈希）
+    small = storage_utils.new_possession_challenge(7, sha256, 10)
+    assert (small['offset'], small['length']) == (0, 10)
+    assert storage_utils.possession_proof(io.BytesIO(b'0123456789'), small['nonce'], 0, 10) != \
+        hashlib.sha256(b'0123456789').hexdigest()
@@ -0,0 +1,75 @@
+"""
+缩略图工具测试：尺寸选择、生成各尺寸WebP、压缩存储的源、解码失败标记与清理
+"""
+import io
+
+import pytest
+import zstandard
+from PIL import Image
+
+from config import settings
+from utils import compression_utils, thumbnail_utils
+
+SHA = 'ab' * 32
+SIZES = (64, 128)
+
+
+@pytest.fixture
+def thumb_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, 'THUMBNAIL_DIR', tmp_path / 'thumbnails')
+    monkeypatch.setattr(settings, 'THUMBNAIL_SIZES', SIZES)
+    return tmp_path / 'thumbnails'
+
+
+def _png(size=(400, 300), mode='RGB') -> bytes:
+    buf = io.BytesIO()
+    Image.new(mode, size, (10, 120, 200, 128)[:len(mode)]).save(buf, 'PNG')
+    return buf.getvalue()
+
+
+def test_kind_and_size():
+    assert thumbnail_utils.thumbnail_kind('照片.JPG') == thumbnail_utils.KIND_IMAGE
+    assert thumbnail_utils.thumbnail_kind('scan', 'image/png') == thumbnail_utils.KIND_IMAGE
+    assert thumbnail_utils.thumbnail_kind('notes.txt', 'text/plain') is None
+
+    assert thumbnail_utils.pick_size(None, (128, 256, 512)) == 128
+    assert thumbnail_utils.pick_size(200, (128, 256, 512)) == 256
+    assert thumbnail_utils.pick_size(2000, (128, 256, 512)) == 512
+
+
+def test_render_all_sizes(tmp_path, thumb_dir):
+    source = tmp_path / 'photo.png'
+    source.write_bytes(_png(mode='RGBA'))
+
+    assert thumbnail_utils.render_thumbnails(str(source), None, thumbnail_utils.KIND_IMAGE, SHA,
+                                             SIZES, 80, str(thumb_dir))
+    assert thumbnail_utils.has_thumbnails(SHA)
+    for size in SIZES:
+        with Image.open(thumbnail_utils.thumbnail_path(SHA, size)) as image:
+            assert image.format == 'WEBP'
+            assert max(image.size) == size
+            assert image.mode == 'RGBA'
+    # 临时工作目录不会留下
+    assert {p.name for p in (thumb_dir / SHA[:2]).iterdir()} == {f"{SHA}_{size}.webp" for size in SIZES}
+
+
+def test_render_compressed_source(tmp_path, thumb_dir):
+    source = tmp_path / 'blob'
+    source.write_bytes(zstandard.ZstdCompressor().compress(_png()))
+
+    assert thumbnail_utils.render_thumbnails(str(source), compression_utils.CODEC_ZSTD, thumbnail_utils.KIND_IMAGE,
+                                             SHA, SIZES, 80, str(thumb_dir))
+    assert thumbnail_utils.has_thumbnails(SHA)
+
+
+def test_undecodable_source_is_marked_and_removed(tmp_path, thumb_dir):
+    source = tmp_path / 'broken.jpg'
+    source.write_bytes(b'not an image' * 100)
+
+    assert not thumbnail_utils.render_thumbnails(str(source), None, thumbnail_utils.KIND_IMAGE, SHA,
+                                                 SIZES, 80, str(thumb_dir))
+    marker = thumb_dir / SHA[:2] / f"{SHA}{thumbnail_utils.FAILED_SUFFIX}"
+    assert marker.exists()
+
+    assert thumbnail_utils.remove_thumbnails(SHA) == 1
+    assert not marker.exists()
@@ -0,0 +1,34 @@
+"""
+冷存储分层工具测试：访问记录的批量取出、计时读取
+"""
+import hashlib
+import os
+
+import zstandard
+
+from utils import tiering_utils
+
+TEXT = ('第一章 学习计划 study plan for the week\n' * 20000).encode('utf-8')
+
+
+def test_access_tracker_drains_unique_sorted():
+    tracker = tiering_utils.AccessTracker()
+    for sha256 in ('b' * 64, 'a' * 64, 'b' * 64, None, ''):
+        tracker.touch(sha256)
+    assert tracker.drain() == ['a' * 64, 'b' * 64]
+    assert tracker.drain() == []
+
+
+def test_timed_read_hashes_original_content(tmp_path):
+    plain = tmp_path / 'plain'
+    content = os.urandom(200 * 1024)
+    plain.write_bytes(content)
+    timing = tiering_utils.timed_read(plain, None)
+    assert (timing.plain_bytes, timing.sha256) == (len(content), hashlib.sha256(content).hexdigest())
+    assert 0 <= timing.first_byte_seconds <= timing.total_seconds
+
+    compressed = tmp_path / 'compressed'
+    compressed.write_bytes(zstandard.ZstdCompressor(level=19).compress(TEXT))
+    tiering_utils.drop_page_cache(compressed)
+    timing = tiering_utils.timed_read(compressed, 'zstd')
+    assert (timing.plain_bytes, timing.sha256) == (len(TEXT), hashlib.sha256(TEXT).hexdigest())
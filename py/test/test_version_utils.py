@@ -0,0 +1,84 @@
+"""
+文件历史版本工具测试：分块边界在局部修改后保持稳定、块清单往返、块的保存和版本还原
+"""
+import random
+
+import pytest
+
+from config import settings
+from utils import version_utils
+
+
+@pytest.fixture
+def chunk_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(settings, 'VERSION_CHUNK_DIR', tmp_path / 'version_chunks')
+    return tmp_path / 'version_chunks'
+
+
+def _text(lines=20000, seed=1) -> bytes:
+    rng = random.Random(seed)
+    words = ['alpha', 'beta', 'gamma', 'delta', '学习', '计划', 'return', 'value', '{', '}']
+    return '\n'.join(
+        ' '.join(rng.choice(words) for _ in range(rng.randint(1, 12))) for _ in range(lines)
+    ).encode('utf-8')
+
+
+def test_boundaries_cover_content():
+    data = _text()
+    cuts = version_utils.chunk_boundaries(data)
+    assert cuts[-1] == len(data)
+    sizes = [b - a for a, b in zip([0] + cuts, cuts)]
+    assert all(size <= version_utils.MAX_CHUNK_SIZE for size in sizes)
+    assert all(size >= version_utils.MIN_CHUNK_SIZE for size in sizes[:-1])
+    # 没有换行的内容按最大块强制切分
+    assert version_utils.chunk_boundaries(b'x' * (version_utils.MAX_CHUNK_SIZE * 2 + 1)) == [
+        version_utils.MAX_CHUNK_SIZE, version_utils.MAX_CHUNK_SIZE * 2, version_utils.MAX_CHUNK_SIZE * 2 + 1
+    ]
+    assert version_utils.chunk_boundaries(b'') == []
+
+
+def test_local_edit_changes_few_chunks():
+    data = _text()
+    middle = data.index(b'\n', len(data) // 2) + 1
+    edited = data[:middle] + b'inserted line\n' + data[middle:]
+
+    before = {sha for sha, _, _ in version_utils.split_chunks(data)}
+    after = {sha for sha, _, _ in version_utils.split_chunks(edited)}
+    assert len(after - before) <= 2
+    assert len(before) > 20
+
+
+def test_store_and_read_version(chunk_dir):
+    data = _text(lines=3000)
+    chunks = version_utils.split_chunks(data)
+    for sha, start, end in chunks:
+        assert version_utils.store_chunk(sha, data[start:end]) > 0
+    # 已存在的块不重复写
+    sha, start, end = chunks[0]
+    assert version_utils.store_chunk(sha, data[start:end]) == version_utils.chunk_path(sha).stat().st_size
+
+    manifest = version_utils.pack_manifest(sha for sha, _, _ in chunks)
+    assert len(manifest) == len(chunks) * version_utils.DIGEST_SIZE
+    assert version_utils.unpack_manifest(manifest) == [sha for sha, _, _ in chunks]
+    assert version_utils.read_version(manifest) == data
+    assert not list(chunk_dir.rglob('*.tmp'))
+
+    assert version_utils.remove_chunk(sha)
+    assert not version_utils.remove_chunk(sha)
+    with pytest.raises(FileNotFoundError):
+        version_utils.read_version(manifest)
+
+
+def test_store_chunks_writes_each_distinct_chunk_once(chunk_dir, monkeypatch):
+    data = _text(lines=3000) * 2
+    chunks = version_utils.split_chunks(data)
+    digests = {sha for sha, _, _ in chunks}
+    assert len(digests) < len(chunks)
+
+    writes = []
+    store_chunk = version_utils.store_chunk
+    monkeypatch.setattr(version_utils, 'store_chunk', lambda sha, block: writes.append(sha) or store_chunk(sha, block))
+    stored_sizes = version_utils.store_chunks(data, chunks)
+    assert sorted(writes) == sorted(digests)
+    assert stored_sizes == {sha: version_utils.chunk_path(sha).stat().st_size for sha in digests}
+    assert version_utils.read_version(version_utils.pack_manifest(sha for sha, _, _ in chunks)) == data
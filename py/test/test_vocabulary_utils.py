@@ -0,0 +1,88 @@
+"""
+单词表AI补全工具测试：按token预算分批、并发数上限、截断的批次拆分重试、提前退出时取消请求
+"""
+import asyncio
+
+from utils import vocabulary_utils
+
+
+def test_plan_batches_respects_budget():
+    words = [f"word{i}" for i in range(100)]
+    batches = vocabulary_utils.plan_batches(words, 'en', token_budget=1000, max_batch=40)
+    assert [w for batch in batches for w in batch] == words
+    for batch in batches:
+        cost = sum(vocabulary_utils.estimate_word_tokens(w, 'en') for w in batch)
+        assert cost <= 1000 * vocabulary_utils.TOKEN_HEADROOM
+    # 预算足够时按单词数上限分批
+    assert [len(b) for b in vocabulary_utils.plan_batches(words, 'en', 100000, 40)] == [40, 40, 20]
+    # 中日韩结果更长，同样的预算每批更少
+    assert len(vocabulary_utils.plan_batches(words, 'ja', 1000, 40)) > len(batches)
+    # 单个单词超出预算时单独成批
+    assert vocabulary_utils.plan_batches(['a', 'b'], 'en', 10, 40) == [['a'], ['b']]
+    assert vocabulary_utils.plan_batches([], 'en', 1000, 40) == []
+
+
+def test_enrich_batches_limits_concurrency():
+    batches = [[f"w{i}"] for i in range(12)]
+    active = 0
+    peak = 0
+
+    async def enrich(batch):
+        nonlocal active, peak
+        active += 1
+        peak = max(peak, active)
+        # 后提交的批次先完成
+        await asyncio.sleep(0.01 * (12 - int(batch[0][1:])) / 12)
+        active -= 1
+        return [w.upper() for w in batch]
+
+    async def run():
+        return [item async for item in vocabulary_utils.enrich_batches(batches, enrich, concurrency=3)]
+
+    results = asyncio.run(run())
+    assert peak == 3
+    assert sorted(batch[0] for batch, _ in results) == sorted(b[0] for b in batches)
+    assert all(result == [batch[0].upper()] for batch, result in results)
+
+
+def test_truncated_batches_are_split():
+    calls = []
+
+    async def enrich(batch):
+        calls.append(len(batch))
+        if len(batch) > 2 or batch == ['long']:
+            raise vocabulary_utils.BatchTruncated()
+        return batch
+
+    async def run():
+        return [item async for item in vocabulary_utils.enrich_batches(
+            [['a', 'b', 'c', 'd', 'e'], ['long']], enrich, concurrency=2)]
+
+    results = asyncio.run(run())
+    done = sorted(w for batch, result in results if result for w in result)
+    assert done == ['a', 'b', 'c', 'd', 'e']
+    assert (['long'], None) in results
+    assert calls.count(5) == 1 and max(calls[1:]) <= 3
+
+
+def test_early_exit_cancels_pending():
+    cancelled = []
+
+    async def enrich(batch):
+        try:
+            await asyncio.sleep(0 if batch == ['fast'] else 10)
+        except asyncio.CancelledError:
+            cancelled.append(batch[0])
+            raise
+        return batch
+
+    async def run():
+        results = vocabulary_utils.enrich_batches([['fast'], ['slow1'], ['slow2']], enrich, concurrency=3)
+        async for batch, _ in results:
+            assert batch == ['fast']
+            break
+        await results.aclose()
+        await asyncio.sleep(0)
+
+    asyncio.run(run())
+    assert sorted(cancelled) == ['slow1', 'slow2']
@@ -0,0 +1,72 @@
+"""
+流式ZIP打包测试：STORED/DEFLATE 条目、重名处理、跳过缺失文件、提前关闭
+"""
+import io
+import os
+import zipfile
+
+from utils import zip_stream_utils
+
+TEXT = ('第一章 学习计划 study plan for the week\n' * 20000).encode('utf-8')
+
+
+def _opener(content: bytes, closed: list = None):
+    def open_content():
+        reader = io.BytesIO(content)
+        if closed is not None:
+            reader.close = lambda: closed.append(True)
+        return reader, [reader]
+    return open_content
+
+
+def _missing():
+    raise FileNotFoundError('gone.txt')
+
+
+def test_archive_round_trip():
+    video = os.urandom(300 * 1024)
+    entries = [
+        zip_stream_utils.ZipEntry('空文件夹/'),
+        zip_stream_utils.ZipEntry('课程/notes.txt', len(TEXT), None, _opener(TEXT)),
+        zip_stream_utils.ZipEntry('课程/gone.txt', 10, None, _missing),
+        zip_stream_utils.ZipEntry('video.mp4', len(video), None, _opener(video), store=True),
+    ]
+    data = b''.join(zip_stream_utils.iter_zip(entries))
+
+    with zipfile.ZipFile(io.BytesIO(data)) as zf:
+        assert zf.testzip() is None
+        infos = {info.filename: info for info in zf.infolist()}
+        assert set(infos) == {'空文件夹/', '课程/notes.txt', 'video.mp4'}
+        assert infos['空文件夹/'].is_dir()
+        assert infos['课程/notes.txt'].compress_type == zipfile.ZIP_DEFLATED
+        assert infos['课程/notes.txt'].compress_size < len(TEXT) // 10
+        assert infos['video.mp4'].compress_type == zipfile.ZIP_STORED
+        assert zf.read('课程/notes.txt') == TEXT
+        assert zf.read('video.mp4') == video
+
+
+def test_member_names():
+    assert zip_stream_utils.safe_member_name('a/b\\c.txt') == 'a_b_c.txt'
+    assert zip_stream_utils.safe_member_name('..') == '_'
+
+    used = set()
+    names = [zip_stream_utils.unique_member_name('a.txt', used) for _ in range(3)]
+    assert names == ['a.txt', 'a (1).txt', 'a (2).txt']
+
+
+def test_compressed_types():
+    assert zip_stream_utils.is_compressed_type('lecture.MP4')
+    assert zip_stream_utils.is_compressed_type('photo', 'image/jpeg')
+    assert not zip_stream_utils.is_compressed_type('icon.svg', 'image/svg+xml')
+    assert not zip_stream_utils.is_compressed_type('notes.txt', 'text/plain')
+
+
+def test_closing_early_closes_source():
+    closed = []
+    content = os.urandom(2 * 1024 * 1024)
+    stream = zip_stream_utils.iter_zip([
+        zip_stream_utils.ZipEntry('big.bin', len(content), None, _opener(content, closed), store=True)
+    ])
+    next(stream)
+    stream.close()
+    assert closed == [True]
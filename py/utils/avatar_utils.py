@@ -0,0 +1,141 @@
+"""
+用户头像工具模块
+上传的图片只解码一次，裁剪为正方形后生成多个尺寸的 WebP 和 JPEG。
+文件名包含内容哈希（如 12_3f9a..._80.webp），内容变化时地址随之变化，因此可以永久缓存。
+"""
+import hashlib
+import io
+import os
+import re
+import uuid
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from PIL import Image, ImageOps
+
+from utils import thumbnail_utils
+
+AVATAR_SIZES = (40, 80, 200)
+DEFAULT_SIZE = 200
+# 扩展名 -> Pillow 格式
+FORMATS = {'webp': 'WEBP', 'jpg': 'JPEG'}
+MEDIA_TYPES = {'webp': 'image/webp', 'jpg': 'image/jpeg', 'jpeg': 'image/jpeg', 'png': 'image/png'}
+ENCODE_OPTIONS = {'WEBP': {'quality': 82, 'method': 4}, 'JPEG': {'quality': 85, 'optimize': True}}
+
+# 新格式：{用户ID}_{内容哈希}_{尺寸}.{webp|jpg}；旧格式：{用户ID}_{uuid}.jpg
+_VARIANT_RE = re.compile(r'^(\d+)_([0-9a-f]{16})_(\d+)\.(webp|jpg)$')
+_FILENAME_RE = re.compile(r'^[0-9A-Za-z_\-]+\.(webp|jpg|jpeg|png)$')
+
+
+def is_valid_filename(filename: str) -> bool:
+    """头像文件名只允许字母数字、下划线和连字符，防止目录遍历"""
+    return bool(_FILENAME_RE.match(filename or ''))
+
+
+def media_type(filename: str) -> str:
+    return MEDIA_TYPES.get(filename.rsplit('.', 1)[-1].lower(), 'application/octet-stream')
+
+
+def variant_filename(user_id: int, digest: str, size: int = DEFAULT_SIZE, ext: str = 'jpg') -> str:
+    return f"{user_id}_{digest}_{size}.{ext}"
+
+
+def variant_urls(url_prefix: str, user_id: int, digest: str) -> Dict[str, Dict[str, str]]:
+    """各尺寸、各格式的头像地址，如 {'40': {'webp': ..., 'jpg': ...}, ...}"""
+    return {
+        str(size): {ext: f"{url_prefix}{variant_filename(user_id, digest, size, ext)}" for ext in FORMATS}
+        for size in AVATAR_SIZES
+    }
+
+
+def _square(image: Image.Image) -> Image.Image:
+    """按EXIF方向旋转，透明背景铺白，裁剪中心的正方形"""
+    image = ImageOps.exif_transpose(image)
+    if image.mode in ('RGBA', 'LA', 'P'):
+        image = image.convert('RGBA')
+        background = Image.new('RGB', image.size, (255, 255, 255))
+        background.paste(image, mask=image.split()[-1])
+        image = background
+    elif image.mode != 'RGB':
+        image = image.convert('RGB')
+    width, height = image.size
+    side = min(width, height)
+    left, top = (width - side) // 2, (height - side) // 2
+    return image.crop((left, top, left + side, top + side))
+
+
+def render_avatar(content: bytes, user_id: int, out_dir: str, sizes: Sequence[int] = AVATAR_SIZES) -> str:
+    """
+    生成头像的全部尺寸和格式（在进程池工作进程中运行）
+
+    Args:
+        content: 上传的原始图片
+        user_id: 用户ID（文件名前缀，删除时按用户清理）
+        out_dir: 头像目录
+
+    Returns:
+        内容哈希（文件名中的版本部分）
+    """
+    image = Image.open(io.BytesIO(content))
+    # JPEG 解码时直接缩小到接近目标尺寸
+    image.draft('RGB', (max(sizes) * 2, max(sizes) * 2))
+    image = _square(image)
+
+    encoded: List[Tuple[int, str, bytes]] = []
+    for size in sorted(sizes, reverse=True):
+        image = image.resize((size, size), Image.Resampling.LANCZOS)
+        for ext, fmt in FORMATS.items():
+            buf = io.BytesIO()
+            image.save(buf, fmt, **ENCODE_OPTIONS[fmt])
+            encoded.append((size, ext, buf.getvalue()))
+
+    hasher = hashlib.sha256()
+    for _, _, data in encoded:
+        hasher.update(data)
+    digest = hasher.hexdigest()[:16]
+
+    os.makedirs(out_dir, exist_ok=True)
+    for size, ext, data in encoded:
+        target = os.path.join(out_dir, variant_filename(user_id, digest, size, ext))
+        tmp_path = f"{target}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, target)
+    return digest
+
+
+async def process_avatar(content: bytes, user_id: int, out_dir: Path) -> str:
+    """在图片处理进程池中生成头像，返回内容哈希"""
+    return await thumbnail_utils.run_image_job(render_avatar, content, user_id, str(out_dir))
+
+
+def avatar_files(avatar_dir: Path, avatar_url: Optional[str]) -> List[Path]:
+    """
+    用户当前头像对应的全部文件（新格式为所有尺寸和格式，旧格式为单个文件）
+
+    Args:
+        avatar_dir: 头像目录
+        avatar_url: users.avatar 中保存的地址
+    """
+    if not avatar_url:
+        return []
+    filename = avatar_url.split('/')[-1]
+    if not is_valid_filename(filename):
+        return []
+    match = _VARIANT_RE.match(filename)
+    if not match:
+        return [avatar_dir / filename]
+    user_id, digest = match.group(1), match.group(2)
+    return [avatar_dir / variant_filename(user_id, digest, size, ext) for size in AVATAR_SIZES for ext in FORMATS]
+
+
+def remove_avatar_files(avatar_dir: Path, avatar_url: Optional[str]) -> int:
+    """删除头像的全部文件，返回删除的数量"""
+    removed = 0
+    for path in avatar_files(avatar_dir, avatar_url):
+        try:
+            os.remove(path)
+            removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
@@ -0,0 +1,273 @@
+"""
+分片续传工具模块
+上传会话保存在本地磁盘：每个会话一个目录，包含会话信息 session.json 和已收到的分片文件。
+分片先写临时文件再原子 rename，因此同一会话的分片可以乱序、并行上传。
+"""
+import hashlib
+import json
+import os
+import re
+import shutil
+import time
+import uuid
+from pathlib import Path
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from config import settings
+from utils import storage_utils
+
+MANIFEST_NAME = 'session.json'
+COMPLETING_NAME = 'session.completing'
+_UPLOAD_ID_RE = re.compile(r'^[0-9a-f]{32}$')
+
+
+class UploadSessionError(Exception):
+    """上传会话错误，status_code 对应返回给客户端的HTTP状态码"""
+
+    def __init__(self, message: str, status_code: int = 400):
+        super().__init__(message)
+        self.status_code = status_code
+
+
+def _session_dir(upload_id: str) -> Path:
+    if not _UPLOAD_ID_RE.match(upload_id or ''):
+        raise UploadSessionError("无效的上传会话ID", 404)
+    return settings.UPLOAD_SESSION_DIR / upload_id
+
+
+def _chunk_path(session_dir: Path, index: int) -> Path:
+    return session_dir / f"{index:06d}.chunk"
+
+
+def total_chunks(file_size: int, chunk_size: int) -> int:
+    """计算分片总数（空文件也占一个分片）"""
+    return max(1, (file_size + chunk_size - 1) // chunk_size)
+
+
+def expected_chunk_size(session: Dict[str, Any], index: int) -> int:
+    """第 index 个分片应有的字节数"""
+    chunk_size = session['chunk_size']
+    if index < session['total_chunks'] - 1:
+        return chunk_size
+    return session['file_size'] - chunk_size * (session['total_chunks'] - 1)
+
+
+def create_session(user_id: int, file_name: str, file_size: int, folder_path: str,
+                   file_type: str, chunk_size: Optional[int] = None,
+                   sha256: Optional[str] = None) -> Dict[str, Any]:
+    """
+    创建上传会话
+
+    Args:
+        user_id: 用户ID
+        file_name: 原始文件名
+        file_size: 文件总大小
+        folder_path: 目标文件夹
+        file_type: MIME类型
+        chunk_size: 客户端期望的分片大小，会被限制在配置范围内
+        sha256: 可选的整体文件哈希，完成时校验
+
+    Returns:
+        会话信息字典
+    """
+    chunk_size = chunk_size or settings.UPLOAD_CHUNK_SIZE
+    chunk_size = min(max(chunk_size, settings.UPLOAD_CHUNK_MIN_SIZE), settings.UPLOAD_CHUNK_MAX_SIZE)
+    if sha256 is not None and not storage_utils.is_valid_sha256(sha256):
+        raise UploadSessionError("无效的sha256")
+
+    now = time.time()
+    session = {
+        'upload_id': uuid.uuid4().hex,
+        'user_id': user_id,
+        'file_name': file_name,
+        'file_size': file_size,
+        'folder_path': folder_path,
+        'file_type': file_type,
+        'chunk_size': chunk_size,
+        'total_chunks': total_chunks(file_size, chunk_size),
+        'sha256': sha256,
+        'created_at': now,
+        'expires_at': now + settings.UPLOAD_SESSION_EXPIRE_HOURS * 3600,
+    }
+
+    session_dir = _session_dir(session['upload_id'])
+    session_dir.mkdir(parents=True, exist_ok=False)
+    tmp_manifest = session_dir / f"{MANIFEST_NAME}.tmp"
+    with open(tmp_manifest, 'w', encoding='utf-8') as f:
+        json.dump(session, f, ensure_ascii=False)
+    os.replace(tmp_manifest, session_dir / MANIFEST_NAME)
+    return session
+
+
+def load_session(upload_id: str, user_id: int) -> Dict[str, Any]:
+    """读取会话信息并校验归属和有效期"""
+    session_dir = _session_dir(upload_id)
+    try:
+        with open(session_dir / MANIFEST_NAME, 'r', encoding='utf-8') as f:
+            session = json.load(f)
+    except FileNotFoundError:
+        raise UploadSessionError("上传会话不存在或已过期", 404)
+
+    if session['user_id'] != user_id:
+        raise UploadSessionError("上传会话不存在或已过期", 404)
+    if session['expires_at'] < time.time():
+        remove_session(upload_id)
+        raise UploadSessionError("上传会话不存在或已过期", 404)
+    return session
+
+
+async def save_chunk(session: Dict[str, Any], index: int, stream: AsyncIterator[bytes],
+                     checksum: str) -> int:
+    """
+    保存一个分片，写入时计算SHA-256并与客户端提供的校验值比对（写入和哈希在线程中进行）
+
+    Args:
+        session: 会话信息
+        index: 分片序号（从0开始）
+        stream: 请求体的异步字节流
+        checksum: 客户端计算的分片SHA-256
+
+    Returns:
+        分片字节数
+    """
+    if index < 0 or index >= session['total_chunks']:
+        raise UploadSessionError(f"分片序号超出范围: {index}")
+    checksum = (checksum or '').strip().lower()
+    if not storage_utils.is_valid_sha256(checksum):
+        raise UploadSessionError("缺少或无效的分片校验值")
+
+    expected_size = expected_chunk_size(session, index)
+    session_dir = _session_dir(session['upload_id'])
+    tmp_path = session_dir / f"{index:06d}.{uuid.uuid4().hex}.part"
+    try:
+        # 请求体的小块攒起来在线程中写入并计算哈希，不阻塞事件循环
+        async with storage_utils.HashingFileWriter(tmp_path) as writer:
+            async for data in stream:
+                if writer.size + len(data) > expected_size:
+                    raise UploadSessionError(f"分片大小超出预期: {expected_size}")
+                await writer.write(data)
+        size = writer.size
+        if size != expected_size:
+            raise UploadSessionError(f"分片大小不匹配: {size} != {expected_size}")
+        if writer.hexdigest() != checksum:
+            raise UploadSessionError("分片校验失败，请重新上传该分片")
+        # 重复上传同一分片时直接覆盖
+        os.replace(tmp_path, _chunk_path(session_dir, index))
+    except BaseException:
+        storage_utils.discard_temp(tmp_path)
+        raise
+    return size
+
+
+def received_chunks(session: Dict[str, Any]) -> List[int]:
+    """返回已收到的分片序号（升序）"""
+    session_dir = _session_dir(session['upload_id'])
+    indexes = []
+    with os.scandir(session_dir) as it:
+        for entry in it:
+            if entry.name.endswith('.chunk'):
+                indexes.append(int(entry.name.split('.', 1)[0]))
+    indexes.sort()
+    return indexes
+
+
+def to_ranges(indexes: List[int]) -> List[List[int]]:
+    """将升序序号压缩为闭区间列表，如 [0,1,2,5] -> [[0,2],[5,5]]"""
+    ranges = []
+    for index in indexes:
+        if ranges and ranges[-1][1] == index - 1:
+            ranges[-1][1] = index
+        else:
+            ranges.append([index, index])
+    return ranges
+
+
+def assemble(session: Dict[str, Any]) -> Tuple[Path, str, int]:
+    """
+    按顺序拼接所有分片到blob临时文件，同时计算整体SHA-256
+
+    Returns:
+        (临时文件路径, sha256, 文件大小)
+    """
+    received = received_chunks(session)
+    if len(received) != session['total_chunks']:
+        missing = session['total_chunks'] - len(received)
+        raise UploadSessionError(f"还有 {missing} 个分片未上传", 409)
+
+    session_dir = _session_dir(session['upload_id'])
+    tmp_path = storage_utils.new_temp_path()
+    hasher = hashlib.sha256()
+    size = 0
+    try:
+        with open(tmp_path, 'wb') as out:
+            for index in range(session['total_chunks']):
+                with open(_chunk_path(session_dir, index), 'rb') as chunk:
+                    for data in iter(lambda: chunk.read(storage_utils.CHUNK_SIZE), b''):
+                        hasher.update(data)
+                        out.write(data)
+                        size += len(data)
+        sha256 = hasher.hexdigest()
+        if size != session['file_size']:
+            raise UploadSessionError("文件大小不匹配", 409)
+        if session.get('sha256') and session['sha256'] != sha256:
+            raise UploadSessionError("文件校验失败，请重新上传", 409)
+    except BaseException:
+        storage_utils.discard_temp(tmp_path)
+        raise
+    return tmp_path, sha256, size
+
+
+def begin_completion(session: Dict[str, Any]):
+    """
+    标记会话进入完成阶段，保证同一会话只会被拼接登记一次
+
+    通过原子 rename 会话信息文件实现，并发的第二个完成请求会失败
+    """
+    session_dir = _session_dir(session['upload_id'])
+    try:
+        os.rename(session_dir / MANIFEST_NAME, session_dir / COMPLETING_NAME)
+    except FileNotFoundError:
+        raise UploadSessionError("上传会话正在完成或已完成", 409)
+
+
+def abort_completion(session: Dict[str, Any]):
+    """完成失败时恢复会话，客户端可补传分片后重试"""
+    session_dir = _session_dir(session['upload_id'])
+    try:
+        os.rename(session_dir / COMPLETING_NAME, session_dir / MANIFEST_NAME)
+    except FileNotFoundError:
+        pass
+
+
+def remove_session(upload_id: str):
+    """删除会话目录及其中的所有分片"""
+    shutil.rmtree(_session_dir(upload_id), ignore_errors=True)
+
+
+def cleanup_expired_sessions() -> int:
+    """
+    清理过期（被放弃）的上传会话
+
+    Returns:
+        清理的会话数量
+    """
+    root = settings.UPLOAD_SESSION_DIR
+    if not root.exists():
+        return 0
+    now = time.time()
+    # 没有会话信息的目录（创建中途失败）按目录修改时间判断
+    stale_before = now - settings.UPLOAD_SESSION_EXPIRE_HOURS * 3600
+    removed = 0
+    with os.scandir(root) as it:
+        for entry in it:
+            if not entry.is_dir() or not _UPLOAD_ID_RE.match(entry.name):
+                continue
+            try:
+                with open(os.path.join(entry.path, MANIFEST_NAME), 'r', encoding='utf-8') as f:
+                    expired = json.load(f)['expires_at'] < now
+            except (OSError, ValueError, KeyError):
+                expired = entry.stat().st_mtime < stale_before
+            if expired:
+                shutil.rmtree(entry.path, ignore_errors=True)
+                removed += 1
+    return removed
@@ -0,0 +1,252 @@
+"""
+云盘压缩工具模块
+按内容判断是否值得压缩：先抽样估算可压缩性，已压缩的格式（mp4、jpg、zip、docx等）直接跳过，
+其余内容使用流式 zstd 压缩。压缩在进程池中执行，不阻塞事件循环。
+"""
+import asyncio
+import hashlib
+import math
+import multiprocessing
+import os
+import shutil
+import sys
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import IO, Callable, List, Optional, Tuple
+
+import zstandard
+
+from config import settings
+from utils import storage_utils
+
+CODEC_ZSTD = 'zstd'
+
+# 抽样参数：最多取 SAMPLE_BLOCKS 个块，均匀分布在文件中（第一个块总是文件开头）
+SAMPLE_BLOCK_SIZE = 64 * 1024
+SAMPLE_BLOCKS = 4
+# 抽样的字节熵超过该值（比特/字节）时认为是已压缩或加密内容，不再试压缩
+ENTROPY_SKIP_THRESHOLD = 7.9
+# 试压缩使用的级别（只用于估算，追求速度）
+TRIAL_LEVEL = 1
+
+
+class LazyProcessPool:
+    """
+    第一次使用时才创建的进程池（压缩、缩略图等CPU密集任务共用这一实现）
+
+    服务进程是多线程的，fork 可能继承被占用的锁，使用 forkserver/spawn 启动工作进程
+    """
+
+    def __init__(self, max_workers: Callable[[], int]):
+        self._max_workers = max_workers
+        self._executor: Optional[ProcessPoolExecutor] = None
+
+    def get(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+            self._executor = ProcessPoolExecutor(max_workers=self._max_workers(), mp_context=context)
+        return self._executor
+
+    def shutdown(self):
+        if self._executor is not None:
+            # cancel_futures 需要 Python 3.9，更早的版本只是不再等待，排队的任务仍会执行
+            if sys.version_info >= (3, 9):
+                self._executor.shutdown(wait=False, cancel_futures=True)
+            else:
+                self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+_pool = LazyProcessPool(lambda: settings.COMPRESSION_WORKERS)
+
+
+def byte_entropy(data: bytes) -> float:
+    """计算字节的香农熵（比特/字节，0~8）"""
+    if not data:
+        return 0.0
+    total = len(data)
+    return -sum(c / total * math.log2(c / total) for c in Counter(data).values())
+
+
+def read_samples(path, block_size: int = SAMPLE_BLOCK_SIZE, blocks: int = SAMPLE_BLOCKS) -> bytes:
+    """从文件中均匀抽取若干块数据"""
+    size = os.path.getsize(path)
+    if size <= block_size * blocks:
+        with open(path, 'rb') as f:
+            return f.read()
+    step = (size - block_size) // (blocks - 1)
+    samples: List[bytes] = []
+    with open(path, 'rb') as f:
+        for i in range(blocks):
+            f.seek(i * step)
+            samples.append(f.read(block_size))
+    return b''.join(samples)
+
+
+def estimate_ratio(path) -> float:
+    """
+    估算压缩后大小与原始大小之比
+
+    熵很高的内容直接返回1.0，否则对样本做一次快速试压缩
+
+    Returns:
+        估算的压缩比（越小越值得压缩）
+    """
+    sample = read_samples(path)
+    if not sample:
+        return 1.0
+    # 熵接近8的样本（视频、图片、压缩包）试压缩也不会有收益，直接跳过
+    if byte_entropy(sample) >= ENTROPY_SKIP_THRESHOLD:
+        return 1.0
+    compressed = zstandard.ZstdCompressor(level=TRIAL_LEVEL).compress(sample)
+    return min(1.0, len(compressed) / len(sample))
+
+
+def compress_file_to_temp(path, level: int, min_saving: float) -> Tuple[str, Optional[str]]:
+    """
+    对blob临时文件执行压缩阶段（在进程池工作进程中运行）
+
+    Args:
+        path: 原始内容的临时文件
+        level: zstd压缩级别
+        min_saving: 至少节省的比例，达不到时保留原始内容
+
+    Returns:
+        (最终要提交的临时文件路径, 编码)，不压缩时编码为None且路径不变
+    """
+    path = str(path)
+    original_size = os.path.getsize(path)
+    if estimate_ratio(path) > 1.0 - min_saving:
+        return path, None
+
+    # 写在原临时文件旁边：工作进程不依赖服务进程的配置，且保证后续 rename 在同一文件系统
+    compressed_path = path + '.zst'
+    try:
+        cctx = zstandard.ZstdCompressor(level=level, write_checksum=True)
+        with open(path, 'rb') as src, open(compressed_path, 'wb') as dst:
+            cctx.copy_stream(src, dst, size=original_size,
+                             read_size=storage_utils.CHUNK_SIZE, write_size=storage_utils.CHUNK_SIZE)
+    except BaseException:
+        storage_utils.discard_temp(compressed_path)
+        raise
+
+    # 抽样估算偏乐观时，以实际结果为准
+    if os.path.getsize(compressed_path) > original_size * (1.0 - min_saving):
+        storage_utils.discard_temp(compressed_path)
+        return path, None
+    storage_utils.discard_temp(path)
+    return compressed_path, CODEC_ZSTD
+
+
+def _write_content(source, codec: Optional[str], dest, level: Optional[int]) -> Tuple[str, int]:
+    """把存储文件的原始内容写到 dest 并刷到磁盘，level 为None时原样写入；返回原始内容的SHA-256和大小"""
+    digest = hashlib.sha256()
+    size = 0
+    reader, resources = open_reader(source, codec)
+    try:
+        with open(dest, 'wb') as dst:
+            writer = (zstandard.ZstdCompressor(level=level, write_checksum=True).stream_writer(dst, closefd=False)
+                      if level is not None else dst)
+            while True:
+                block = reader.read(storage_utils.CHUNK_SIZE)
+                if not block:
+                    break
+                digest.update(block)
+                size += len(block)
+                writer.write(block)
+            if level is not None:
+                writer.close()
+            dst.flush()
+            os.fsync(dst.fileno())
+    except BaseException:
+        storage_utils.discard_temp(dest)
+        raise
+    finally:
+        for resource in resources:
+            resource.close()
+    return digest.hexdigest(), size
+
+
+def _copy_stored(source, dest):
+    """按字节复制存储文件并刷到磁盘"""
+    try:
+        with open(source, 'rb') as src, open(dest, 'wb') as dst:
+            shutil.copyfileobj(src, dst, storage_utils.CHUNK_SIZE)
+            dst.flush()
+            os.fsync(dst.fileno())
+    except BaseException:
+        storage_utils.discard_temp(dest)
+        raise
+
+
+def recompress_file(source, codec: Optional[str], dest, level: int, min_saving: float) -> Tuple[Optional[str], str, int]:
+    """
+    把存储文件的原始内容以指定级别重新写到 dest（冷存储分层，在进程池工作进程中运行）
+
+    已压缩存储的内容直接用新级别重新压缩；原样存储的内容先抽样判断，不值得压缩的原样复制。
+    同时计算原始内容的SHA-256，调用方据此确认内容没有损坏。
+
+    Returns:
+        (dest 的编码, 原始内容的SHA-256, 原始内容大小)
+    """
+    compress = codec is not None or estimate_ratio(source) <= 1.0 - min_saving
+    sha256, size = _write_content(source, codec, dest, level if compress else None)
+    if codec is not None and os.path.getsize(dest) >= os.path.getsize(source):
+        # 高级别对少数内容（大量长重复）反而更大，保留原来的压缩结果
+        _copy_stored(source, dest)
+    elif compress and codec is None and os.path.getsize(dest) > size * (1.0 - min_saving):
+        # 抽样估算偏乐观时，以实际结果为准
+        sha256, size = _write_content(source, None, dest, None)
+        compress = False
+    return (CODEC_ZSTD if compress else None), sha256, size
+
+
+async def compress_in_pool(path: Path, file_size: int) -> Tuple[Path, Optional[str]]:
+    """
+    在进程池中对blob临时文件执行压缩阶段
+
+    未开启压缩或文件太小时直接返回原路径
+
+    Returns:
+        (最终要提交的临时文件路径, 编码)
+    """
+    if not settings.COMPRESSION_ENABLED or file_size < settings.COMPRESSION_MIN_SIZE:
+        return path, None
+    loop = asyncio.get_running_loop()
+    result_path, codec = await loop.run_in_executor(
+        _pool.get(), compress_file_to_temp, str(path),
+        settings.COMPRESSION_LEVEL, settings.COMPRESSION_MIN_SAVING
+    )
+    return Path(result_path), codec
+
+
+async def recompress_in_pool(source, codec: Optional[str], dest, level: int) -> Tuple[Optional[str], str, int]:
+    """在进程池中执行 recompress_file，返回 (dest 的编码, 原始内容的SHA-256, 原始内容大小)"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(
+        _pool.get(), recompress_file, str(source), codec, str(dest), level, settings.COMPRESSION_MIN_SAVING
+    )
+
+
+def shutdown_pool():
+    """关闭压缩进程池"""
+    _pool.shutdown()
+
+
+def open_reader(path, codec: Optional[str]) -> Tuple[IO[bytes], List]:
+    """
+    打开存储文件，返回解压后的顺序读取流
+
+    Returns:
+        (可读流, 用完后需要按顺序关闭的对象列表)
+    """
+    raw = open(path, 'rb')
+    if codec is None:
+        return raw, [raw]
+    if codec != CODEC_ZSTD:
+        raw.close()
+        raise ValueError(f"不支持的压缩编码: {codec}")
+    reader = zstandard.ZstdDecompressor().stream_reader(raw, read_size=storage_utils.CHUNK_SIZE)
+    return reader, [reader, raw]
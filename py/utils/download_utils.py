@@ -0,0 +1,549 @@
+"""
+文件下载工具模块
+统一的下载响应：支持 Range（含多段）、强 ETag、条件请求（304）和恒定内存的流式发送，
+zip成员免解压直接发送，以及交给nginx发送文件的 X-Accel-Redirect 模式
+"""
+import os
+import secrets
+import stat
+import struct
+import zipfile
+from abc import ABC, abstractmethod
+from email.utils import formatdate, parsedate_to_datetime
+from pathlib import Path
+from typing import IO, List, Mapping, Optional, Tuple
+from urllib.parse import quote
+
+import anyio
+from starlette.background import BackgroundTask
+from starlette.responses import Response
+from starlette.types import Receive, Scope, Send
+
+from config import settings
+from utils import compression_utils
+
+# 单次读取块大小
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+# 多段 Range 的最大段数，超过时忽略 Range 返回完整文件
+MAX_RANGES = 16
+
+ByteRange = Tuple[int, int]  # 闭区间 [start, end]
+
+
+def content_disposition(filename: str, disposition_type: str = 'attachment') -> str:
+    """
+    生成 Content-Disposition 头，正确处理中文等非ASCII文件名
+
+    非ASCII文件名按 RFC 5987 使用 filename*=UTF-8''，同时提供ASCII兜底的 filename
+
+    Args:
+        filename: 下载文件名
+        disposition_type: attachment 或 inline
+
+    Returns:
+        Content-Disposition 头的值
+    """
+    try:
+        filename.encode('ascii')
+        if '"' not in filename and '\\' not in filename:
+            return f'{disposition_type}; filename="{filename}"'
+    except UnicodeEncodeError:
+        pass
+    ext = os.path.splitext(filename)[1]
+    try:
+        ext.encode('ascii')
+    except UnicodeEncodeError:
+        ext = ''
+    fallback = f"download{ext}".replace('"', '')
+    return f"{disposition_type}; filename=\"{fallback}\"; filename*=UTF-8''{quote(filename, safe='')}"
+
+
+def make_etag(stat_result: os.stat_result, content_hash: Optional[str] = None) -> str:
+    """
+    生成强 ETag：有内容哈希时直接使用哈希，否则使用修改时间和大小
+    """
+    if content_hash:
+        return f'"{content_hash}"'
+    return f'"{stat_result.st_mtime_ns:x}-{stat_result.st_size:x}"'
+
+
+def _etag_matches(header_value: str, etag: str) -> bool:
+    """比较 If-None-Match 列表与 ETag（忽略弱校验前缀 W/）"""
+    if header_value.strip() == '*':
+        return True
+    for candidate in header_value.split(','):
+        candidate = candidate.strip()
+        if candidate.startswith('W/'):
+            candidate = candidate[2:]
+        if candidate == etag:
+            return True
+    return False
+
+
+def _http_date_to_timestamp(value: str) -> Optional[float]:
+    try:
+        return parsedate_to_datetime(value).timestamp()
+    except (TypeError, ValueError, IndexError):
+        return None
+
+
+def is_not_modified(headers: Mapping[str, str], etag: str, mtime: float) -> bool:
+    """
+    判断条件请求是否可以返回 304
+
+    If-None-Match 优先；没有时才使用 If-Modified-Since（按秒比较）
+    """
+    if_none_match = headers.get('if-none-match')
+    if if_none_match is not None:
+        return _etag_matches(if_none_match, etag)
+    if_modified_since = headers.get('if-modified-since')
+    if if_modified_since:
+        since = _http_date_to_timestamp(if_modified_since)
+        return since is not None and int(mtime) <= since
+    return False
+
+
+def _if_range_matches(value: str, etag: str, mtime: float) -> bool:
+    """If-Range：ETag 必须强匹配，日期必须与最后修改时间一致"""
+    value = value.strip()
+    if value.startswith('"'):
+        return value == etag
+    if value.startswith('W/'):
+        return False
+    since = _http_date_to_timestamp(value)
+    return since is not None and int(mtime) == int(since)
+
+
+def parse_range_header(header: Optional[str], file_size: int) -> Optional[List[ByteRange]]:
+    """
+    解析 Range 请求头
+
+    Returns:
+        None 表示忽略 Range（返回完整文件），[] 表示无法满足（416），
+        否则为排序并合并后的闭区间列表
+    """
+    if not header:
+        return None
+    unit, _, spec = header.partition('=')
+    if unit.strip().lower() != 'bytes' or not spec.strip():
+        return None
+
+    ranges: List[ByteRange] = []
+    for part in spec.split(','):
+        part = part.strip()
+        if not part:
+            continue
+        start_str, sep, end_str = part.partition('-')
+        if not sep:
+            return None
+        start_str, end_str = start_str.strip(), end_str.strip()
+        try:
+            if not start_str:
+                # 后缀形式：bytes=-500 表示最后500字节
+                suffix = int(end_str)
+                if suffix <= 0:
+                    continue
+                start, end = max(0, file_size - suffix), file_size - 1
+            else:
+                start = int(start_str)
+                end = int(end_str) if end_str else file_size - 1
+                if end_str and start > end:
+                    return None
+                end = min(end, file_size - 1)
+        except ValueError:
+            return None
+        if start < 0:
+            return None
+        if start < file_size:
+            ranges.append((start, end))
+
+    if not ranges:
+        return []
+
+    # 合并重叠或相邻的区间
+    ranges.sort()
+    merged = [ranges[0]]
+    for start, end in ranges[1:]:
+        last_start, last_end = merged[-1]
+        if start <= last_end + 1:
+            merged[-1] = (last_start, max(last_end, end))
+        else:
+            merged.append((start, end))
+    if len(merged) > MAX_RANGES:
+        return None
+    return merged
+
+
+class RangeFileResponse(Response):
+    """
+    按字节区间流式发送文件的响应
+
+    内存占用与文件大小无关；ASGI服务器支持 http.response.zerocopysend 扩展时使用 sendfile 零拷贝发送
+    """
+
+    def __init__(
+        self,
+        path: str,
+        file_size: int,
+        ranges: Optional[List[ByteRange]] = None,
+        headers: Optional[Mapping[str, str]] = None,
+        media_type: str = 'application/octet-stream',
+        background: Optional[BackgroundTask] = None,
+        send_header_only: bool = False,
+        data_offset: int = 0,
+    ) -> None:
+        self.path = path
+        self.file_size = file_size
+        # 内容在磁盘文件中的起始偏移（如zip中以 STORED 方式存储的成员）
+        self.data_offset = data_offset
+        self.ranges = ranges
+        self.media_type = media_type
+        self.background = background
+        self.send_header_only = send_header_only
+        self.init_headers(headers)
+        self.headers['accept-ranges'] = 'bytes'
+
+        self.parts: List[Tuple[bytes, int, int]] = []  # (分段头, 起始偏移, 字节数)
+        self.epilogue = b''
+        if not ranges:
+            self.status_code = 200
+            self.parts.append((b'', 0, file_size))
+            self.headers['content-type'] = media_type
+            self.headers['content-length'] = str(file_size)
+        elif len(ranges) == 1:
+            start, end = ranges[0]
+            self.status_code = 206
+            self.parts.append((b'', start, end - start + 1))
+            self.headers['content-type'] = media_type
+            self.headers['content-range'] = f'bytes {start}-{end}/{file_size}'
+            self.headers['content-length'] = str(end - start + 1)
+        else:
+            boundary = secrets.token_hex(16)
+            self.status_code = 206
+            for start, end in ranges:
+                preamble = (
+                    f'\r\n--{boundary}\r\n'
+                    f'Content-Type: {media_type}\r\n'
+                    f'Content-Range: bytes {start}-{end}/{file_size}\r\n\r\n'
+                ).encode('latin-1')
+                self.parts.append((preamble, start, end - start + 1))
+            self.epilogue = f'\r\n--{boundary}--\r\n'.encode('latin-1')
+            total = sum(len(p) + count for p, _, count in self.parts) + len(self.epilogue)
+            self.headers['content-type'] = f'multipart/byteranges; boundary={boundary}'
+            self.headers['content-length'] = str(total)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        await send({
+            'type': 'http.response.start',
+            'status': self.status_code,
+            'headers': self.raw_headers,
+        })
+        if self.send_header_only:
+            await send({'type': 'http.response.body', 'body': b'', 'more_body': False})
+        else:
+            await self.send_parts(scope, send)
+            await send({'type': 'http.response.body', 'body': self.epilogue, 'more_body': False})
+        if self.background is not None:
+            await self.background()
+
+    async def send_parts(self, scope: Scope, send: Send) -> None:
+        """发送各分段的数据（不含结尾的 epilogue）"""
+        zero_copy = 'http.response.zerocopysend' in scope.get('extensions', {})
+        async with await anyio.open_file(self.path, mode='rb') as file:
+            for preamble, offset, count in self.parts:
+                if preamble:
+                    await send({'type': 'http.response.body', 'body': preamble, 'more_body': True})
+                offset += self.data_offset
+                if zero_copy:
+                    await send({
+                        'type': 'http.response.zerocopysend',
+                        'file': file.wrapped,
+                        'offset': offset,
+                        'count': count,
+                        'more_body': True,
+                    })
+                    continue
+                await file.seek(offset)
+                remaining = count
+                while remaining > 0:
+                    chunk = await file.read(min(DOWNLOAD_CHUNK_SIZE, remaining))
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+
+
+class DecompressingResponse(RangeFileResponse, ABC):
+    """
+    边解压边发送的响应基类，不落地临时文件
+
+    压缩数据不支持随机访问，Range 通过顺序解压跳过前面的数据实现（区间已按升序排列）
+    """
+
+    @abstractmethod
+    def open_reader(self) -> Tuple[IO[bytes], list]:
+        """打开解压流，返回 (可读流, 用完后按顺序关闭的对象列表)"""
+
+    async def send_parts(self, scope: Scope, send: Send) -> None:
+        reader, resources = await anyio.to_thread.run_sync(self.open_reader)
+        try:
+            for preamble, offset, count in self.parts:
+                if preamble:
+                    await send({'type': 'http.response.body', 'body': preamble, 'more_body': True})
+                if offset:
+                    await anyio.to_thread.run_sync(reader.seek, offset)
+                remaining = count
+                while remaining > 0:
+                    chunk = await anyio.to_thread.run_sync(
+                        reader.read, min(DOWNLOAD_CHUNK_SIZE, remaining)
+                    )
+                    if not chunk:
+                        break
+                    remaining -= len(chunk)
+                    await send({'type': 'http.response.body', 'body': chunk, 'more_body': True})
+        finally:
+            for resource in resources:
+                resource.close()
+
+
+class ZipMemberResponse(DecompressingResponse):
+    """直接从zip成员流式解压发送"""
+
+    def __init__(self, path: str, member: str, file_size: int, **kwargs) -> None:
+        self.member = member
+        super().__init__(path, file_size, **kwargs)
+
+    def open_reader(self) -> Tuple[IO[bytes], list]:
+        zf = zipfile.ZipFile(self.path)
+        try:
+            member = zf.open(self.member)
+        except BaseException:
+            zf.close()
+            raise
+        return member, [member, zf]
+
+
+class CompressedFileResponse(DecompressingResponse):
+    """发送以 zstd 等编码压缩存储的blob，边解压边发送"""
+
+    def __init__(self, path: str, codec: str, file_size: int, **kwargs) -> None:
+        self.codec = codec
+        super().__init__(path, file_size, **kwargs)
+
+    def open_reader(self) -> Tuple[IO[bytes], list]:
+        return compression_utils.open_reader(self.path, self.codec)
+
+
+def _evaluate_preconditions(
+    request_headers: Mapping[str, str],
+    file_size: int,
+    etag: str,
+    mtime: float,
+    headers: dict,
+    background: Optional[BackgroundTask],
+) -> Tuple[Optional[Response], Optional[List[ByteRange]]]:
+    """
+    处理条件请求、Range 和 If-Range
+
+    Returns:
+        (需直接返回的304/416响应或None, 要发送的字节区间)
+    """
+    if is_not_modified(request_headers, etag, mtime):
+        return Response(status_code=304, headers=headers, background=background), None
+
+    ranges = parse_range_header(request_headers.get('range'), file_size)
+    if_range = request_headers.get('if-range')
+    if ranges is not None and if_range and not _if_range_matches(if_range, etag, mtime):
+        ranges = None
+    if ranges == []:
+        headers['content-range'] = f'bytes */{file_size}'
+        return Response(status_code=416, headers=headers, background=background), None
+    return None, ranges
+
+
+def _validator_headers(etag: str, mtime: float, cache_control: str,
+                       filename: Optional[str], disposition_type: str) -> dict:
+    headers = {
+        'etag': etag,
+        'last-modified': formatdate(mtime, usegmt=True),
+        'cache-control': cache_control,
+    }
+    if filename is not None:
+        headers['content-disposition'] = content_disposition(filename, disposition_type)
+    return headers
+
+
+def file_download_response(
+    request_headers: Mapping[str, str],
+    path: str,
+    filename: Optional[str],
+    media_type: Optional[str] = None,
+    content_hash: Optional[str] = None,
+    background: Optional[BackgroundTask] = None,
+    disposition_type: str = 'attachment',
+    cache_control: str = 'private, no-cache',
+    method: str = 'GET',
+    codec: Optional[str] = None,
+    content_size: Optional[int] = None,
+) -> Response:
+    """
+    构造文件下载响应（处理条件请求、Range 和 If-Range）
+
+    Args:
+        request_headers: 请求头
+        path: 磁盘文件路径
+        filename: 下载文件名，为None时不设置 Content-Disposition
+        media_type: MIME类型
+        content_hash: 内容SHA-256，用于生成强ETag
+        background: 响应发送完毕后执行的任务
+        disposition_type: attachment 或 inline
+        cache_control: Cache-Control 头
+        method: 请求方法，HEAD 时只发送响应头
+        codec: 磁盘文件的压缩编码（如 zstd），为None表示原样存储
+        content_size: 压缩存储时解压后的内容大小
+
+    Returns:
+        200/206/304/416 响应
+    """
+    stat_result = os.stat(path)
+    if not stat.S_ISREG(stat_result.st_mode):
+        raise FileNotFoundError(path)
+
+    file_size = stat_result.st_size if codec is None else content_size
+    etag = make_etag(stat_result, content_hash)
+    headers = _validator_headers(etag, stat_result.st_mtime, cache_control, filename, disposition_type)
+    early_response, ranges = _evaluate_preconditions(
+        request_headers, file_size, etag, stat_result.st_mtime, headers, background
+    )
+    if early_response is not None:
+        return early_response
+
+    options = dict(
+        ranges=ranges,
+        headers=headers,
+        media_type=media_type or 'application/octet-stream',
+        background=background,
+        send_header_only=method.upper() == 'HEAD',
+    )
+    if codec is not None:
+        return CompressedFileResponse(path, codec, file_size, **options)
+    return RangeFileResponse(path, file_size, **options)
+
+
+def _stored_member_offset(zf: zipfile.ZipFile, info: zipfile.ZipInfo) -> Optional[int]:
+    """以 STORED 方式存储且未加密的成员返回其数据在zip文件中的偏移，否则返回None"""
+    if info.compress_type != zipfile.ZIP_STORED or info.flag_bits & 0x1:
+        return None
+    zf.fp.seek(info.header_offset)
+    local_header = zf.fp.read(30)
+    if len(local_header) != 30 or local_header[:4] != b'PK\x03\x04':
+        return None
+    name_length, extra_length = struct.unpack('<HH', local_header[26:30])
+    return info.header_offset + 30 + name_length + extra_length
+
+
+def zip_member_download_response(
+    request_headers: Mapping[str, str],
+    zip_path: str,
+    filename: Optional[str],
+    media_type: Optional[str] = None,
+    background: Optional[BackgroundTask] = None,
+    disposition_type: str = 'attachment',
+    cache_control: str = 'private, no-cache',
+    method: str = 'GET',
+) -> Response:
+    """
+    下载zip压缩包中的第一个文件成员，不解压到临时文件
+
+    STORED 成员直接按偏移发送（可零拷贝、随机 Range）；
+    压缩成员边解压边发送，Range 通过顺序解压跳过实现
+
+    Args:
+        同 file_download_response，zip_path 为压缩包路径
+
+    Returns:
+        200/206/304/416 响应
+    """
+    stat_result = os.stat(zip_path)
+    with zipfile.ZipFile(zip_path) as zf:
+        members = [info for info in zf.infolist() if not info.is_dir()]
+        if not members:
+            raise FileNotFoundError(zip_path)
+        info = members[0]
+        data_offset = _stored_member_offset(zf, info)
+
+    file_size = info.file_size
+    etag = f'"{stat_result.st_mtime_ns:x}-{info.CRC:08x}-{file_size:x}"'
+    headers = _validator_headers(etag, stat_result.st_mtime, cache_control, filename, disposition_type)
+    early_response, ranges = _evaluate_preconditions(
+        request_headers, file_size, etag, stat_result.st_mtime, headers, background
+    )
+    if early_response is not None:
+        return early_response
+
+    options = dict(
+        ranges=ranges,
+        headers=headers,
+        media_type=media_type or 'application/octet-stream',
+        background=background,
+        send_header_only=method.upper() == 'HEAD',
+    )
+    if data_offset is not None:
+        return RangeFileResponse(zip_path, file_size, data_offset=data_offset, **options)
+    return ZipMemberResponse(zip_path, info.filename, file_size, **options)
+
+
+def accel_redirect_uri(path: str, locations: Optional[Mapping[str, Path]] = None) -> Optional[str]:
+    """
+    将磁盘路径映射为nginx internal location 下的URI
+
+    Args:
+        path: 磁盘文件路径
+        locations: {location名: 目录}，默认为云盘目录和上传目录
+
+    Returns:
+        如 /_protected/cloud_disk/blobs/ab/cd/abcd...；不在任何目录下时返回None
+    """
+    if locations is None:
+        locations = {'cloud_disk': settings.CLOUD_DISK_DIR, 'uploads': settings.UPLOAD_DIR}
+    resolved = Path(path).resolve()
+    for name, root in locations.items():
+        try:
+            relative = resolved.relative_to(Path(root).resolve())
+        except ValueError:
+            continue
+        prefix = settings.ACCEL_REDIRECT_PREFIX.rstrip('/')
+        return f"{prefix}/{name}/{quote(relative.as_posix())}"
+    return None
+
+
+def accel_redirect_response(
+    path: str,
+    filename: Optional[str],
+    media_type: Optional[str] = None,
+    disposition_type: str = 'attachment',
+    cache_control: str = 'private, no-cache',
+    locations: Optional[Mapping[str, Path]] = None,
+) -> Optional[Response]:
+    """
+    构造 X-Accel-Redirect 响应，由nginx负责发送文件（Range、ETag、sendfile均由nginx处理）
+
+    nginx 会保留上游的 Content-Type、Content-Disposition 和 Cache-Control 头
+
+    Returns:
+        空响应体的响应；路径不在可映射目录下时返回None，调用方应回退到 file_download_response
+    """
+    uri = accel_redirect_uri(path, locations)
+    if uri is None:
+        return None
+    headers = {
+        'x-accel-redirect': uri,
+        'cache-control': cache_control,
+    }
+    if filename is not None:
+        headers['content-disposition'] = content_disposition(filename, disposition_type)
+    return Response(
+        status_code=200,
+        headers=headers,
+        media_type=media_type or 'application/octet-stream',
+    )
@@ -0,0 +1,135 @@
+"""
+云盘文件夹工具模块
+文件夹使用物化路径表示（如 /课程/第一章/），每个文件夹记录其父路径，按层级查询走 (user_id, parent_path) 索引
+"""
+import threading
+from collections import OrderedDict
+from typing import Any, Iterable, List, NamedTuple, Optional, Tuple
+
+ROOT_PATH = '/'
+
+# 变更日志中的对象类型与操作
+CHANGE_FILE = 'file'
+CHANGE_FOLDER = 'folder'
+ACTION_CREATE = 'create'
+ACTION_UPDATE = 'update'
+ACTION_MOVE = 'move'
+ACTION_DELETE = 'delete'
+ACTION_RENAME = 'rename'
+
+
+def normalize_folder_path(path: Optional[str]) -> str:
+    """规范化文件夹路径：以 / 开头和结尾，合并多余的斜杠"""
+    parts = [part for part in (path or '').strip().split('/') if part]
+    if not parts:
+        return ROOT_PATH
+    return '/' + '/'.join(parts) + '/'
+
+
+def parent_path(path: str) -> Optional[str]:
+    """返回父文件夹路径，根目录没有父目录返回None"""
+    path = normalize_folder_path(path)
+    if path == ROOT_PATH:
+        return None
+    return path[:path.rstrip('/').rfind('/') + 1]
+
+
+def folder_name(path: str) -> str:
+    """文件夹显示名称"""
+    return path.strip('/').split('/')[-1] or "根目录"
+
+
+def ancestor_paths(path: str) -> List[str]:
+    """
+    返回路径自身及所有祖先文件夹（不含根目录），从上到下排列
+
+    如 /a/b/c/ -> ['/a/', '/a/b/', '/a/b/c/']
+    """
+    parts = [part for part in path.split('/') if part]
+    return ['/' + '/'.join(parts[:i + 1]) + '/' for i in range(len(parts))]
+
+
+def is_under(path: str, root: str) -> bool:
+    """path 是否为 root 自身或其下的文件夹（两者都是规范化路径）"""
+    return path.startswith(root)
+
+
+def _outermost(paths: Iterable[str]) -> List[str]:
+    """去掉被其他路径包含的子路径，按路径排序"""
+    result: List[str] = []
+    for path in sorted(set(paths)):
+        if not result or not is_under(path, result[-1]):
+            result.append(path)
+    return result
+
+
+class ChangeSummary(NamedTuple):
+    """一段变更日志合并后的结果，客户端先执行删除，再按当前状态写入"""
+    file_ids: List[int]            # 需要按当前状态同步（存在则写入，不存在则删除）的文件
+    deleted_folders: List[str]     # 需要整棵删除的文件夹
+    created_folders: List[str]     # 需要按当前状态写入的文件夹
+    subtree_roots: List[str]       # 需要整棵重新下发的文件夹（重命名的目标）
+
+
+def summarize_changes(changes: Iterable[Tuple[str, str, Optional[int], Optional[str], Optional[str]]]) -> ChangeSummary:
+    """
+    合并变更日志
+
+    同一文件的多次变更只保留文件ID，由调用方读取其当前状态；文件夹重命名记为删除旧路径并重新下发新路径下的整棵树。
+    被其他路径包含的删除/下发路径会被去掉。
+
+    Args:
+        changes: 按序号排列的 (对象类型, 操作, 文件ID, 路径, 新路径)
+    """
+    file_ids = {}
+    deleted, created, roots = [], [], []
+    for entity_type, action, file_id, path, new_path in changes:
+        if entity_type == CHANGE_FILE:
+            file_ids[file_id] = None
+        elif action == ACTION_DELETE:
+            deleted.append(path)
+        elif action == ACTION_RENAME:
+            deleted.append(path)
+            roots.append(new_path)
+        else:
+            created.append(path)
+
+    roots = _outermost(roots)
+    created = [
+        path for path in sorted(set(created))
+        if not any(is_under(path, root) for root in roots)
+    ]
+    return ChangeSummary(list(file_ids), _outermost(deleted), created, roots)
+
+
+class TreeCache:
+    """
+    按用户缓存云盘目录树
+
+    缓存项带有用户的云盘版本号，任何修改都会递增版本号，版本不一致时缓存失效。
+    版本号保存在数据库中，因此多个worker进程之间也不会读到过期的树。
+    """
+
+    def __init__(self, max_users: int = 256):
+        self._max_users = max_users
+        self._items: 'OrderedDict[int, Tuple[int, Any]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id: int, version: int) -> Optional[Any]:
+        with self._lock:
+            item = self._items.get(user_id)
+            if item is None or item[0] != version:
+                return None
+            self._items.move_to_end(user_id)
+            return item[1]
+
+    def put(self, user_id: int, version: int, value: Any):
+        with self._lock:
+            self._items[user_id] = (version, value)
+            self._items.move_to_end(user_id)
+            while len(self._items) > self._max_users:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
@@ -0,0 +1,93 @@
+"""
+笔记存储工具模块
+笔记内容保存在固定路径的文件中，每次保存先写同目录的临时文件再原子 rename，写到一半崩溃也不会丢失旧内容。
+自动保存可以只提交相对某个版本号的增量修改（偏移/删除长度/插入文本），由服务端应用到当前内容上。
+"""
+import os
+import uuid
+from typing import Any, Dict, List, Optional
+
+# 单次请求最多的修改段数
+MAX_PATCHES = 1000
+
+
+class PatchError(ValueError):
+    """增量修改无法应用（格式错误或越界）"""
+
+
+def new_note_filename() -> str:
+    """新笔记的文件名，笔记之后的保存都写回同一个文件"""
+    return f"{uuid.uuid4()}.txt"
+
+
+def write_temp(path: str, content: str) -> str:
+    """
+    把内容写到目标文件同目录下的临时文件并刷到磁盘
+
+    Returns:
+        临时文件路径，由调用方 os.replace 到目标路径或用 discard_temp 删除
+    """
+    tmp_path = f"{path}.{uuid.uuid4().hex}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+    return tmp_path
+
+
+def discard_temp(tmp_path: Optional[str]):
+    if tmp_path:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+
+
+def read_note(path: str) -> str:
+    """读取笔记内容，文件不存在时返回空字符串"""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            return f.read()
+    except FileNotFoundError:
+        return ''
+
+
+def apply_patches(content: str, patches: List[Dict[str, Any]]) -> str:
+    """
+    依次应用增量修改，每段的偏移基于前一段应用后的内容
+
+    偏移和删除长度按 UTF-16 码元计算，与浏览器中字符串的下标一致（表情等字符占2个）。
+
+    Args:
+        content: 当前内容
+        patches: [{"offset": 起始位置, "delete": 删除长度, "insert": 插入文本}]
+
+    Raises:
+        PatchError: 格式错误、越界或切开了一个字符
+    """
+    if not isinstance(patches, list) or len(patches) > MAX_PATCHES:
+        raise PatchError(f"patches 必须是不超过 {MAX_PATCHES} 项的列表")
+    try:
+        data = content.encode('utf-16-le')
+    except UnicodeEncodeError:
+        raise PatchError("内容包含无效字符")
+    for patch in patches:
+        if not isinstance(patch, dict):
+            raise PatchError("修改段格式错误")
+        offset = patch.get('offset')
+        delete = patch.get('delete', 0)
+        insert = patch.get('insert', '')
+        if (not isinstance(offset, int) or not isinstance(delete, int) or not isinstance(insert, str)
+                or isinstance(offset, bool) or isinstance(delete, bool)):
+            raise PatchError("offset/delete 必须是整数，insert 必须是字符串")
+        start, end = offset * 2, (offset + delete) * 2
+        if offset < 0 or delete < 0 or end > len(data):
+            raise PatchError(f"修改范围越界: offset={offset}, delete={delete}, 长度={len(data) // 2}")
+        try:
+            data = data[:start] + insert.encode('utf-16-le') + data[end:]
+        except UnicodeEncodeError:
+            raise PatchError("插入的文本包含无效字符")
+    try:
+        return data.decode('utf-16-le')
+    except UnicodeDecodeError:
+        raise PatchError("修改位置切开了一个字符")
@@ -0,0 +1,300 @@
+"""
+云盘文本预览工具模块
+在线编辑器按字节区间读取文本文件的一个窗口，不需要下载整个文件：
+根据文件开头的样本判断编码，窗口边界对齐到字符（尽量对齐到行），返回解码后的文本和下一个窗口的起点。
+跳转到第N行使用稀疏行索引（每 LINE_INDEX_STEP 行记录一次字节偏移），首次需要时顺序扫描一遍生成，
+按blob哈希缓存在磁盘上，之后跳转只需从最近的索引点向后数不到 LINE_INDEX_STEP 行。
+"""
+import asyncio
+import codecs
+import json
+import os
+import uuid
+from pathlib import Path
+from typing import IO, Dict, List, NamedTuple, Optional, Tuple
+
+from config import settings
+
+# 判断编码时读取的文件开头样本大小
+SAMPLE_SIZE = 64 * 1024
+# 顺序扫描（生成行索引、数行）时每次读取的字节数
+SCAN_BLOCK_SIZE = 1024 * 1024
+# 行索引的间隔行数
+LINE_INDEX_STEP = 1000
+# 行索引格式版本，格式变化时旧缓存自动失效
+LINE_INDEX_VERSION = 1
+
+_BOMS = (
+    (codecs.BOM_UTF8, 'utf-8'),
+    (codecs.BOM_UTF16_LE, 'utf-16-le'),
+    (codecs.BOM_UTF16_BE, 'utf-16-be'),
+)
+
+_pending: Dict[str, asyncio.Future] = {}
+
+
+class TextEncoding(NamedTuple):
+    name: str       # Python 编解码器名称
+    bom: int        # 文件开头BOM的字节数，文本从这里开始
+
+    @property
+    def unit(self) -> int:
+        """编码单元的字节数，字符和换行都从单元边界开始"""
+        return 2 if self.name.startswith('utf-16') else 1
+
+    @property
+    def newline(self) -> bytes:
+        return '\n'.encode(self.name)
+
+
+class LineIndex(NamedTuple):
+    encoding: TextEncoding
+    total_lines: int
+    size: int                   # 原始内容的字节数
+    offsets: List[int]          # offsets[i] 为第 i * LINE_INDEX_STEP + 1 行开头的字节偏移
+
+
+class TextWindow(NamedTuple):
+    offset: int         # 窗口实际起点（已对齐）
+    next_offset: int    # 下一个窗口的起点，等于文件大小时已读到末尾
+    text: str
+
+
+def detect_encoding(sample: bytes) -> Optional[TextEncoding]:
+    """
+    根据文件开头的样本判断编码：BOM > UTF-8 > GB18030，都不是时按UTF-8替换无法解码的字节
+
+    Returns:
+        编码；样本中有NUL字节（二进制文件）时返回None
+    """
+    for bom, name in _BOMS:
+        if sample.startswith(bom):
+            return TextEncoding(name, len(bom))
+    if b'\x00' in sample:
+        return None
+    for name in ('utf-8', 'gb18030'):
+        try:
+            sample.decode(name)
+            return TextEncoding(name, 0)
+        except UnicodeDecodeError as e:
+            # 样本截断在多字节字符中间
+            if e.start >= len(sample) - 3 and e.reason == 'unexpected end of data':
+                return TextEncoding(name, 0)
+    return TextEncoding('utf-8', 0)
+
+
+def _newline_positions(data: bytes, encoding: TextEncoding, base: int):
+    """data 中换行的结束位置（相对 data），base 为 data 在文件中的偏移，用于判断编码单元边界"""
+    newline = encoding.newline
+    position = data.find(newline)
+    while position >= 0:
+        if (base + position - encoding.bom) % encoding.unit == 0:
+            yield position + len(newline)
+            position = data.find(newline, position + len(newline))
+        else:
+            position = data.find(newline, position + 1)
+
+
+def _read_full(reader: IO[bytes], size: int) -> bytes:
+    """读满 size 字节（解压流一次可能返回较少的数据），到文件末尾时返回剩余的全部"""
+    block = reader.read(size)
+    if len(block) < size and block:
+        parts = [block]
+        remaining = size - len(block)
+        while remaining > 0:
+            more = reader.read(remaining)
+            if not more:
+                break
+            parts.append(more)
+            remaining -= len(more)
+        block = b''.join(parts)
+    return block
+
+
+def _align_start(data: bytes, offset: int, encoding: TextEncoding, previous: Optional[int]) -> int:
+    """窗口起点对齐到字符边界需要跳过的字节数，previous 为起点前一个字节（GB18030 需要）"""
+    if offset <= encoding.bom:
+        return 0
+    if encoding.unit == 2:
+        return (offset - encoding.bom) % 2
+    if encoding.name == 'utf-8':
+        skip = 0
+        while skip < min(3, len(data)) and 0x80 <= data[skip] <= 0xbf:
+            skip += 1
+        return skip
+    # GB18030 的尾字节可能落在ASCII范围，不能从任意字节重新同步，不在行首时从下一行开始
+    if previous == ord('\n'):
+        return 0
+    first = next(_newline_positions(data, encoding, offset), None)
+    return first if first is not None and first < len(data) else 0
+
+
+def text_window(data: bytes, offset: int, encoding: TextEncoding, size: int,
+                previous: Optional[int] = None) -> TextWindow:
+    """
+    把从 offset 开始读出的字节解码为文本窗口
+
+    起点对齐到字符边界；没读到文件末尾时终点截到最后一个换行之后（窗口内没有换行时截到最后一个完整字符），
+    下一个窗口从 next_offset 继续，不会把字符或行切成两半。
+
+    Args:
+        data: 从 offset 开始读出的字节
+        offset: data 在原始内容中的起点（不小于 encoding.bom）
+        size: 原始内容的总字节数
+        previous: offset 前一个字节的值，GB18030 据此判断起点是否在行首
+    """
+    skip = _align_start(data, offset, encoding, previous)
+    data = data[skip:]
+    offset += skip
+    at_end = offset + len(data) >= size
+    if not at_end:
+        last = None
+        for last in _newline_positions(data, encoding, offset):
+            pass
+        if last:
+            data = data[:last]
+    decoder = codecs.getincrementaldecoder(encoding.name)(errors='replace')
+    text = decoder.decode(data, final=at_end)
+    pending = decoder.getstate()[0]
+    return TextWindow(offset, offset + len(data) - len(pending), text)
+
+
+def read_window(reader: IO[bytes], offset: int, length: int, encoding: TextEncoding, size: int) -> TextWindow:
+    """从新打开的 reader 中读取 offset 开始的约 length 字节并解码为文本窗口（解压流只能向前 seek）"""
+    offset = max(offset, encoding.bom)
+    lookbehind = 1 if encoding.name == 'gb18030' and offset > encoding.bom else 0
+    if offset - lookbehind:
+        reader.seek(offset - lookbehind)
+    data = _read_full(reader, length + lookbehind)
+    previous = None
+    if lookbehind and data:
+        previous, data = data[0], data[1:]
+    return text_window(data, offset, encoding, size, previous)
+
+
+def count_lines(reader: IO[bytes], start: int, lines: int, encoding: TextEncoding) -> Tuple[int, int]:
+    """
+    从 reader 的当前位置（原始内容中的 start）向后跳过 lines 行
+
+    Returns:
+        (停下的位置, 实际跳过的行数)；内容不足时停在文件末尾
+    """
+    position, skipped = start, 0
+    while skipped < lines:
+        block = _read_full(reader, SCAN_BLOCK_SIZE)
+        if not block:
+            break
+        for end in _newline_positions(block, encoding, position):
+            skipped += 1
+            if skipped == lines:
+                return position + end, skipped
+        position += len(block)
+    return position, skipped
+
+
+def build_line_index(reader: IO[bytes], encoding: TextEncoding, step: int = LINE_INDEX_STEP) -> LineIndex:
+    """
+    顺序扫描全部内容生成稀疏行索引，reader 位于原始内容开头
+
+    单字节换行的编码用 bytes.count 整块数行，只在跨过索引点的块里查找具体位置；
+    每块读满 SCAN_BLOCK_SIZE（偶数），UTF-16 的换行不会跨块。
+    """
+    offsets = [encoding.bom]
+    _read_full(reader, encoding.bom)
+    position = encoding.bom
+    lines = 0           # 已结束的行数
+    last_end = encoding.bom
+    while True:
+        block = _read_full(reader, SCAN_BLOCK_SIZE)
+        if not block:
+            break
+        if encoding.unit == 1:
+            count = block.count(encoding.newline)
+            if count and (lines + count) // step > lines // step:
+                ends = list(_newline_positions(block, encoding, position))
+            else:
+                ends = None
+        else:
+            ends = list(_newline_positions(block, encoding, position))
+            count = len(ends)
+        if ends:
+            for end in ends:
+                lines += 1
+                if lines % step == 0:
+                    offsets.append(position + end)
+            last_end = position + ends[-1]
+        elif count:
+            lines += count
+            last_end = position + block.rfind(encoding.newline) + 1
+        position += len(block)
+    # 最后一行没有换行结尾
+    total_lines = lines + (1 if position > last_end or lines == 0 else 0)
+    if offsets[-1] >= position and len(offsets) > 1:
+        offsets.pop()
+    return LineIndex(encoding, total_lines, position, offsets)
+
+
+def line_index_path(sha256: str, root: Path = None) -> Path:
+    """行索引缓存在磁盘上的路径，如 line_index/ab/abcd....json"""
+    return (root or settings.LINE_INDEX_DIR) / sha256[:2] / f"{sha256}.json"
+
+
+def load_line_index(sha256: str) -> Optional[LineIndex]:
+    """读取缓存的行索引，没有或格式过期时返回None"""
+    try:
+        with open(line_index_path(sha256), 'r', encoding='utf-8') as f:
+            data = json.load(f)
+    except (FileNotFoundError, ValueError):
+        return None
+    if data.get('version') != LINE_INDEX_VERSION or data.get('step') != LINE_INDEX_STEP:
+        return None
+    return LineIndex(TextEncoding(*data['encoding']), data['total_lines'], data['size'], data['offsets'])
+
+
+def save_line_index(sha256: str, index: LineIndex):
+    """写入行索引缓存（先写临时文件再改名，并发读取不会看到半个文件）"""
+    path = line_index_path(sha256)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # 临时文件名不以哈希开头，进程中断留下的会被存储对账当作孤儿清理
+    tmp_path = path.with_name(f".{uuid.uuid4().hex}.tmp")
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({
+            'version': LINE_INDEX_VERSION, 'step': LINE_INDEX_STEP, 'encoding': list(index.encoding),
+            'total_lines': index.total_lines, 'size': index.size, 'offsets': index.offsets
+        }, f, separators=(',', ':'))
+    os.replace(tmp_path, path)
+
+
+async def ensure_line_index(sha256: Optional[str], build) -> LineIndex:
+    """
+    获取行索引，没有缓存时在线程中调用 build() 生成
+
+    有内容哈希时结果缓存在磁盘上，同一blob的并发调用共享一次生成；没有哈希的旧文件每次重新生成
+    """
+    if not sha256:
+        return await asyncio.get_running_loop().run_in_executor(None, build)
+    index = load_line_index(sha256)
+    if index is not None:
+        return index
+
+    def build_and_save() -> LineIndex:
+        result = build()
+        save_line_index(sha256, result)
+        return result
+
+    loop = asyncio.get_running_loop()
+    future = _pending.get(sha256)
+    if future is None or future.get_loop() is not loop:
+        future = loop.run_in_executor(None, build_and_save)
+        _pending[sha256] = future
+        future.add_done_callback(lambda _: _pending.pop(sha256, None))
+    return await asyncio.shield(future)
+
+
+def remove_line_index(sha256: str) -> bool:
+    """删除blob的行索引缓存（blob被回收时调用）"""
+    try:
+        os.remove(line_index_path(sha256))
+        return True
+    except FileNotFoundError:
+        return False
@@ -0,0 +1,147 @@
+"""
+存储对账工具模块
+并行扫描存储目录（os.scandir），按名称有序地产出磁盘上的文件，与数据库中同样有序的记录流做归并，
+找出磁盘上多余的文件（孤儿）和数据库中有记录但磁盘上不存在的文件。
+
+blob、版本块和缩略图按哈希前缀分目录存放：分片目录按名称排序后依次列出，每个分片内排序，
+拼起来就是全局有序的，内存占用只和单个分片目录的大小以及并行扫描的窗口有关。
+"""
+import os
+import re
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+_SHARD_RE = re.compile(r'^[0-9a-f]{2}$')
+
+
+class DiskEntry(NamedTuple):
+    """磁盘上的一个文件（扫描时不 stat，只有孤儿才需要大小和修改时间，见 file_stat）"""
+    name: str
+    path: str
+
+
+def file_stat(path: str) -> Optional[os.stat_result]:
+    """文件的 stat，已被删除时返回None"""
+    try:
+        return os.stat(path, follow_symlinks=False)
+    except FileNotFoundError:
+        return None
+
+
+def ordered_parallel_map(func: Callable, items: Iterable, workers: int, window: int = None) -> Iterator:
+    """
+    在线程池中并行执行 func，按输入顺序产出结果
+
+    同时进行中的任务不超过 window 个（默认为线程数的4倍），输入可以是很长的生成器
+    """
+    window = window or workers * 4
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending: deque = deque()
+        for item in items:
+            pending.append(executor.submit(func, item))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def list_files(directory: str) -> List[DiskEntry]:
+    """列出目录中的文件（不递归），按名称排序；目录不存在时返回空列表"""
+    entries = []
+    try:
+        with os.scandir(directory) as it:
+            for entry in it:
+                if entry.is_file(follow_symlinks=False):
+                    entries.append(DiskEntry(entry.name, entry.path))
+    except FileNotFoundError:
+        return []
+    entries.sort()
+    return entries
+
+
+def list_shards(directory: str) -> List[str]:
+    """列出两位十六进制命名的分片子目录，按名称排序"""
+    try:
+        with os.scandir(directory) as it:
+            return sorted(entry.path for entry in it if entry.is_dir(follow_symlinks=False)
+                          and _SHARD_RE.match(entry.name))
+    except FileNotFoundError:
+        return []
+
+
+def _leaf_dirs(root: str, depth: int) -> Iterator[str]:
+    if depth == 0:
+        yield root
+        return
+    for shard in list_shards(root):
+        yield from _leaf_dirs(shard, depth - 1)
+
+
+def scan_sharded(root, depth: int, workers: int = 8) -> Iterator[DiskEntry]:
+    """
+    按名称有序地产出分片存储中的全部文件
+
+    Args:
+        root: 存储根目录
+        depth: 分片目录的层数（blob为2：ab/cd/，版本块和缩略图为1：ab/）
+        workers: 并行列目录的线程数
+    """
+    for entries in ordered_parallel_map(list_files, _leaf_dirs(str(root), depth), workers):
+        yield from entries
+
+
+def walk_files(root) -> List[DiskEntry]:
+    """递归列出目录中的全部文件（name 为相对 root 的路径），按路径排序"""
+    result: List[DiskEntry] = []
+    stack = [str(root)]
+    root = str(root)
+    while stack:
+        directory = stack.pop()
+        try:
+            with os.scandir(directory) as it:
+                for entry in it:
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(entry.path)
+                    elif entry.is_file(follow_symlinks=False):
+                        name = os.path.relpath(entry.path, root).replace(os.sep, '/')
+                        result.append(DiskEntry(name, entry.path))
+        except FileNotFoundError:
+            continue
+    result.sort()
+    return result
+
+
+def merge_join(disk: Iterable[Any], keys: Iterable[str],
+               disk_key: Callable[[Any], str]) -> Iterator[Tuple[str, Optional[Any], bool]]:
+    """
+    归并两个按键有序的流
+
+    Args:
+        disk: 磁盘文件流，多个文件可以对应同一个键（如同一blob的多个尺寸缩略图）
+        keys: 数据库记录的键，有序且不重复
+        disk_key: 从磁盘文件取键
+
+    Yields:
+        (键, 磁盘文件或None, 数据库中是否有记录)；数据库中有记录且磁盘上有文件时，每个文件产出一次
+    """
+    keys = iter(keys)
+    current = next(keys, None)
+    matched = False
+    for item in disk:
+        key = disk_key(item)
+        while current is not None and current < key:
+            if not matched:
+                yield current, None, True
+            current = next(keys, None)
+            matched = False
+        if current == key:
+            matched = True
+            yield key, item, True
+        else:
+            yield key, item, False
+    while current is not None:
+        if not matched:
+            yield current, None, True
+        current = next(keys, None)
+        matched = False
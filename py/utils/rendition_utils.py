@@ -0,0 +1,232 @@
+"""
+云盘图片转码工具模块
+上传的照片保留原图，另外生成去掉EXIF、缩小到最大边长的 WebP/AVIF 版本（按blob哈希和格式缓存在磁盘上），
+内嵌显示（<img> 加载或预览）时根据 Accept 头选择客户端明确支持的格式，节省移动端流量。
+生成与缩略图共用图片处理进程池；AVIF 需要 Pillow 支持（Pillow 11.2+ 或安装 pillow-avif-plugin），
+HEIC 原图需要安装 pillow-heif，没有安装时只处理其他格式。
+"""
+import asyncio
+import os
+import shutil
+import tempfile
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from config import settings
+from utils import compression_utils, storage_utils, thumbnail_utils
+
+try:
+    import pillow_avif  # noqa: F401  注册 AVIF 编解码
+except ImportError:
+    pass
+
+try:
+    import pillow_heif
+    pillow_heif.register_heif_opener()
+    HEIF_SUPPORTED = True
+except ImportError:
+    HEIF_SUPPORTED = False
+
+# 转码格式：名称 -> (MIME类型, Pillow 格式名)
+FORMATS = {
+    'avif': ('image/avif', 'AVIF'),
+    'webp': ('image/webp', 'WEBP'),
+}
+# GIF 可能是动图，转码会丢掉动画，不处理
+SOURCE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp', '.bmp', '.tif', '.tiff'}
+SOURCE_MIME_TYPES = {'image/jpeg', 'image/png', 'image/webp', 'image/bmp', 'image/tiff'}
+HEIF_EXTENSIONS = {'.heic', '.heif'}
+HEIF_MIME_TYPES = {'image/heic', 'image/heif'}
+# 不生成（内容无法解码，或转码后没有变小）的标记文件后缀，避免反复尝试
+SKIPPED_SUFFIX = '.skipped'
+
+_pending: Dict[str, asyncio.Future] = {}
+
+
+def supported_formats(formats: Sequence[str] = None) -> List[str]:
+    """配置的转码格式中本机 Pillow 能编码的，按偏好顺序"""
+    Image.init()
+    result = []
+    for name in formats or settings.IMAGE_RENDITION_FORMATS:
+        if name in FORMATS and FORMATS[name][1] in Image.SAVE:
+            result.append(name)
+    return result
+
+
+def is_rendition_source(filename: str, media_type: Optional[str] = None) -> bool:
+    """文件是否是可以转码的照片/图片"""
+    ext = os.path.splitext(filename or '')[1].lower()
+    media_type = (media_type or '').lower()
+    if ext in SOURCE_EXTENSIONS or media_type in SOURCE_MIME_TYPES:
+        return True
+    return HEIF_SUPPORTED and (ext in HEIF_EXTENSIONS or media_type in HEIF_MIME_TYPES)
+
+
+def rendition_path(sha256: str, name: str, root: Path = None) -> Path:
+    """转码版本在磁盘上的路径，如 renditions/ab/abcd....webp"""
+    return (root or settings.IMAGE_RENDITION_DIR) / sha256[:2] / f"{sha256}.{name}"
+
+
+def _skipped_marker(sha256: str, root: Path) -> Path:
+    return root / sha256[:2] / f"{sha256}{SKIPPED_SUFFIX}"
+
+
+def parse_accept(header: Optional[str]) -> Dict[str, float]:
+    """解析 Accept 头，返回 {媒体类型: q值}（媒体类型小写，忽略其他参数）"""
+    result: Dict[str, float] = {}
+    for part in (header or '').split(','):
+        fields = [field.strip() for field in part.split(';')]
+        media_type = fields[0].lower()
+        if not media_type:
+            continue
+        quality = 1.0
+        for field in fields[1:]:
+            key, _, value = field.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        result[media_type] = max(quality, result.get(media_type, 0.0))
+    return result
+
+
+def negotiate(accept_header: Optional[str], available: Sequence[str]) -> Optional[str]:
+    """
+    按 Accept 头从可用的转码格式中选择一个
+
+    只认客户端明确列出的类型（image/webp 等），不认 */* 和 image/*：
+    下载工具、旧客户端通常只发送通配符，这时返回原图。q 值相同时按 available 的顺序（服务端偏好）。
+
+    Returns:
+        选中的格式名，没有合适的格式时返回None
+    """
+    accepted = parse_accept(accept_header)
+    best, best_quality = None, 0.0
+    for name in available:
+        quality = accepted.get(FORMATS[name][0], 0.0)
+        if quality > best_quality:
+            best, best_quality = name, quality
+    return best
+
+
+def available_renditions(sha256: str) -> List[str]:
+    """blob已生成的转码格式，按偏好顺序"""
+    return [name for name in supported_formats() if rendition_path(sha256, name).exists()]
+
+
+def _open_image(source_path: str, codec: Optional[str], max_dimension: int, workdir: str) -> Image.Image:
+    """打开原图（压缩存储的blob先解压到临时文件），按EXIF方向转正并缩小到最大边长"""
+    if codec is not None:
+        plain_path = os.path.join(workdir, 'source')
+        reader, resources = compression_utils.open_reader(source_path, codec)
+        try:
+            with open(plain_path, 'wb') as out:
+                shutil.copyfileobj(reader, out, storage_utils.CHUNK_SIZE)
+        finally:
+            for resource in resources:
+                resource.close()
+        source_path = plain_path
+
+    image = Image.open(source_path)
+    image.draft('RGB', (max_dimension, max_dimension))
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.getbands() or image.mode == 'P' else 'RGB')
+    image.thumbnail((max_dimension, max_dimension), Image.Resampling.LANCZOS)
+    return image
+
+
+def render_renditions(source_path: str, codec: Optional[str], sha256: str, formats: Sequence[str],
+                      max_dimension: int, quality: int, min_saving: float, source_size: int, root: str) -> List[str]:
+    """
+    生成一个blob的各格式转码版本（在进程池工作进程中运行）
+
+    原图只解码一次；保存时不写入EXIF/XMP（保留ICC色彩配置），先写临时文件再原子 rename。
+    转码后没有比原图小 min_saving 的格式不保留；有格式没有保留或原图无法解码时写入标记，不再尝试。
+
+    Returns:
+        生成的格式名列表
+    """
+    root = Path(root)
+    target_dir = root / sha256[:2]
+    target_dir.mkdir(parents=True, exist_ok=True)
+    produced = []
+    with tempfile.TemporaryDirectory(dir=target_dir) as workdir:
+        try:
+            image = _open_image(source_path, codec, max_dimension, workdir)
+            icc_profile = image.info.get('icc_profile')
+            for name in formats:
+                tmp_path = os.path.join(workdir, name)
+                options = {'quality': quality}
+                if icc_profile:
+                    options['icc_profile'] = icc_profile
+                if name == 'webp':
+                    options['method'] = 4
+                image.save(tmp_path, FORMATS[name][1], **options)
+                if os.path.getsize(tmp_path) <= source_size * (1.0 - min_saving):
+                    os.replace(tmp_path, rendition_path(sha256, name, root))
+                    produced.append(name)
+        except (UnidentifiedImageError, Image.DecompressionBombError, SyntaxError, ValueError, OSError) as e:
+            # 源文件不存在不算解码失败（blob可能稍后被修复）
+            if not os.path.exists(source_path):
+                raise
+            _skipped_marker(sha256, root).write_text(f"{type(e).__name__}: {e}", encoding='utf-8')
+            return []
+    skipped = [name for name in formats if name not in produced]
+    if skipped:
+        _skipped_marker(sha256, root).write_text(f"转码后没有变小: {','.join(skipped)}", encoding='utf-8')
+    return produced
+
+
+async def ensure_renditions(sha256: str, source_path: str, codec: Optional[str], file_size: int) -> List[str]:
+    """
+    确保blob的转码版本已生成，没有时在图片处理进程池中生成
+
+    同一blob的并发调用共享一次生成；原图太小/太大、之前标记为不生成时直接返回已有的格式
+
+    Returns:
+        可用的格式名列表
+    """
+    formats = supported_formats()
+    existing = [name for name in formats if rendition_path(sha256, name).exists()]
+    if (not formats or len(existing) == len(formats) or file_size < settings.IMAGE_RENDITION_MIN_SIZE
+            or file_size > settings.IMAGE_RENDITION_MAX_SOURCE_SIZE
+            or _skipped_marker(sha256, settings.IMAGE_RENDITION_DIR).exists()):
+        return existing
+
+    missing = [name for name in formats if name not in existing]
+    loop = asyncio.get_running_loop()
+    future = _pending.get(sha256)
+    if future is None or future.get_loop() is not loop:
+        future = asyncio.ensure_future(thumbnail_utils.run_image_job(
+            render_renditions, str(source_path), codec, sha256, tuple(missing),
+            settings.IMAGE_RENDITION_MAX_DIMENSION, settings.IMAGE_RENDITION_QUALITY,
+            settings.COMPRESSION_MIN_SAVING, file_size, str(settings.IMAGE_RENDITION_DIR)
+        ))
+        _pending[sha256] = future
+        future.add_done_callback(lambda _: _pending.pop(sha256, None))
+    # 某个请求被取消时不影响其他等待同一结果的请求
+    await asyncio.shield(future)
+    return available_renditions(sha256)
+
+
+def remove_renditions(sha256: str) -> int:
+    """
+    删除blob的全部转码版本和标记（blob被回收时调用）
+
+    Returns:
+        删除的文件数
+    """
+    paths = [_skipped_marker(sha256, settings.IMAGE_RENDITION_DIR)]
+    paths += [rendition_path(sha256, name) for name in FORMATS]
+    removed = 0
+    for path in paths:
+        try:
+            os.remove(path)
+            removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
@@ -0,0 +1,172 @@
+"""
+存储完整性校验工具模块
+blob 以内容的 SHA-256 命名，重新计算哈希与文件名比对即可发现静默损坏（位翻转、截断、被覆盖）。
+后台逐个重算哈希：未压缩的文件用 mmap 大块顺序读，zstd 压缩的文件流式解压后计算原始内容的哈希；
+按字节数限速，所在线程降低 IO/CPU 优先级，读完后提示内核丢弃页缓存，不挤占正常请求。
+"""
+import hashlib
+import mmap
+import os
+import platform
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, NamedTuple, Optional
+
+import zstandard
+
+from utils import compression_utils
+
+# 每次读取/哈希的块大小，大块顺序读减少系统调用，hashlib 计算时释放 GIL
+READ_SIZE = 8 * 1024 * 1024
+# 解压后的内容按较小的块交给哈希，解压输出仍在CPU缓存中时计算（实测比按 READ_SIZE 取块快约20%）
+DECOMPRESS_BLOCK_SIZE = 128 * 1024
+
+# ioprio_set 的系统调用号（glibc 没有封装）
+_IOPRIO_SYSCALLS = {'x86_64': 251, 'aarch64': 30, 'i686': 289, 'armv7l': 314}
+_IOPRIO_CLASS_IDLE = 3
+_IOPRIO_CLASS_SHIFT = 13
+_IOPRIO_WHO_PROCESS = 1
+
+# 校验专用线程（降低了优先级，不能与其他任务共用）；关闭时设置 stop_event 让进行中的批次尽快结束
+_executor: Optional[ThreadPoolExecutor] = None
+stop_event = threading.Event()
+
+
+class HashResult(NamedTuple):
+    sha256: str
+    plain_bytes: int    # 原始内容的字节数
+    stored_bytes: int   # 磁盘上读取的字节数
+
+
+class RateLimiter:
+    """按字节数限速（令牌桶，最多积攒1秒的额度）；bytes_per_second <= 0 时不限速"""
+
+    def __init__(self, bytes_per_second: float, sleep: Callable[[float], None] = time.sleep,
+                 clock: Callable[[], float] = time.monotonic):
+        self.rate = bytes_per_second
+        self._sleep = sleep
+        self._clock = clock
+        self._allowance = bytes_per_second
+        self._last = clock()
+
+    def consume(self, size: int):
+        if self.rate <= 0:
+            return
+        now = self._clock()
+        self._allowance = min(self.rate, self._allowance + (now - self._last) * self.rate)
+        self._last = now
+        self._allowance -= size
+        if self._allowance < 0:
+            self._sleep(-self._allowance / self.rate)
+
+
+def lower_io_priority() -> bool:
+    """
+    把当前线程的IO调度类设为 idle 并把 nice 调到最低，只影响调用线程
+
+    需要在专用线程中调用（不要在共享的线程池里调用）。不支持的平台上什么都不做，返回是否设置了IO优先级。
+    """
+    tid = threading.get_native_id()
+    try:
+        os.setpriority(os.PRIO_PROCESS, tid, 19)
+    except (AttributeError, OSError):
+        pass
+    syscall_number = _IOPRIO_SYSCALLS.get(platform.machine())
+    if syscall_number is None:
+        return False
+    try:
+        import ctypes
+        libc = ctypes.CDLL(None, use_errno=True)
+        return libc.syscall(syscall_number, _IOPRIO_WHO_PROCESS, tid,
+                            _IOPRIO_CLASS_IDLE << _IOPRIO_CLASS_SHIFT) == 0
+    except (OSError, AttributeError):
+        return False
+
+
+def get_executor() -> ThreadPoolExecutor:
+    """校验专用的单线程执行器，线程启动时降低自身的IO/CPU优先级"""
+    global _executor
+    if _executor is None:
+        stop_event.clear()
+        _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='storage-scrub',
+                                       initializer=lower_io_priority)
+    return _executor
+
+
+def shutdown_executor():
+    """关闭校验线程，不等待进行中的批次（排队的批次看到 stop_event 后立即返回）"""
+    global _executor
+    stop_event.set()
+    if _executor is not None:
+        _executor.shutdown(wait=False)
+        _executor = None
+
+
+def _advise(fd: int, advice_name: str):
+    advice = getattr(os, advice_name, None)
+    if advice is not None:
+        try:
+            os.posix_fadvise(fd, 0, 0, advice)
+        except OSError:
+            pass
+
+
+def hash_file(path, codec: Optional[str] = None, limiter: Optional[RateLimiter] = None,
+              read_size: int = READ_SIZE) -> HashResult:
+    """
+    计算存储文件中原始内容的 SHA-256
+
+    Args:
+        path: 存储文件路径
+        codec: 存储编码，None 为未压缩
+        limiter: 限速器，按磁盘上读取的字节数计
+        read_size: 每次从磁盘读取的字节数
+
+    Raises:
+        OSError: 文件不存在或读取失败
+        zstandard.ZstdError: 压缩数据损坏
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as raw:
+        fd = raw.fileno()
+        stored = os.fstat(fd).st_size
+        _advise(fd, 'POSIX_FADV_SEQUENTIAL')
+        try:
+            if codec is None:
+                plain = stored
+                if stored:
+                    with mmap.mmap(fd, 0, access=mmap.ACCESS_READ) as mapped:
+                        if hasattr(mapped, 'madvise') and hasattr(mmap, 'MADV_SEQUENTIAL'):
+                            mapped.madvise(mmap.MADV_SEQUENTIAL)
+                        view = memoryview(mapped)
+                        try:
+                            for offset in range(0, stored, read_size):
+                                block = view[offset:offset + read_size]
+                                if limiter:
+                                    limiter.consume(len(block))
+                                digest.update(block)
+                                block.release()
+                        finally:
+                            view.release()
+            else:
+                if codec != compression_utils.CODEC_ZSTD:
+                    raise ValueError(f"不支持的压缩编码: {codec}")
+                plain = 0
+                consumed = 0
+                with zstandard.ZstdDecompressor().stream_reader(raw, read_size=read_size,
+                                                                closefd=False) as reader:
+                    while True:
+                        block = reader.read(DECOMPRESS_BLOCK_SIZE)
+                        if not block:
+                            break
+                        plain += len(block)
+                        digest.update(block)
+                        if limiter:
+                            position = raw.tell()
+                            limiter.consume(position - consumed)
+                            consumed = position
+        finally:
+            # 校验读过的数据不会再被用到，不让它把热数据挤出页缓存
+            _advise(fd, 'POSIX_FADV_DONTNEED')
+    return HashResult(digest.hexdigest(), plain, stored)
@@ -0,0 +1,254 @@
+"""
+全文搜索工具模块
+分词（英文/数字按词，中日韩文字按二元组并附带单字）、从文本/PDF/docx中提取文本、BM25打分和摘要生成。
+倒排索引本身保存在数据库中（search_documents / search_postings），由后台索引任务增量维护。
+"""
+import math
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import unicodedata
+import zipfile
+from collections import Counter
+from functools import lru_cache
+from typing import IO, Callable, Dict, List, Optional, Tuple
+from xml.etree import ElementTree
+
+KIND_TEXT = 'text'
+KIND_PDF = 'pdf'
+KIND_DOCX = 'docx'
+
+TEXT_EXTENSIONS = {
+    '.txt', '.md', '.markdown', '.rst', '.log', '.csv', '.tsv', '.json', '.xml', '.html', '.htm',
+    '.yaml', '.yml', '.ini', '.conf', '.config', '.cfg', '.toml', '.properties', '.tex', '.srt',
+    '.py', '.js', '.jsx', '.ts', '.tsx', '.vue', '.java', '.kt', '.c', '.h', '.cc', '.cxx', '.cpp', '.hpp',
+    '.cs', '.go', '.rs', '.rb', '.php', '.swift', '.scala', '.lua', '.r', '.m', '.sql',
+    '.sh', '.bat', '.ps1', '.css', '.scss', '.less',
+}
+TEXT_MIME_TYPES = {'application/json', 'application/xml', 'application/javascript', 'application/x-sh'}
+DOCX_MIME_TYPE = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'
+
+# BM25 参数
+BM25_K1 = 1.2
+BM25_B = 0.75
+# 标题中的词按该倍数计入词频
+TITLE_WEIGHT = 3
+# 超过该长度的词（base64、哈希等）不建索引
+MAX_TERM_LENGTH = 32
+# 摘要长度（字符）
+SNIPPET_CHARS = 120
+# PDF 只提取前若干页
+PDF_MAX_PAGES = 50
+PDF_EXTRACT_TIMEOUT = 30
+
+_CJK = '\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af'
+# 第一组为中日韩文字串，第二组为其他文字的词
+_TOKEN_RE = re.compile(f'([{_CJK}]+)|([^\\W_{_CJK}]+)')
+_WORD_NS = '{http://schemas.openxmlformats.org/wordprocessingml/2006/main}'
+
+
+def normalize(text: str) -> str:
+    """全角转半角、兼容字符归一（NFKC），索引和查询使用同一规则"""
+    return unicodedata.normalize('NFKC', text or '')
+
+
+def _tokens(text: str, unigrams: bool):
+    for match in _TOKEN_RE.finditer(normalize(text).lower()):
+        run, word = match.groups()
+        if word is not None:
+            if len(word) <= MAX_TERM_LENGTH:
+                yield word
+            continue
+        if len(run) == 1:
+            yield run
+            continue
+        for i in range(len(run) - 1):
+            yield run[i:i + 2]
+        if unigrams:
+            # 单字也建索引，单字查询（如“学”）可以命中“学习”“大学”
+            yield from run
+
+
+def tokenize(text: str) -> List[str]:
+    """建索引用的分词：中日韩文字同时产生二元组和单字"""
+    return list(_tokens(text, unigrams=True))
+
+
+def query_terms(query: str) -> List[str]:
+    """查询用的分词（去重，保持顺序）：多字的中文词只用二元组，单字才用单字"""
+    return list(dict.fromkeys(_tokens(query, unigrams=False)))
+
+
+def term_frequencies(title: str, content: str) -> Tuple[Counter, int]:
+    """
+    计算文档的词频和长度
+
+    Returns:
+        (词 -> 词频, 文档长度)
+    """
+    counts = Counter(tokenize(content))
+    for term in tokenize(title):
+        counts[term] += TITLE_WEIGHT
+    return counts, sum(counts.values())
+
+
+def document_kind(filename: str, media_type: Optional[str] = None) -> Optional[str]:
+    """判断文件能否提取文本，返回 text / pdf / docx，不支持时返回None"""
+    ext = os.path.splitext(filename or '')[1].lower()
+    media_type = (media_type or '').lower()
+    if ext in TEXT_EXTENSIONS or media_type.startswith('text/') or media_type in TEXT_MIME_TYPES:
+        return KIND_TEXT
+    if ext == '.docx' or media_type == DOCX_MIME_TYPE:
+        return KIND_DOCX
+    if (ext == '.pdf' or media_type == 'application/pdf') and pdf_extractor():
+        return KIND_PDF
+    return None
+
+
+@lru_cache(maxsize=1)
+def pdf_extractor() -> Optional[str]:
+    """本机的PDF文本提取程序（poppler 的 pdftotext），没有安装时返回None"""
+    return shutil.which('pdftotext')
+
+
+def decode_text(data: bytes) -> str:
+    """
+    解码文本文件内容：BOM > UTF-8 > GB18030，都失败时按UTF-8替换无法解码的字节
+
+    data 可能是截断的，末尾不完整的多字节字符会被丢弃
+    """
+    if data.startswith((b'\xff\xfe', b'\xfe\xff')):
+        return data.decode('utf-16', errors='replace')
+    if data.startswith(b'\xef\xbb\xbf'):
+        data = data[3:]
+    for encoding in ('utf-8', 'gb18030'):
+        try:
+            return data.decode(encoding)
+        except UnicodeDecodeError as e:
+            # 只是截断在多字节字符中间
+            if e.start >= len(data) - 3 and e.reason == 'unexpected end of data':
+                return data[:e.start].decode(encoding, errors='replace')
+    return data.decode('utf-8', errors='replace')
+
+
+def _docx_text(path: str, max_chars: int) -> str:
+    parts: List[str] = []
+    size = 0
+    with zipfile.ZipFile(path) as zf, zf.open('word/document.xml') as xml:
+        for _, element in ElementTree.iterparse(xml):
+            tag = element.tag
+            if tag == f'{_WORD_NS}t' and element.text:
+                parts.append(element.text)
+                size += len(element.text)
+            elif tag == f'{_WORD_NS}tab':
+                parts.append('\t')
+            elif tag in (f'{_WORD_NS}p', f'{_WORD_NS}br'):
+                parts.append('\n')
+                element.clear()
+            if size >= max_chars:
+                break
+    return ''.join(parts)
+
+
+def _pdf_text(path: str) -> str:
+    result = subprocess.run(
+        [pdf_extractor(), '-l', str(PDF_MAX_PAGES), '-enc', 'UTF-8', '-q', path, '-'],
+        check=True, timeout=PDF_EXTRACT_TIMEOUT, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+    )
+    return result.stdout.decode('utf-8', errors='replace')
+
+
+def extract_text(opener: Callable[[], Tuple[IO[bytes], list]], kind: str, max_chars: int) -> str:
+    """
+    提取文件的文本（在线程中调用），最多返回 max_chars 个字符
+
+    Args:
+        opener: 打开文件内容，返回 (可读流, 用完后按顺序关闭的对象列表)
+        kind: document_kind 的返回值
+        max_chars: 文本长度上限
+
+    Raises:
+        FileNotFoundError: 文件内容不存在
+        zipfile.BadZipFile / ElementTree.ParseError / subprocess.SubprocessError: 文件损坏
+    """
+    reader, resources = opener()
+    try:
+        if kind == KIND_TEXT:
+            # UTF-8 每个字符最多4字节
+            return decode_text(reader.read(max_chars * 4))[:max_chars]
+        # docx 需要随机访问，pdftotext 需要文件路径，先写到临时文件
+        with tempfile.NamedTemporaryFile(suffix=f'.{kind}') as tmp:
+            shutil.copyfileobj(reader, tmp, 1024 * 1024)
+            tmp.flush()
+            text = _docx_text(tmp.name, max_chars) if kind == KIND_DOCX else _pdf_text(tmp.name)
+        return text[:max_chars]
+    finally:
+        for resource in resources:
+            resource.close()
+
+
+def bm25_scores(postings: Dict[str, Dict[int, int]], doc_lengths: Dict[int, int],
+                doc_count: int, avg_length: float) -> Dict[int, float]:
+    """
+    按 BM25 计算文档得分
+
+    Args:
+        postings: 词 -> {文档ID: 词频}
+        doc_lengths: 文档ID -> 文档长度
+        doc_count: 文档总数
+        avg_length: 平均文档长度
+
+    Returns:
+        文档ID -> 得分
+    """
+    scores: Dict[int, float] = {}
+    avg_length = avg_length or 1.0
+    for docs in postings.values():
+        idf = math.log(1 + (doc_count - len(docs) + 0.5) / (len(docs) + 0.5))
+        for doc_id, tf in docs.items():
+            norm = BM25_K1 * (1 - BM25_B + BM25_B * doc_lengths.get(doc_id, 0) / avg_length)
+            scores[doc_id] = scores.get(doc_id, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+    return scores
+
+
+def _query_phrases(query: str) -> List[str]:
+    # 查询中的原始词和中文串，长的优先匹配
+    phrases = [run or word for run, word in _TOKEN_RE.findall(normalize(query).lower())]
+    return sorted(set(phrases), key=len, reverse=True)
+
+
+def make_snippet(content: str, query: str, width: int = SNIPPET_CHARS) -> Tuple[str, List[Tuple[int, int]]]:
+    """
+    截取内容中第一个命中位置附近的摘要
+
+    Returns:
+        (摘要, 摘要中命中位置的 [起, 止) 列表)
+    """
+    content = content or ''
+    lowered = content.lower()
+    phrases = _query_phrases(query)
+    # 整个词找不到时退回到二元组（“学习计划”可能只出现了“学习”）
+    candidates = phrases + [term for term in query_terms(query) if term not in phrases]
+    first = -1
+    for phrase in candidates:
+        first = lowered.find(phrase)
+        if first >= 0:
+            break
+    start = max(0, first - width // 3) if first >= 0 else 0
+    end = min(len(content), start + width)
+    snippet = re.sub(r'\s+', ' ', content[start:end])
+    prefix = '…' if start > 0 else ''
+    suffix = '…' if end < len(content) else ''
+
+    highlights: List[Tuple[int, int]] = []
+    lowered_snippet = snippet.lower()
+    for phrase in candidates:
+        pos = lowered_snippet.find(phrase)
+        while pos >= 0:
+            span = (pos + len(prefix), pos + len(prefix) + len(phrase))
+            if not any(a < span[1] and span[0] < b for a, b in highlights):
+                highlights.append(span)
+            pos = lowered_snippet.find(phrase, pos + len(phrase))
+    return prefix + snippet + suffix, sorted(highlights)
@@ -0,0 +1,197 @@
+"""
+云盘分享链接工具模块
+热门分享链接会被频繁访问：分享信息按分享码缓存在进程内（带过期时间，撤销时失效），
+下载次数用一条带条件的 UPDATE 原子递增，并发下载不会超过最大下载次数。
+"""
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Mapping, NamedTuple, Optional, Tuple
+
+import jwt
+from sqlalchemy import or_, select, update
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from config import settings
+from utils import download_utils
+
+# 分享码的随机字节数（URL安全的base64编码后为16个字符）
+SHARE_CODE_BYTES = 12
+
+
+class ShareInfo(NamedTuple):
+    """缓存的分享信息（只包含不会随下载变化的字段，下载次数以数据库为准）"""
+    id: int
+    file_id: int
+    user_id: int
+    password_hash: Optional[str]
+    expires_at: Optional[datetime]
+    max_downloads: Optional[int]
+
+    def is_expired(self, now: datetime = None) -> bool:
+        return self.expires_at is not None and (now or datetime.now()) >= self.expires_at
+
+
+def new_share_code() -> str:
+    return secrets.token_urlsafe(SHARE_CODE_BYTES)
+
+
+def hash_password(password: str) -> str:
+    """分享密码的加盐慢哈希（与用户密码相同的 werkzeug 实现）"""
+    return generate_password_hash(password)
+
+
+def check_password(info: ShareInfo, password: Optional[str]) -> bool:
+    """没有设置密码的分享总是通过"""
+    if not info.password_hash:
+        return True
+    if not password:
+        return False
+    return check_password_hash(info.password_hash, password)
+
+
+def new_access_token(share_id: int, ttl: float = None) -> str:
+    """
+    密码校验通过后签发的短期访问凭证
+
+    密码只在 POST 请求体中提交一次，之后的信息和下载请求（包括浏览器直接打开的下载链接）只携带凭证，
+    密码不会出现在访问日志、浏览器历史和 Referer 中，也不必每个 Range 请求都计算一次慢哈希
+    """
+    ttl = settings.SHARE_ACCESS_TOKEN_TTL if ttl is None else ttl
+    return jwt.encode({
+        "purpose": "share_access",
+        "share_id": share_id,
+        "exp": datetime.now(timezone.utc) + timedelta(seconds=ttl)
+    }, settings.JWT_SECRET_KEY, algorithm="HS256")
+
+
+def has_access(info: ShareInfo, token: Optional[str]) -> bool:
+    """没有设置密码的分享总是可以访问，设置了密码的需要该分享未过期的访问凭证"""
+    if not info.password_hash:
+        return True
+    if not token:
+        return False
+    try:
+        payload = jwt.decode(token, settings.JWT_SECRET_KEY, algorithms=["HS256"])
+    except jwt.InvalidTokenError:
+        return False
+    return payload.get("purpose") == "share_access" and payload.get("share_id") == info.id
+
+
+def counts_as_download(headers: Mapping[str, str], file_size: int, etag: str) -> bool:
+    """
+    请求是否计入下载次数
+
+    下载工具和播放器会把一次下载拆成多个 Range 请求（断点续传、分段下载、拖动进度条），
+    只有会收到文件第一个字节的请求计数，不包含开头的后续分段请求不计数。
+    按下载响应相同的规则解析 Range：无效或被忽略的 Range、If-Range 不匹配（返回完整文件）、
+    多段中任一段或后缀区间覆盖到开头，都计数；无法满足的 Range（416）不计数。
+
+    Args:
+        headers: 请求头
+        file_size: 文件内容大小
+        etag: 文件的强 ETag（download_utils.make_etag），If-Range 与之不同时按完整下载计数
+    """
+    ranges = download_utils.parse_range_header(headers.get('range'), file_size)
+    if ranges is None:
+        return True
+    if not ranges:
+        return False
+    if_range = headers.get('if-range')
+    if if_range and if_range.strip() != etag:
+        return True
+    # 区间已排序并合并
+    return ranges[0][0] == 0
+
+
+def claim_download(db, table, share_id: int, now: datetime = None) -> bool:
+    """
+    原子地为分享计一次下载（不提交事务）
+
+    条件和递增在同一条 UPDATE 中完成（WHERE download_count < max_downloads），数据库按行加锁依次执行，
+    并发请求不会像“先读再写”那样读到相同的计数而超出限制；已撤销、已过期的分享同样不会计数。
+
+    Args:
+        table: 分享表（映射类或 Table），需要 id、is_active、expires_at、max_downloads、download_count 列
+
+    Returns:
+        是否计数成功，失败时分享已失效或已达到最大下载次数
+    """
+    table = getattr(table, '__table__', table)
+    columns = table.c
+    result = db.execute(
+        update(table).where(*_downloadable(columns, share_id, now))
+        .values(download_count=columns.download_count + 1)
+    )
+    return result.rowcount == 1
+
+
+def download_allowed(db, table, share_id: int, now: datetime = None) -> bool:
+    """
+    不计数的分段请求（断点续传等）发送内容前，按数据库检查分享仍可下载
+
+    与 claim_download 条件相同：缓存中的分享信息可能已在其他进程中撤销，计数达到上限后分段请求也不再提供，
+    否则客户端只要避开第一个字节就能无限次下载。
+
+    Args:
+        table: 分享表（映射类或 Table），列要求同 claim_download
+    """
+    table = getattr(table, '__table__', table)
+    return db.execute(
+        select(table.c.id).where(*_downloadable(table.c, share_id, now))
+    ).first() is not None
+
+
+def _downloadable(columns, share_id: int, now: Optional[datetime]) -> tuple:
+    """分享有效、未过期、未达到最大下载次数的条件"""
+    return (
+        columns.id == share_id,
+        columns.is_active.is_(True),
+        or_(columns.expires_at.is_(None), columns.expires_at > (now or datetime.now())),
+        or_(columns.max_downloads.is_(None), columns.download_count < columns.max_downloads),
+    )
+
+
+class ShareCache:
+    """
+    按分享码缓存分享信息
+
+    撤销、文件删除时调用 invalidate 立即失效；其他进程中的缓存最多保留 ttl 秒，
+    但下载计数的条件 UPDATE 和分段请求的检查都以数据库的 is_active 为准，撤销后其他进程也不会再提供下载。
+    """
+
+    def __init__(self, max_items: int = 4096, ttl: float = 60):
+        self._max_items = max_items
+        self._ttl = ttl
+        self._items: 'OrderedDict[str, Tuple[float, ShareInfo]]' = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, share_code: str) -> Optional[ShareInfo]:
+        with self._lock:
+            item = self._items.get(share_code)
+            if item is None:
+                return None
+            if item[0] <= time.monotonic():
+                del self._items[share_code]
+                return None
+            self._items.move_to_end(share_code)
+            return item[1]
+
+    def put(self, share_code: str, info: ShareInfo):
+        if self._ttl <= 0:
+            return
+        with self._lock:
+            self._items[share_code] = (time.monotonic() + self._ttl, info)
+            self._items.move_to_end(share_code)
+            while len(self._items) > self._max_items:
+                self._items.popitem(last=False)
+
+    def invalidate(self, share_code: str):
+        with self._lock:
+            self._items.pop(share_code, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
@@ -0,0 +1,333 @@
+"""
+云盘存储工具模块
+基于SHA-256内容寻址的blob存储：相同内容只在磁盘上保存一份
+"""
+import hashlib
+import os
+import re
+import secrets
+import shutil
+import threading
+import uuid
+from datetime import datetime, timedelta, UTC
+from pathlib import Path
+from typing import IO, Any, Dict, Optional, Tuple
+
+import anyio
+import jwt
+
+from config import settings
+
+# 流式读写的块大小
+CHUNK_SIZE = 1024 * 1024  # 1MB
+
+_SHA256_RE = re.compile(r'^[0-9a-f]{64}$')
+
+# 冷存储层（FileBlob.tier），热存储层为None
+TIER_COLD = 'cold'
+
+# 秒传持有证明：服务器随机选取的区间大小和挑战的有效期（秒）
+POSSESSION_RANGE_SIZE = 64 * 1024
+POSSESSION_CHALLENGE_TTL = 300
+
+# 同一进程内对blob落盘/回收的互斥锁，避免回收线程删除刚写入的同名blob
+blob_lock = threading.Lock()
+
+
+class FileTooLargeError(Exception):
+    """上传内容超过大小限制"""
+
+
+class QuotaExceededError(Exception):
+    """超出用户的云盘空间配额"""
+
+
+def is_valid_sha256(value: Optional[str]) -> bool:
+    """检查是否为合法的小写十六进制SHA-256字符串"""
+    return bool(value) and bool(_SHA256_RE.match(value))
+
+
+def blob_path(sha256: str, tier: Optional[str] = None) -> Path:
+    """
+    获取blob在磁盘上的存储路径
+
+    使用两级目录分散文件，如 blobs/ab/cd/abcd...；冷存储的blob在 COLD_BLOB_DIR 下使用相同的布局
+
+    Args:
+        sha256: 内容哈希
+        tier: 存储层，TIER_COLD 为冷存储，None 为默认的热存储
+
+    Returns:
+        blob文件路径
+    """
+    root = settings.COLD_BLOB_DIR if tier == TIER_COLD else settings.BLOB_DIR
+    return root / sha256[:2] / sha256[2:4] / sha256
+
+
+def storage_roots() -> Tuple[Tuple[str, Path], ...]:
+    """存储键的前缀和对应的目录（blobs 位于 cloud_disk 之内，需要先匹配）"""
+    return (
+        ('blobs', settings.BLOB_DIR),
+        ('cold_blobs', settings.COLD_BLOB_DIR),
+        ('cloud_disk', settings.CLOUD_DISK_DIR),
+        ('uploads', settings.UPLOAD_DIR),
+    )
+
+
+def storage_key(path) -> str:
+    """
+    把磁盘路径转换为保存在 save_path 中的存储键，如 blobs/ab/cd/abcd...、cloud_disk/12/x.txt
+
+    存储键与部署目录无关，存储目录迁移后不需要改写数据库；不在存储目录下的路径原样返回绝对路径
+    """
+    path = os.path.abspath(path)
+    for name, root in storage_roots():
+        root = os.path.abspath(root)
+        if path.startswith(root + os.sep):
+            return f"{name}/{Path(os.path.relpath(path, root)).as_posix()}"
+    return path
+
+
+def blob_key(sha256: str, tier: Optional[str] = None) -> str:
+    """blob的存储键"""
+    return storage_key(blob_path(sha256, tier))
+
+
+def resolve_storage_path(save_path: Optional[str]) -> Optional[Path]:
+    """
+    把 save_path（存储键或旧记录的绝对路径）解析为磁盘路径，只做字符串运算，不访问磁盘
+
+    Returns:
+        磁盘路径；无法识别的相对路径（很早的旧记录）返回None
+    """
+    if not save_path:
+        return None
+    if os.path.isabs(save_path):
+        return Path(save_path)
+    name, _, rest = save_path.replace('\\', '/').partition('/')
+    for root_name, root in storage_roots():
+        if name == root_name and rest:
+            return Path(root) / rest
+    return None
+
+
+def new_temp_path(tier: Optional[str] = None) -> Path:
+    """生成一个临时文件路径（与对应存储层的blob目录在同一文件系统，保证rename原子性）"""
+    directory = settings.COLD_BLOB_DIR / 'tmp' if tier == TIER_COLD else settings.BLOB_TMP_DIR
+    directory.mkdir(parents=True, exist_ok=True)
+    return directory / f"{uuid.uuid4().hex}.part"
+
+
+class HashingFileWriter:
+    """
+    异步写入文件并计算SHA-256，不阻塞事件循环
+
+    收到的数据先攒到 CHUNK_SIZE，再在线程中写入并计算哈希（hashlib 处理大块数据时释放 GIL）；
+    用作 async with 上下文，正常退出时写入剩余数据
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.size = 0
+        self._hasher = hashlib.sha256()
+        self._buffer = bytearray()
+        self._file = None
+
+    async def __aenter__(self) -> 'HashingFileWriter':
+        self._file = await anyio.to_thread.run_sync(open, self.path, 'wb')
+        return self
+
+    async def __aexit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                await self._flush()
+        finally:
+            # 数据都已整块写入，关闭很快；取消时也要关闭，不能放进线程
+            self._file.close()
+
+    async def write(self, data: bytes):
+        self.size += len(data)
+        self._buffer += data
+        if len(self._buffer) >= CHUNK_SIZE:
+            await self._flush()
+
+    def hexdigest(self) -> str:
+        """已写入内容的SHA-256，退出上下文后调用"""
+        return self._hasher.hexdigest()
+
+    async def _flush(self):
+        if self._buffer:
+            block, self._buffer = bytes(self._buffer), bytearray()
+            await anyio.to_thread.run_sync(self._write_block, block)
+
+    def _write_block(self, block: bytes):
+        self._hasher.update(block)
+        self._file.write(block)
+
+
+async def save_upload_to_temp(upload_file, max_size: Optional[int] = None) -> Tuple[Path, str, int]:
+    """
+    将上传文件流式写入临时文件，同时计算SHA-256（写入和哈希在线程中进行）
+
+    Args:
+        upload_file: starlette UploadFile
+        max_size: 最大允许字节数，超过时抛出 FileTooLargeError
+
+    Returns:
+        (临时文件路径, sha256, 文件大小)
+    """
+    tmp_path = new_temp_path()
+    try:
+        async with HashingFileWriter(tmp_path) as writer:
+            while True:
+                chunk = await upload_file.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                if max_size is not None and writer.size + len(chunk) > max_size:
+                    raise FileTooLargeError(f"文件大小超过限制: {writer.size + len(chunk)} > {max_size}")
+                await writer.write(chunk)
+    except BaseException:
+        discard_temp(tmp_path)
+        raise
+    return tmp_path, writer.hexdigest(), writer.size
+
+
+def save_bytes_to_temp(content: bytes) -> Tuple[Path, str, int]:
+    """将内存中的内容写入临时文件并计算SHA-256"""
+    tmp_path = new_temp_path()
+    with open(tmp_path, 'wb') as out:
+        out.write(content)
+    return tmp_path, hashlib.sha256(content).hexdigest(), len(content)
+
+
+def hash_file(path) -> str:
+    """流式计算已有文件的SHA-256"""
+    hasher = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+def commit_temp_as_blob(tmp_path: Path, sha256: str) -> Path:
+    """
+    将临时文件提交为blob
+
+    如果blob已存在则丢弃临时文件（内容相同），否则原子地rename到位。
+    调用方需持有 blob_lock。
+
+    Returns:
+        blob文件路径
+    """
+    target = blob_path(sha256)
+    if target.exists():
+        discard_temp(tmp_path)
+        return target
+    target.parent.mkdir(parents=True, exist_ok=True)
+    os.replace(tmp_path, target)
+    return target
+
+
+def discard_temp(tmp_path: Optional[Path]):
+    """删除临时文件，忽略不存在的情况"""
+    if tmp_path is None:
+        return
+    try:
+        os.remove(tmp_path)
+    except FileNotFoundError:
+        pass
+
+
+def remove_blob(sha256: str) -> bool:
+    """
+    删除blob文件（热存储和冷存储中的都删除），调用方需持有 blob_lock
+
+    Returns:
+        是否确实删除了文件
+    """
+    removed = False
+    for tier in (None, TIER_COLD):
+        try:
+            os.remove(blob_path(sha256, tier))
+            removed = True
+        except FileNotFoundError:
+            pass
+    return removed
+
+
+def remove_path(path) -> bool:
+    """
+    删除磁盘上的文件或整个目录（path 也可以是存储键），不存在或无法识别时忽略
+
+    Returns:
+        是否确实删除了内容
+    """
+    path = resolve_storage_path(str(path))
+    if path is None:
+        return False
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+        return True
+    try:
+        os.remove(path)
+        return True
+    except FileNotFoundError:
+        return False
+
+
+def new_possession_challenge(user_id: int, sha256: str, file_size: int) -> Dict[str, Any]:
+    """
+    生成秒传持有证明的挑战
+
+    服务器随机选取一段内容区间和一个随机串，客户端需要回答 SHA-256(随机串 + 区间内容)；
+    只知道哈希和大小的人答不出来。挑战签名后交给客户端保存，服务器不记录状态。
+
+    Returns:
+        {"token": 签名后的挑战, "nonce": 随机串, "offset": 区间起点, "length": 区间长度}
+    """
+    length = min(POSSESSION_RANGE_SIZE, file_size)
+    offset = secrets.randbelow(file_size - length + 1)
+    nonce = secrets.token_hex(16)
+    token = jwt.encode({
+        "purpose": "upload_probe",
+        "user_id": user_id,
+        "sha256": sha256,
+        "file_size": file_size,
+        "offset": offset,
+        "length": length,
+        "nonce": nonce,
+        "exp": datetime.now(UTC) + timedelta(seconds=POSSESSION_CHALLENGE_TTL)
+    }, settings.JWT_SECRET_KEY, algorithm="HS256")
+    return {"token": token, "nonce": nonce, "offset": offset, "length": length}
+
+
+def read_possession_challenge(token: str, user_id: int, sha256: str, file_size: int) -> Optional[Tuple[str, int, int]]:
+    """
+    校验挑战的签名、有效期以及是否属于该用户和该内容
+
+    Returns:
+        (随机串, 区间起点, 区间长度)，无效时返回None
+    """
+    try:
+        payload = jwt.decode(token, settings.JWT_SECRET_KEY, algorithms=["HS256"])
+    except jwt.InvalidTokenError:
+        return None
+    if (payload.get("purpose") != "upload_probe" or payload.get("user_id") != user_id
+            or payload.get("sha256") != sha256 or payload.get("file_size") != file_size):
+        return None
+    return payload["nonce"], payload["offset"], payload["length"]
+
+
+def possession_proof(stream: IO[bytes], nonce: str, offset: int, length: int) -> str:
+    """计算持有证明 SHA-256(随机串 + 内容[offset, offset+length))，stream 为解压后的顺序读取流"""
+    hasher = hashlib.sha256(nonce.encode('utf-8'))
+    if offset:
+        stream.seek(offset)
+    remaining = length
+    while remaining > 0:
+        chunk = stream.read(min(CHUNK_SIZE, remaining))
+        if not chunk:
+            break
+        hasher.update(chunk)
+        remaining -= len(chunk)
+    return hasher.hexdigest()
@@ -0,0 +1,193 @@
+"""
+云盘缩略图工具模块
+为图片（以及本机装有 pdftoppm 时的PDF首页）生成几个固定尺寸的WebP缩略图，
+按blob哈希和尺寸缓存在磁盘上。生成在进程池中执行，同一blob的并发请求只生成一次。
+"""
+import asyncio
+import os
+import shutil
+import subprocess
+import tempfile
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, List, Optional, Sequence
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+from config import settings
+from utils import compression_utils, storage_utils
+
+KIND_IMAGE = 'image'
+KIND_PDF = 'pdf'
+
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.webp', '.bmp', '.tif', '.tiff'}
+IMAGE_MIME_TYPES = {'image/jpeg', 'image/png', 'image/gif', 'image/webp', 'image/bmp', 'image/tiff'}
+# 生成失败（内容无法解码）的标记文件后缀，避免反复尝试
+FAILED_SUFFIX = '.failed'
+# 渲染PDF首页的超时时间（秒）
+PDF_RENDER_TIMEOUT = 30
+
+_pool = compression_utils.LazyProcessPool(lambda: settings.THUMBNAIL_WORKERS)
+_pending: Dict[str, asyncio.Future] = {}
+
+
+@lru_cache(maxsize=1)
+def pdf_renderer() -> Optional[str]:
+    """本机的PDF渲染程序（poppler 的 pdftoppm），没有安装时返回None"""
+    return shutil.which('pdftoppm')
+
+
+def thumbnail_kind(filename: str, media_type: Optional[str] = None) -> Optional[str]:
+    """判断文件能否生成缩略图，返回 image / pdf，不支持时返回None"""
+    ext = os.path.splitext(filename or '')[1].lower()
+    media_type = (media_type or '').lower()
+    if ext in IMAGE_EXTENSIONS or media_type in IMAGE_MIME_TYPES:
+        return KIND_IMAGE
+    if (ext == '.pdf' or media_type == 'application/pdf') and pdf_renderer():
+        return KIND_PDF
+    return None
+
+
+def pick_size(requested: Optional[int], sizes: Sequence[int] = None) -> int:
+    """选择不小于请求尺寸的最小固定尺寸，超过最大尺寸时使用最大尺寸"""
+    sizes = sorted(sizes or settings.THUMBNAIL_SIZES)
+    for size in sizes:
+        if requested is not None and size >= requested:
+            return size
+    return sizes[-1] if requested is not None else sizes[0]
+
+
+def thumbnail_path(sha256: str, size: int, root: Path = None) -> Path:
+    """缩略图在磁盘上的路径，如 thumbnails/ab/abcd..._256.webp"""
+    return (root or settings.THUMBNAIL_DIR) / sha256[:2] / f"{sha256}_{size}.webp"
+
+
+def _failed_marker(sha256: str, root: Path) -> Path:
+    return root / sha256[:2] / f"{sha256}{FAILED_SUFFIX}"
+
+
+def _open_source(source_path: str, codec: Optional[str], kind: str, max_size: int, workdir: str) -> Image.Image:
+    """打开源内容：压缩存储的blob先解压到临时文件，PDF先渲染首页为PNG"""
+    if codec is not None:
+        plain_path = os.path.join(workdir, 'source')
+        reader, resources = compression_utils.open_reader(source_path, codec)
+        try:
+            with open(plain_path, 'wb') as out:
+                shutil.copyfileobj(reader, out, storage_utils.CHUNK_SIZE)
+        finally:
+            for resource in resources:
+                resource.close()
+        source_path = plain_path
+
+    if kind == KIND_PDF:
+        prefix = os.path.join(workdir, 'page')
+        subprocess.run(
+            [pdf_renderer(), '-f', '1', '-l', '1', '-singlefile', '-png', '-scale-to', str(max_size),
+             source_path, prefix],
+            check=True, timeout=PDF_RENDER_TIMEOUT, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+        )
+        source_path = prefix + '.png'
+
+    image = Image.open(source_path)
+    # JPEG 可以在解码时直接按比例缩小，大图省掉大部分解码时间
+    image.draft('RGB', (max_size, max_size))
+    image = ImageOps.exif_transpose(image)
+    if image.mode not in ('RGB', 'RGBA'):
+        image = image.convert('RGBA' if 'A' in image.getbands() or image.mode == 'P' else 'RGB')
+    return image
+
+
+def render_thumbnails(source_path: str, codec: Optional[str], kind: str, sha256: str,
+                      sizes: Sequence[int], quality: int, root: str) -> bool:
+    """
+    生成一个blob的全部尺寸缩略图（在进程池工作进程中运行）
+
+    从大到小依次缩放，每个尺寸先写临时文件再原子 rename。内容无法解码时写入失败标记。
+
+    Returns:
+        是否生成成功
+    """
+    root = Path(root)
+    target_dir = root / sha256[:2]
+    target_dir.mkdir(parents=True, exist_ok=True)
+    with tempfile.TemporaryDirectory(dir=target_dir) as workdir:
+        try:
+            image = _open_source(source_path, codec, kind, max(sizes), workdir)
+            for size in sorted(sizes, reverse=True):
+                image.thumbnail((size, size), Image.Resampling.LANCZOS)
+                tmp_path = os.path.join(workdir, f"{size}.webp")
+                image.save(tmp_path, 'WEBP', quality=quality, method=4)
+                os.replace(tmp_path, thumbnail_path(sha256, size, root))
+        except (UnidentifiedImageError, Image.DecompressionBombError, SyntaxError, ValueError, OSError,
+                subprocess.SubprocessError) as e:
+            # 源文件不存在不算解码失败（blob可能稍后被修复）
+            if not os.path.exists(source_path):
+                raise
+            _failed_marker(sha256, root).write_text(f"{type(e).__name__}: {e}", encoding='utf-8')
+            return False
+    return True
+
+
+async def run_image_job(func, *args):
+    """在图片处理进程池中执行任务（缩略图、头像等），func 必须是模块级函数"""
+    return await asyncio.get_running_loop().run_in_executor(_pool.get(), func, *args)
+
+
+def has_thumbnails(sha256: str) -> bool:
+    """全部尺寸的缩略图是否都已生成"""
+    return all(thumbnail_path(sha256, size).exists() for size in settings.THUMBNAIL_SIZES)
+
+
+async def ensure_thumbnails(sha256: str, source_path: str, codec: Optional[str], kind: str,
+                            file_size: int) -> bool:
+    """
+    确保blob的缩略图已生成，没有时在进程池中生成
+
+    同一blob的并发调用共享一次生成；之前解码失败或源文件过大时直接返回False
+
+    Returns:
+        缩略图是否可用
+    """
+    if has_thumbnails(sha256):
+        return True
+    if file_size > settings.THUMBNAIL_MAX_SOURCE_SIZE or _failed_marker(sha256, settings.THUMBNAIL_DIR).exists():
+        return False
+
+    loop = asyncio.get_running_loop()
+    future = _pending.get(sha256)
+    if future is None or future.get_loop() is not loop:
+        future = loop.run_in_executor(
+            _pool.get(), render_thumbnails, str(source_path), codec, kind, sha256,
+            tuple(settings.THUMBNAIL_SIZES), settings.THUMBNAIL_QUALITY, str(settings.THUMBNAIL_DIR)
+        )
+        _pending[sha256] = future
+        future.add_done_callback(lambda _: _pending.pop(sha256, None))
+    # 某个请求被取消时不影响其他等待同一结果的请求
+    return await asyncio.shield(future)
+
+
+def remove_thumbnails(sha256: str) -> int:
+    """
+    删除blob的全部缩略图和失败标记（blob被回收时调用）
+
+    Returns:
+        删除的文件数
+    """
+    target_dir = settings.THUMBNAIL_DIR / sha256[:2]
+    paths: List[Path] = [_failed_marker(sha256, settings.THUMBNAIL_DIR)]
+    if target_dir.is_dir():
+        # 包括调整尺寸配置之前生成的旧尺寸
+        paths += list(target_dir.glob(f"{sha256}_*.webp"))
+    removed = 0
+    for path in paths:
+        try:
+            os.remove(path)
+            removed += 1
+        except FileNotFoundError:
+            pass
+    return removed
+
+
+def shutdown_pool():
+    """关闭缩略图进程池"""
+    _pool.shutdown()
@@ -0,0 +1,74 @@
+"""
+冷存储分层工具模块
+下载时只在内存中记下被访问的blob，由后台任务批量写回最后访问时间，下载路径上没有额外的数据库写入。
+分层任务把长期没有访问的blob移到冷存储并重新压缩，移动前后各计时读一次，用于报告对访问延迟的影响。
+"""
+import hashlib
+import os
+import threading
+import time
+from typing import List, NamedTuple, Optional
+
+from utils import compression_utils
+from utils.download_utils import DOWNLOAD_CHUNK_SIZE
+
+
+class AccessTracker:
+    """记录被访问的blob，由后台任务定期取出并写回数据库"""
+
+    def __init__(self):
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def touch(self, sha256: Optional[str]):
+        if sha256:
+            with self._lock:
+                self._pending.add(sha256)
+
+    def drain(self) -> List[str]:
+        """取出并清空记录的blob，按哈希排序（批量更新时按主键顺序加锁）"""
+        with self._lock:
+            pending, self._pending = self._pending, set()
+        return sorted(pending)
+
+
+class ReadTiming(NamedTuple):
+    first_byte_seconds: float   # 打开文件到读出第一块原始内容
+    total_seconds: float        # 读完全部内容
+    plain_bytes: int
+    sha256: str
+
+
+def drop_page_cache(path):
+    """提示内核丢弃文件的页缓存，之后的读取从磁盘开始（不支持时什么都不做）"""
+    if not hasattr(os, 'posix_fadvise'):
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+    finally:
+        os.close(fd)
+
+
+def timed_read(path, codec: Optional[str]) -> ReadTiming:
+    """
+    像下载一样顺序读出（解压）存储文件的全部内容，记录首字节延迟和总耗时，并计算原始内容的SHA-256
+
+    Raises:
+        OSError / zstandard.ZstdError: 文件不存在或内容损坏
+    """
+    digest = hashlib.sha256()
+    started = time.perf_counter()
+    reader, resources = compression_utils.open_reader(path, codec)
+    try:
+        block = reader.read(DOWNLOAD_CHUNK_SIZE)
+        first_byte = time.perf_counter() - started
+        size = 0
+        while block:
+            digest.update(block)
+            size += len(block)
+            block = reader.read(DOWNLOAD_CHUNK_SIZE)
+    finally:
+        for resource in resources:
+            resource.close()
+    return ReadTiming(first_byte, time.perf_counter() - started, size, digest.hexdigest())
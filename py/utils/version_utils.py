@@ -0,0 +1,147 @@
+"""
+文件历史版本工具模块
+版本内容按内容定义的边界分块（content-defined chunking），块以 SHA-256 命名、zstd 压缩后保存，
+相邻版本之间未改动的块共享存储，一次编辑通常只新增一两个块。
+
+分块边界只出现在换行符之后：对换行符前 ANCHOR_WINDOW 字节的窗口计算哈希，低位全为0时切分。
+边界只取决于附近的内容，插入或删除只影响所在的块。没有换行的长内容（压缩后的单行JSON等）
+在 MAX_CHUNK_SIZE 处强制切分。
+"""
+import hashlib
+import os
+import uuid
+import zlib
+from pathlib import Path
+from typing import Dict, Iterable, List, Tuple
+
+import zstandard
+
+from config import settings
+
+MIN_CHUNK_SIZE = 1024
+MAX_CHUNK_SIZE = 64 * 1024
+# 窗口哈希低6位为0时切分：每64个候选边界（行尾）约切一次，普通文本平均块大小约4KB
+BOUNDARY_MASK = (1 << 6) - 1
+ANCHOR_WINDOW = 32
+DIGEST_SIZE = 32
+CHUNK_COMPRESSION_LEVEL = 3
+
+
+def chunk_boundaries(data: bytes) -> List[int]:
+    """
+    计算分块的结束位置
+
+    Returns:
+        每个块的结束偏移（最后一个等于 len(data)）
+    """
+    view = memoryview(data)
+    size = len(data)
+    cuts: List[int] = []
+    start = 0
+    while start < size:
+        limit = min(start + MAX_CHUNK_SIZE, size)
+        cut = limit
+        pos = data.find(b'\n', start + MIN_CHUNK_SIZE - 1, limit)
+        while pos != -1:
+            end = pos + 1
+            if not zlib.crc32(view[max(start, end - ANCHOR_WINDOW):end]) & BOUNDARY_MASK:
+                cut = end
+                break
+            pos = data.find(b'\n', end, limit)
+        cuts.append(cut)
+        start = cut
+    return cuts
+
+
+def split_chunks(data: bytes) -> List[Tuple[str, int, int]]:
+    """
+    将内容分块并计算每块的哈希（在线程中调用）
+
+    Returns:
+        [(块SHA-256, 起始偏移, 结束偏移)]
+    """
+    view = memoryview(data)
+    chunks = []
+    start = 0
+    for end in chunk_boundaries(data):
+        chunks.append((hashlib.sha256(view[start:end]).hexdigest(), start, end))
+        start = end
+    return chunks
+
+
+def pack_manifest(digests: Iterable[str]) -> bytes:
+    """版本的块清单：依次排列的块SHA-256（每个32字节）"""
+    return b''.join(bytes.fromhex(digest) for digest in digests)
+
+
+def unpack_manifest(manifest: bytes) -> List[str]:
+    return [manifest[i:i + DIGEST_SIZE].hex() for i in range(0, len(manifest or b''), DIGEST_SIZE)]
+
+
+def chunk_path(sha256: str) -> Path:
+    """块在磁盘上的路径，如 version_chunks/ab/abcd..."""
+    return settings.VERSION_CHUNK_DIR / sha256[:2] / sha256
+
+
+def store_chunk(sha256: str, data) -> int:
+    """
+    保存一个块（已存在时跳过），先写临时文件再原子 rename，可以并发调用
+
+    Returns:
+        磁盘上的大小
+    """
+    target = chunk_path(sha256)
+    if target.exists():
+        return target.stat().st_size
+    target.parent.mkdir(parents=True, exist_ok=True)
+    compressed = zstandard.ZstdCompressor(level=CHUNK_COMPRESSION_LEVEL).compress(data)
+    tmp_path = target.with_name(f"{sha256}.{uuid.uuid4().hex}.tmp")
+    with open(tmp_path, 'wb') as f:
+        f.write(compressed)
+    os.replace(tmp_path, target)
+    return len(compressed)
+
+
+def store_chunks(data: bytes, chunks: List[Tuple[str, int, int]]) -> Dict[str, int]:
+    """
+    压缩并保存内容的全部块（已存在的跳过），在线程中调用，不持有 blob_lock
+
+    写入后、登记引用之前，引用计数为0的同名块可能被回收任务删除，调用方在 blob_lock 内登记时
+    需对没有记录的块确认文件仍然存在
+
+    Args:
+        chunks: split_chunks(data) 的结果
+
+    Returns:
+        {块SHA-256: 磁盘上的大小}
+    """
+    view = memoryview(data)
+    stored_sizes: Dict[str, int] = {}
+    for sha256, start, end in chunks:
+        if sha256 not in stored_sizes:
+            stored_sizes[sha256] = store_chunk(sha256, view[start:end])
+    return stored_sizes
+
+
+def read_version(manifest: bytes) -> bytes:
+    """
+    按块清单拼出版本内容
+
+    Raises:
+        FileNotFoundError: 块文件丢失
+    """
+    decompressor = zstandard.ZstdDecompressor()
+    parts = []
+    for sha256 in unpack_manifest(manifest):
+        with open(chunk_path(sha256), 'rb') as f:
+            parts.append(decompressor.decompress(f.read()))
+    return b''.join(parts)
+
+
+def remove_chunk(sha256: str) -> bool:
+    """删除块文件，调用方需持有 blob_lock"""
+    try:
+        os.remove(chunk_path(sha256))
+        return True
+    except FileNotFoundError:
+        return False
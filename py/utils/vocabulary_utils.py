@@ -0,0 +1,88 @@
+"""
+单词表AI补全工具模块
+上传单词表时，总表中没有的单词要调用AI补全释义、词性和例句。单词按预估的输出token数分批
+（每批不超过 token 预算，短单词一批可以放更多），各批通过异步客户端并发请求，并发数有上限；
+结果按完成顺序交给调用方逐批保存。输出被 max_tokens 截断的批次对半拆分后重新请求。
+"""
+import asyncio
+from typing import AsyncIterator, Awaitable, Callable, List, Optional, Sequence, Tuple
+
+# 每个单词结果的预估输出token数：释义、词性、例句和JSON结构；
+# 中日韩例句按字计token，比拉丁字母语言的例句更长
+WORD_OUTPUT_TOKENS = 100
+CJK_WORD_OUTPUT_TOKENS = 140
+CJK_LANGUAGES = {'zh', 'ja', 'ko'}
+# 预算中留给模型额外输出（说明文字、格式偏差）的比例
+TOKEN_HEADROOM = 0.8
+
+
+class BatchTruncated(Exception):
+    """批次的输出被 max_tokens 截断，结果不完整"""
+
+
+def estimate_word_tokens(word: str, language: str = 'en') -> int:
+    """预估一个单词补全结果的输出token数（单词本身在结果中原样出现，长词组更长）"""
+    base = CJK_WORD_OUTPUT_TOKENS if language in CJK_LANGUAGES else WORD_OUTPUT_TOKENS
+    return base + len(word)
+
+
+def plan_batches(words: Sequence[str], language: str, token_budget: int, max_batch: int) -> List[List[str]]:
+    """
+    按输出token预算把单词分批
+
+    每批预估的输出token数不超过 token_budget * TOKEN_HEADROOM，单词数不超过 max_batch；
+    单个单词超出预算时单独成批
+    """
+    limit = token_budget * TOKEN_HEADROOM
+    batches: List[List[str]] = []
+    current: List[str] = []
+    used = 0
+    for word in words:
+        cost = estimate_word_tokens(word, language)
+        if current and (used + cost > limit or len(current) >= max_batch):
+            batches.append(current)
+            current, used = [], 0
+        current.append(word)
+        used += cost
+    if current:
+        batches.append(current)
+    return batches
+
+
+async def enrich_batches(
+    batches: Sequence[List[str]],
+    enrich: Callable[[List[str]], Awaitable[list]],
+    concurrency: int
+) -> AsyncIterator[Tuple[List[str], Optional[list]]]:
+    """
+    并发补全各批单词，按完成顺序产出 (批次, 结果)
+
+    同时进行的请求不超过 concurrency 个。enrich 抛出 BatchTruncated 时，批次对半拆分后重新排队；
+    只有一个单词仍被截断时产出 (批次, None)。调用方提前退出时取消未完成的请求。
+    """
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+
+    async def run(batch: List[str]):
+        async with semaphore:
+            return await enrich(batch)
+
+    pending = {asyncio.ensure_future(run(batch)): batch for batch in batches if batch}
+    try:
+        while pending:
+            done, _ = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                batch = pending.pop(future)
+                try:
+                    result = future.result()
+                except BatchTruncated:
+                    if len(batch) == 1:
+                        yield batch, None
+                        continue
+                    middle = len(batch) // 2
+                    for half in (batch[:middle], batch[middle:]):
+                        pending[asyncio.ensure_future(run(half))] = half
+                    continue
+                yield batch, result
+    finally:
+        for future in pending:
+            future.cancel()
@@ -0,0 +1,159 @@
+"""
+流式ZIP打包工具模块
+边读取边生成ZIP（需要时自动使用ZIP64），不落地临时文件，内存占用与文件大小和数量无关。
+输出流不可回退，每个条目的CRC和大小写在条目数据之后的数据描述符中。
+已压缩的格式（视频、图片、压缩包、Office文档等）以 STORED 方式原样写入，其余内容使用 DEFLATE。
+"""
+import os
+import time
+import zipfile
+from typing import IO, Callable, Iterable, Iterator, List, NamedTuple, Optional, Tuple
+
+import anyio
+
+# 读取源文件的块大小
+READ_CHUNK_SIZE = 256 * 1024
+# 缓冲的输出达到该大小时交给调用方发送
+FLUSH_SIZE = 256 * 1024
+
+# 本身已经压缩、再用 DEFLATE 没有收益的扩展名
+COMPRESSED_EXTENSIONS = {
+    '.zip', '.gz', '.tgz', '.bz2', '.xz', '.zst', '.7z', '.rar', '.jar', '.apk',
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.heic', '.avif',
+    '.mp3', '.aac', '.m4a', '.ogg', '.opus', '.flac',
+    '.mp4', '.m4v', '.mov', '.mkv', '.webm', '.avi', '.flv',
+    '.docx', '.xlsx', '.pptx', '.odt', '.ods', '.odp', '.epub', '.pdf',
+}
+COMPRESSED_MIME_PREFIXES = ('image/', 'video/', 'audio/')
+# 图片中 svg 和 bmp 是未压缩的
+UNCOMPRESSED_MIME_TYPES = {'image/svg+xml', 'image/bmp'}
+
+# 打开条目内容，返回 (可读流, 用完后按顺序关闭的对象列表)
+Opener = Callable[[], Tuple[IO[bytes], list]]
+
+
+class ZipEntry(NamedTuple):
+    """要写入压缩包的条目，opener 为None时表示目录"""
+    name: str
+    size: int = 0
+    mtime: Optional[float] = None
+    opener: Optional[Opener] = None
+    store: bool = False
+
+
+def is_compressed_type(filename: str, media_type: Optional[str] = None) -> bool:
+    """按扩展名和MIME类型判断内容是否已经是压缩格式"""
+    if os.path.splitext(filename)[1].lower() in COMPRESSED_EXTENSIONS:
+        return True
+    media_type = (media_type or '').lower()
+    return media_type.startswith(COMPRESSED_MIME_PREFIXES) and media_type not in UNCOMPRESSED_MIME_TYPES
+
+
+def safe_member_name(name: str) -> str:
+    """去掉文件名中的路径分隔符，避免解压时逃出目标目录"""
+    name = name.replace('/', '_').replace('\\', '_').strip()
+    return name if name not in ('', '.', '..') else '_'
+
+
+def unique_member_name(name: str, used: set) -> str:
+    """同一目录下重名时追加序号，如 a.txt -> a (1).txt"""
+    if name not in used:
+        used.add(name)
+        return name
+    stem, ext = os.path.splitext(name)
+    index = 1
+    while f"{stem} ({index}){ext}" in used:
+        index += 1
+    name = f"{stem} ({index}){ext}"
+    used.add(name)
+    return name
+
+
+def _date_time(mtime: Optional[float]) -> Tuple[int, int, int, int, int, int]:
+    # ZIP 的时间字段只能表示 1980 年之后的时间
+    local = time.localtime(mtime if mtime is not None else time.time())
+    return max(local[:6], (1980, 1, 1, 0, 0, 0))
+
+
+class _Sink:
+    """只追加的输出缓冲，zipfile 检测到不可 seek 后会使用数据描述符"""
+
+    def __init__(self):
+        self._parts: List[bytes] = []
+        self.size = 0
+
+    def write(self, data) -> int:
+        if data:
+            self._parts.append(bytes(data))
+            self.size += len(data)
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self) -> bytes:
+        data = b''.join(self._parts)
+        self._parts.clear()
+        self.size = 0
+        return data
+
+
+def iter_zip(entries: Iterable[ZipEntry]) -> Iterator[bytes]:
+    """
+    生成ZIP压缩包的字节块（同步生成器，每一步都会读盘，应在线程中驱动）
+
+    单个条目超过4GB、条目数超过65535或压缩包超过4GB时自动写入ZIP64结构。
+    opener 抛出 FileNotFoundError 的条目会被跳过；提前关闭生成器时会关闭正在读取的源文件。
+    """
+    sink = _Sink()
+    with zipfile.ZipFile(sink, 'w', allowZip64=True) as zf:
+        for entry in entries:
+            info = zipfile.ZipInfo(entry.name, _date_time(entry.mtime))
+            if entry.opener is None:
+                info.external_attr = (0o40755 << 16) | 0x10
+                zf.writestr(info, b'')
+                continue
+            info.external_attr = 0o644 << 16
+            info.compress_type = zipfile.ZIP_STORED if entry.store else zipfile.ZIP_DEFLATED
+            # 预先给出大小，超过4GB的条目在本地文件头中就写入ZIP64扩展字段
+            info.file_size = entry.size
+
+            # 打包过程中内容已被删除的文件直接跳过（响应头已发出，无法再返回错误）
+            try:
+                reader, resources = entry.opener()
+            except FileNotFoundError:
+                continue
+            try:
+                with zf.open(info, 'w') as dst:
+                    while True:
+                        chunk = reader.read(READ_CHUNK_SIZE)
+                        if not chunk:
+                            break
+                        dst.write(chunk)
+                        if sink.size >= FLUSH_SIZE:
+                            yield sink.drain()
+            finally:
+                for resource in resources:
+                    resource.close()
+            if sink.size >= FLUSH_SIZE:
+                yield sink.drain()
+    data = sink.drain()
+    if data:
+        yield data
+
+
+async def stream_zip(entries: Iterable[ZipEntry]):
+    """
+    在线程中驱动 iter_zip 的异步迭代器，可直接交给 StreamingResponse
+
+    客户端断开时 StreamingResponse 会取消迭代，这里负责关闭生成器和源文件
+    """
+    iterator = iter_zip(entries)
+    try:
+        while True:
+            chunk = await anyio.to_thread.run_sync(next, iterator, None)
+            if chunk is None:
+                break
+            yield chunk
+    finally:
+        iterator.close()